@@ -1,20 +1,154 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from typing import List, Dict
+from typing import List, Dict, Optional, Any
 import json
 
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8', extra='ignore')
 
-    GEMINI_SECURE_1PSID: str
-    GEMINI_SECURE_1PSIDTS: str
+    # Conta Gemini única (usada quando GEMINI_ACCOUNTS_JSON não é informado)
+    GEMINI_SECURE_1PSID: str = ""
+    GEMINI_SECURE_1PSIDTS: str = ""
+
+    # Pool de contas Gemini como string JSON:
+    # [{"name": "conta-a", "secure_1psid": "...", "secure_1psidts": "..."}, ...]
+    GEMINI_ACCOUNTS_JSON: str = "[]"
+    # Tempo (s) que uma conta fica fora do pool após UsageLimitExceeded/TemporarilyBlocked/AuthError
+    GEMINI_ACCOUNT_COOLDOWN_SECONDS: float = 300.0
+
+    # Supervisor dos clients: reinicializa clients parados e substitui os antigos em background
+    GEMINI_SUPERVISOR_ENABLED: bool = True
+    GEMINI_SUPERVISOR_INTERVAL_SECONDS: float = 30.0 # Intervalo entre as verificações
+    GEMINI_CLIENT_MAX_AGE_SECONDS: float = 3600.0 # Client mais velho que isso é trocado por um novo (0 desativa)
+    GEMINI_CLIENT_DRAIN_SECONDS: float = 300.0 # Espera máxima pelas requisições do client substituído antes de fechá-lo
+    GEMINI_COOKIE_STORE_PATH: str = "data/gemini_cookies.json" # __Secure-1PSIDTS rotacionados (vazio desativa)
+
+    # Backend do upstream: "webapi" (gemini-webapi, Gemini real) ou "fake" (gerador local para benchmarks)
+    GEMINI_BACKEND: str = "webapi"
+    FAKE_GEMINI_LATENCY_SECONDS: float = 0.2 # Espera até o primeiro token
+    FAKE_GEMINI_TOKENS_PER_SECOND: float = 200.0 # Ritmo de geração (0 gera tudo de uma vez)
+    FAKE_GEMINI_RESPONSE_TOKENS: int = 100 # Palavras por resposta
+    FAKE_GEMINI_TOKENS_PER_CHUNK: int = 4 # Palavras por parcial no streaming
+    FAKE_GEMINI_ERROR_RATE: float = 0.0 # Fração das chamadas que falham antes do primeiro token
+    FAKE_GEMINI_ERROR_TYPE: str = "APIError" # APIError, TimeoutError, UsageLimitExceeded, TemporarilyBlocked...
+    FAKE_GEMINI_STREAMING: bool = True # False simula uma gemini-webapi sem send_message_stream
+    FAKE_GEMINI_CANDIDATES: int = 1 # Candidatos (rascunhos) por resposta
+
+    # Recarga da configuração de roteamento e autenticação (API keys, mapa de modelos, modelo padrão,
+    # fallback e limites por key) quando o .env muda, sem reiniciar os workers
+    CONFIG_RELOAD_ENABLED: bool = True
+    CONFIG_RELOAD_INTERVAL_SECONDS: float = 2.0 # Intervalo entre as verificações do arquivo
+
+    # Desligamento gracioso (SIGTERM/deploys): novas requisições recebem 503 e as em andamento
+    # (inclusive streams) têm até SHUTDOWN_DRAIN_SECONDS para terminar antes de serem interrompidas
+    SHUTDOWN_DRAIN_SECONDS: float = 25.0
+    SHUTDOWN_STEP_TIMEOUT_SECONDS: float = 5.0 # Limite de cada etapa de fechamento (audit log, sessões, clients...)
+    SHUTDOWN_RETRY_AFTER_SECONDS: int = 1 # Valor do Retry-After nas respostas 503 durante a drenagem
 
     LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "text" # "text" (colorido, legível) ou "json" (um objeto JSON por linha)
     ALLOWED_API_KEYS: List[str] = []
 
     # Novas configurações para o modelo Gemini
     DEFAULT_GEMINI_MODEL_NAME: str = "unspecified" # Modelo Gemini padrão
     OPENAI_TO_GEMINI_MODEL_MAP_JSON: str = "{}" # Mapeamento como string JSON
 
+    # Contexto da conversa: "session" (ChatSession no Gemini por conversa; só a última mensagem
+    # é enviada) ou "stateless" (cada requisição envia o histórico `messages` inteiro numa
+    # conversa nova do Gemini, sem estado no proxy)
+    CONVERSATION_MODE: str = "session"
+
+    # Store de sessões de chat (uma ChatSession por conversa)
+    SESSION_STORE_MAX_ENTRIES: int = 1000 # Acima disso, a sessão usada há mais tempo é descartada (LRU)
+    SESSION_STORE_TTL_SECONDS: float = 3600.0 # Sessões inativas por mais tempo expiram (0 desativa)
+    # Sem X-Conversation-ID, identifica a conversa pelo hash do histórico já respondido
+    # (messages[:-1]) em vez da raiz (system prompt + primeira mensagem do usuário)
+    SESSION_FINGERPRINTING: bool = True
+    # Backend do metadata das sessões, compartilhado entre workers: "memory", "sqlite" ou "redis"
+    SESSION_BACKEND: str = "memory"
+    SESSION_SQLITE_PATH: str = "data/sessions.sqlite3"
+    SESSION_REDIS_URL: str = "redis://localhost:6379/0"
+    # Com SESSION_BACKEND=memory, o metadata é gravado neste arquivo no shutdown e relido no startup (vazio desativa)
+    SESSION_MEMORY_SNAPSHOT_PATH: str = "data/sessions_memory.json"
+
+    # Scheduler das chamadas ao upstream
+    SCHEDULER_MAX_CONCURRENT_PER_ACCOUNT: int = 4 # Chamadas simultâneas ao Gemini por conta
+    SCHEDULER_MAX_QUEUE_SIZE: int = 100 # Requisições aguardando; acima disso responde 429
+    SCHEDULER_MAX_WAIT_SECONDS: float = 30.0 # Espera máxima na fila antes de responder 429
+
+    # `n` > 1: as escolhas extras vêm dos candidatos da resposta e de chamadas adicionais ao upstream
+    # (cada uma ocupa um slot do scheduler; com streaming, n-1 chamadas junto com a principal)
+    CHAT_COMPLETION_MAX_CHOICES: int = 8 # Maior `n` aceito; acima disso responde 400
+
+    # Limites por API key (token buckets por minuto; 0 desativa) e prioridade no acesso ao upstream:
+    # `weight` é a fração dos slots que a key recebe quando as contas estão ocupadas (fair queueing)
+    # e `lane` é a fila ("interactive" ou "batch"; a batch só é atendida com a interactive vazia)
+    RATE_LIMIT_DEFAULT_REQUESTS_PER_MINUTE: int = 0
+    RATE_LIMIT_DEFAULT_TOKENS_PER_MINUTE: int = 0
+    RATE_LIMIT_DEFAULT_WEIGHT: float = 1.0
+    RATE_LIMIT_DEFAULT_LANE: str = "interactive"
+    # Valores por key como string JSON (campos omitidos usam os padrões acima):
+    # {"sk-abc": {"requests_per_minute": 60, "tokens_per_minute": 100000, "weight": 2, "lane": "interactive"}}
+    API_KEY_LIMITS_JSON: str = "{}"
+
+    # Novas tentativas em erros transitórios do upstream (antes do primeiro byte enviado ao cliente)
+    UPSTREAM_RETRY_MAX_ATTEMPTS: int = 3 # Total de tentativas, incluindo a primeira (1 desativa)
+    UPSTREAM_RETRY_BASE_DELAY_SECONDS: float = 0.5 # Backoff exponencial com jitter a partir deste valor
+    UPSTREAM_RETRY_MAX_DELAY_SECONDS: float = 8.0 # Teto de cada espera entre tentativas
+    UPSTREAM_RETRY_DEADLINE_SECONDS: float = 60.0 # Prazo total para as tentativas (0 desativa)
+    # Em ModelInvalid/UsageLimitExceeded, tenta os demais modelos do OPENAI_TO_GEMINI_MODEL_MAP
+    UPSTREAM_MODEL_FALLBACK_ENABLED: bool = False
+
+    # Anexos (partes `image_url`/`file` das mensagens), enviados ao Gemini como arquivos
+    ATTACHMENT_MAX_BYTES: int = 20 * 1024 * 1024 # Tamanho máximo de cada anexo (já decodificado)
+    ATTACHMENT_MAX_FILES: int = 10 # Anexos por requisição
+    ATTACHMENT_TEMP_DIR: str = "" # Onde os anexos decodificados ficam durante a requisição (vazio usa o temp do sistema)
+    ATTACHMENT_LOCAL_DIRS: List[str] = [] # Diretórios cujos arquivos podem ser referenciados por caminho (file://)
+    ATTACHMENT_ALLOW_REMOTE_URLS: bool = False # Baixa imagens de URLs http(s) informadas pelo cliente
+    ATTACHMENT_REMOTE_TIMEOUT_SECONDS: float = 30.0
+    # Imagens retornadas pelo Gemini: "markdown" (links ao fim do texto da resposta) ou "none"
+    RESPONSE_IMAGES_FORMAT: str = "markdown"
+
+    # Contagem de tokens do `usage`: "heuristic" (estimativa estilo BPE, sem dependências),
+    # "tiktoken" (exata no vocabulário da OpenAI; requer o pacote opcional) ou "whitespace" (palavras)
+    TOKEN_COUNTER: str = "heuristic"
+    TOKEN_COUNTER_ENCODING: str = "cl100k_base" # Encoding do tiktoken
+    TOKEN_COUNTER_CACHE_SIZE: int = 2048 # Contagens de prompts repetidos mantidas em cache (LRU)
+
+    # Granularidade dos eventos SSE: "upstream" (deltas como chegam; palavras no streaming sintético),
+    # "word", "chars" (STREAM_CHUNK_CHARS por evento) ou "sentence"
+    STREAM_CHUNK_GRANULARITY: str = "upstream"
+    STREAM_CHUNK_CHARS: int = 64
+    STREAM_FLUSH_INTERVAL_MS: float = 0.0 # > 0 agrupa os pedaços do streaming incremental por janela de tempo
+
+    # Cache de respostas para requisições sem estado (sem turnos anteriores do assistente)
+    RESPONSE_CACHE_ENABLED: bool = False
+    RESPONSE_CACHE_MAX_ENTRIES: int = 1000
+    RESPONSE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024 # Limite do cache em memória
+    RESPONSE_CACHE_TTL_SECONDS: float = 3600.0 # 0 desativa a expiração
+    RESPONSE_CACHE_DISK_PATH: str = "" # Ex.: "data/response_cache.sqlite3"; vazio mantém só em memória
+    RESPONSE_CACHE_DISK_MAX_ENTRIES: int = 100000
+
+    # Requisições sem estado idênticas e simultâneas compartilham uma única chamada ao upstream
+    SINGLE_FLIGHT_ENABLED: bool = True
+
+    # Batch API (/v1/files e /v1/batches), executada dentro do proxy
+    BATCH_STORAGE_DIR: str = "data/batches" # Arquivos enviados, resultados e checkpoint dos batches
+    BATCH_MAX_CONCURRENCY: int = 4 # Itens em execução simultânea (soma de todos os batches do processo)
+    BATCH_ITEM_MAX_ATTEMPTS: int = 5 # Tentativas por item em erros transitórios do upstream
+    BATCH_MAX_REQUESTS: int = 50000 # Requisições por batch
+    BATCH_MAX_FILE_BYTES: int = 200 * 1024 * 1024 # Tamanho máximo de um arquivo enviado
+
+    # Audit log dos payloads recebidos (JSONL, gravado em background)
+    AUDIT_LOG_ENABLED: bool = True
+    AUDIT_LOG_PATH: str = "logs/request_payloads.jsonl"
+    AUDIT_LOG_SAMPLE_RATE: float = 1.0 # Fração das requisições registradas (0.0 a 1.0)
+    AUDIT_LOG_QUEUE_SIZE: int = 10000 # Com a fila cheia, novos registros são descartados
+    AUDIT_LOG_BATCH_SIZE: int = 200
+    AUDIT_LOG_FLUSH_INTERVAL_SECONDS: float = 1.0
+    AUDIT_LOG_MAX_BYTES: int = 50 * 1024 * 1024 # Rotaciona ao atingir este tamanho (0 desativa)
+    AUDIT_LOG_ROTATE_SECONDS: float = 86400.0 # Rotaciona arquivos mais antigos que isso (0 desativa)
+    AUDIT_LOG_BACKUP_COUNT: int = 7 # Arquivos rotacionados mantidos (0 mantém todos)
+
     @property
     def OPENAI_TO_GEMINI_MODEL_MAP(self) -> Dict[str, str]:
         try:
@@ -24,4 +158,38 @@ class Settings(BaseSettings):
             print(f"AVISO: OPENAI_TO_GEMINI_MODEL_MAP_JSON ('{self.OPENAI_TO_GEMINI_MODEL_MAP_JSON}') não é um JSON válido. Usando mapa vazio.")
             return {}
 
+    @property
+    def API_KEY_LIMITS(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            limits = json.loads(self.API_KEY_LIMITS_JSON)
+        except json.JSONDecodeError:
+            print("AVISO: API_KEY_LIMITS_JSON não é um JSON válido. Usando os limites padrão para todas as keys.")
+            return {}
+        if not isinstance(limits, dict) or not all(isinstance(value, dict) for value in limits.values()):
+            print("AVISO: API_KEY_LIMITS_JSON deve ser um objeto JSON de objetos. Usando os limites padrão para todas as keys.")
+            return {}
+        return limits
+
+    @property
+    def GEMINI_ACCOUNTS(self) -> List[Dict[str, Optional[str]]]:
+        try:
+            accounts = json.loads(self.GEMINI_ACCOUNTS_JSON)
+        except json.JSONDecodeError:
+            print("AVISO: GEMINI_ACCOUNTS_JSON não é um JSON válido. Ignorando o pool de contas.")
+            accounts = []
+        if not isinstance(accounts, list):
+            print("AVISO: GEMINI_ACCOUNTS_JSON deve ser uma lista JSON. Ignorando o pool de contas.")
+            accounts = []
+
+        if not accounts and self.GEMINI_SECURE_1PSID:
+            accounts = [{
+                "name": "default",
+                "secure_1psid": self.GEMINI_SECURE_1PSID,
+                "secure_1psidts": self.GEMINI_SECURE_1PSIDTS,
+            }]
+        if not accounts and self.GEMINI_BACKEND.lower() == "fake":
+            # O backend falso não usa cookies: uma conta fictícia basta.
+            accounts = [{"name": "fake", "secure_1psid": "fake"}]
+        return accounts
+
 settings = Settings()
@@ -1,50 +1,67 @@
 # Em app/core/logging_config.py
 import sys
 import os
+import json
+import traceback
 from loguru import logger
 from app.core.config import settings
 
+# Template fixo: o Loguru o compila uma única vez e só substitui os campos de cada registro.
+# A mensagem entra como valor, então chaves ou "<tags>" no texto logado não são interpretadas.
+TEXT_LOG_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss.SSSSSSZZ}</green> | "
+    "<level>{level: <8}</level> | "
+    "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> | "
+    "REQ_ID: <yellow>{extra[request_id]}</yellow> | "
+    "<level>{message}</level>\n{exception}"
+)
+JSON_LOG_FORMAT = "{extra[_json]}\n"
+
 def robust_log_formatter(record: dict) -> str:
     """
-    Formata um registro de log do Loguru de forma robusta,
-    incluindo request_id se presente, ou "N/A" caso contrário.
-    Retorna a string de log final, pronta para ser emitida, com tags de formatação Loguru.
+    Formatador do modo texto. Garante o request_id ("N/A" fora de uma requisição) e devolve
+    sempre o mesmo template, que o Loguru preenche com os campos do registro.
     """
-    # Obtém o request_id do 'extra' do registro, com "N/A" como padrão.
-    request_id_val = record["extra"].get("request_id", "N/A")
-
-    # Constrói a string de formato que o Loguru irá processar internamente
-    # ao aplicar esta função como 'format'. Os placeholders {time}, {level.name},
-    # {name}, {function}, {line}, {message} são do Loguru.
-    # A f-string Python é usada aqui apenas para inserir o request_id_val de forma segura.
-    # As tags de cor como <green>, <level>, <cyan>, <yellow> são interpretadas pelo Loguru
-    # se colorize=True estiver ativo no handler.
+    record["extra"].setdefault("request_id", "N/A")
+    return TEXT_LOG_FORMAT
 
-    # O truque é que, quando 'format' é uma função, essa função deve retornar a string *final*.
-    # O Loguru então apenas a imprime. Se quisermos que o Loguru processe placeholders
-    # *depois* da nossa função, o 'format' deveria ser uma string.
-    # Vamos construir a string com os valores do record diretamente.
-
-    # Monta a string de log final com os valores do record
-    # e as tags de formatação do Loguru para cores.
-    log_parts = [
-        f"<green>{record['time']:%Y-%m-%d %H:%M:%S.%f%z}</green>", # Formatação de tempo explícita
-        f"<level>{record['level'].name: <8}</level>",
-        f"<cyan>{record['name']}</cyan>:<cyan>{record['function']}</cyan>:<cyan>{record['line']}</cyan>",
-        f"REQ_ID: <yellow>{request_id_val}</yellow>",
-        f"<level>{record['message']}</level>" # Mensagem do log
-    ]
-    return " | ".join(log_parts) + "\n" # Adiciona uma nova linha no final
+def json_log_formatter(record: dict) -> str:
+    """Formatador do modo JSON (LOG_FORMAT=json): um objeto por linha, pronto para coletores de log."""
+    extra = record["extra"]
+    entry = {
+        "time": record["time"].isoformat(),
+        "level": record["level"].name,
+        "logger": record["name"],
+        "function": record["function"],
+        "line": record["line"],
+        "request_id": extra.get("request_id"),
+        "message": record["message"],
+    }
+    for key, value in extra.items():
+        if key not in ("request_id", "_json"):
+            entry[key] = value
+    if record["exception"] is not None:
+        exception_type, exception_value, _ = record["exception"]
+        entry["exception"] = {
+            "type": exception_type.__name__ if exception_type else None,
+            "message": str(exception_value),
+            "traceback": "".join(traceback.format_exception(*record["exception"])),
+        }
+    extra["_json"] = json.dumps(entry, ensure_ascii=False, default=str)
+    return JSON_LOG_FORMAT
 
 def setup_logging():
     """Configura os handlers do Loguru para a aplicação."""
     logger.remove() # Remove handlers padrão ou configurados anteriormente.
 
+    json_mode = settings.LOG_FORMAT.lower() == "json"
+    log_formatter = json_log_formatter if json_mode else robust_log_formatter
+
     logger.add(
         sys.stderr,
-        format=robust_log_formatter, # Passa a FUNÇÃO como formatador
+        format=log_formatter, # Passa a FUNÇÃO como formatador
         level=settings.LOG_LEVEL.upper(),
-        colorize=True, # Loguru tentará aplicar cores às tags na string retornada
+        colorize=not json_mode, # Loguru aplica cores às tags do template de texto
         enqueue=True,
         diagnose=False
     )
@@ -58,7 +75,7 @@ def setup_logging():
             retention="7 days",
             compression="zip",
             level=settings.LOG_LEVEL.upper(),
-            format=robust_log_formatter, # Passa a FUNÇÃO como formatador
+            format=log_formatter, # Passa a FUNÇÃO como formatador
             enqueue=True,
             # Para arquivos de log, colorize=False é geralmente preferido
             # para evitar códigos de escape de cor nos arquivos.
@@ -67,7 +84,7 @@ def setup_logging():
     except Exception as e:
         print(f"[CRITICAL LOGGING SETUP ERROR] Failed to configure file logging for '{log_file_path}': {e}", file=sys.stderr)
 
-    logger.info("Configuração de logging aplicada (usando formatador de função).")
+    logger.info("Configuração de logging aplicada (formato: {}).", "json" if json_mode else "texto")
 
 # Chama a configuração de logging quando este módulo é importado.
 setup_logging()
\ No newline at end of file
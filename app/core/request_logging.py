@@ -0,0 +1,68 @@
+import time
+import uuid
+
+from loguru import logger
+
+REQUEST_ID_HEADER = b"x-request-id"
+
+
+def _header_value(headers, name: bytes):
+    for key, value in headers:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+class RequestLoggingMiddleware:
+    """
+    Middleware ASGI puro de log das requisições: registra a chegada e o envio dos headers da
+    resposta e acrescenta o `X-Request-ID`, com o request_id no contexto de todos os logs
+    emitidos durante a requisição.
+
+    Ao contrário de `@app.middleware("http")` (BaseHTTPMiddleware), não monta objetos Request e
+    Response nem repassa o corpo por um stream intermediário: as mensagens ASGI seguem direto
+    para o servidor, e o streaming SSE não ganha nenhuma task ou fila a mais.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = _header_value(scope["headers"], REQUEST_ID_HEADER) or str(uuid.uuid4())
+        method = scope["method"]
+        path = scope["path"]
+        start_time = time.perf_counter()
+
+        async def send_with_request_id(message) -> None:
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", ()))
+                headers.append((REQUEST_ID_HEADER, request_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+                # Sem Content-Length, o corpo vem em partes (StreamingResponse).
+                streaming = _header_value(headers, b"content-length") is None
+                logger.info(
+                    "Resposta enviada: {} para {} {}{} (Tempo: {:.2f}ms)",
+                    message["status"], method, path, " (Streaming)" if streaming else "",
+                    (time.perf_counter() - start_time) * 1000,
+                )
+            await send(message)
+
+        with logger.contextualize(request_id=request_id):
+            client = scope.get("client")
+            logger.info("Requisição recebida: {} {} (Cliente: {})", method, path, client[0] if client else "N/A")
+            logger.opt(lazy=True).debug(
+                "Headers da requisição: {}",
+                lambda: {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]},
+            )
+            try:
+                await self.app(scope, receive, send_with_request_id)
+            except Exception:
+                logger.error(
+                    "Erro durante o processamento da requisição {} {} (Tempo: {:.2f}ms). Exceção será propagada.",
+                    method, path, (time.perf_counter() - start_time) * 1000,
+                )
+                raise
@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
-import app.core.logging_config
+from app.core import logging_config  # noqa: F401  (configura o loguru ao importar)
+from app.core.request_logging import RequestLoggingMiddleware
 from loguru import logger
+import asyncio
 import uuid
-import time
-from fastapi import FastAPI, HTTPException, Request, Response, Depends, status
-from fastapi.responses import StreamingResponse, JSONResponse
+from contextlib import AsyncExitStack, asynccontextmanager
+from functools import partial
+from typing import Optional, Sequence
+from fastapi import FastAPI, HTTPException, Request, Response, Depends, status, UploadFile, File, Form
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
 from fastapi.security import APIKeyHeader
 from httpx import ReadTimeout as HttpxReadTimeout
-from app.models.openai_schemas import ModelCard, ModelListResponse # Mantida a importação que você adicionou
+from app.models.openai_schemas import ModelListResponse
 
 
 # Importações do projeto
@@ -17,17 +21,57 @@ from app.models.openai_schemas import (
     ChatCompletionResponse,
     OpenAIErrorResponse,
     OpenAIErrorDetail,
-) # Nota: ModelCard e ModelListResponse já estavam importados acima, o Pydantic schemas foram agrupados.
-  # Vou manter sua estrutura de importação para minimizar alterações não solicitadas.
-from app.services.gemini_service import gemini_service_instance
+    FileObject,
+    BatchCreateRequest,
+    BatchObject,
+    BatchListResponse,
+)
+from app.services.gemini_service import gemini_service_instance, NoAvailableAccountError
+from app.services.runtime_config import runtime_config_instance
+from app.services.client_supervisor import client_supervisor_instance
+from app.services.attachments import (
+    attachment_store_instance, attachment_parts, output_text, redact_inline_attachments, AttachmentError,
+)
+from app.services.audit_log import audit_log_instance
+from app.services.response_cache import (
+    response_cache_instance,
+    is_cacheable_request,
+    cache_bypass_mode,
+    build_cache_key,
+    CACHE_STATUS_HEADER,
+)
+from app.services.metrics import metrics_registry, RequestTimer, record_error, PROMETHEUS_CONTENT_TYPE
+from app.services.retry import create_upstream_retry
+from app.services.single_flight import single_flight_instance, Flight, COALESCED_HEADER
+from app.services.history_renderer import render_messages
+from app.services.batch_runner import batch_runner_instance, owner_for_api_key
+from app.services.scheduler import (
+    upstream_scheduler_instance,
+    release_after_stream,
+    SchedulerQueueFullError,
+)
+from app.services.rate_limiter import rate_limiter_instance, RateLimitExceededError
+from app.services.disconnect import cancel_on_disconnect, ClientDisconnectedError, CLIENT_CLOSED_REQUEST
+from app.services.lifecycle import shutdown_coordinator_instance, DrainMiddleware
+from app.services.choice_fanout import ChoiceFanOut, extra_candidate_texts
+from app.services.session_store import (
+    SessionStore,
+    session_store_instance,
+    derive_conversation_key,
+    starts_new_conversation,
+    derive_reply_conversation_key,
+    CONVERSATION_ID_HEADER,
+)
 from app.utils.openai_formatter import (
     format_to_openai_response,
     generate_openai_streaming_chunks,
+    generate_openai_streaming_chunks_from_deltas,
 )
+from app.utils.token_counter import count_message_tokens
+from app.utils.completion_limits import truncate_completion
 
 # Importações da gemini-webapi
 from gemini_webapi import ChatSession
-from gemini_webapi.constants import Model # Corrigido na interação anterior
 from gemini_webapi.exceptions import (
     AuthError as GeminiAuthError,
     APIError as GeminiAPIError,
@@ -38,13 +82,54 @@ from gemini_webapi.exceptions import (
     TimeoutError as GeminiTimeoutError,
 )
 
-# Dicionário para armazenar sessões de chat ativas, mapeando API Key para ChatSession
-active_chat_sessions: dict[str, ChatSession] = {}
+# Sessões de chat ativas, uma ChatSession por conversa (limitado por LRU/TTL)
+active_chat_sessions: SessionStore = session_store_instance
+
+metrics_registry.gauge(
+    "proxy_session_store_entries",
+    "ChatSessions ativas no session store deste processo.",
+    lambda: len(active_chat_sessions),
+)
+
+# --- Startup e Shutdown ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("Aplicação iniciando...")
+    audit_log_instance.start()
+    client_supervisor_instance.apply_persisted_cookies()
+    try:
+        await gemini_service_instance.warm_up()
+        logger.info("Verificação inicial dos clientes Gemini concluída ({} conta(s) no pool).", len(gemini_service_instance.accounts))
+    except Exception as e:
+        logger.critical("Falha ao inicializar os clientes Gemini durante o startup: {}", e)
+    # Mesmo com falha no startup: o supervisor segue tentando inicializar as contas em background.
+    client_supervisor_instance.start()
+    runtime_config_instance.start()
+    batch_runner_instance.resume_pending()
+    shutdown_coordinator_instance.install_signal_handlers()
+    try:
+        yield
+    finally:
+        logger.info("Aplicação finalizando...")
+        coordinator = shutdown_coordinator_instance
+        # Primeiro termina o trabalho em andamento; depois grava o estado pendente e fecha os clients.
+        await coordinator.drain()
+        await coordinator.run_step("config", runtime_config_instance.stop)
+        await coordinator.run_step("batches", batch_runner_instance.close) # O checkpoint permite retomá-los
+        await coordinator.run_step("supervisor", client_supervisor_instance.stop) # Grava os cookies rotacionados
+        await coordinator.run_step("audit_log", audit_log_instance.stop)
+        await coordinator.run_step("sessions", active_chat_sessions.close)
+        await coordinator.run_step("response_cache", response_cache_instance.close)
+        await coordinator.run_step("gemini_clients", gemini_service_instance.close)
+        coordinator.restore_signal_handlers()
+        logger.info("Shutdown concluído.")
+        await logger.complete() # Esvazia a fila dos sinks com enqueue=True
 
 app = FastAPI(
     title="Gemini OpenAI-Compatible Proxy",
     version="0.1.0",
     description="Proxy para API Gemini com endpoints compatíveis com OpenAI /v1/chat/completions.",
+    lifespan=lifespan,
 )
 
 # Esquema de segurança para o header de autorização
@@ -68,7 +153,7 @@ async def get_api_key(api_key_value: str = Depends(api_key_header_auth)) -> str:
 
     parts = api_key_value.split()
     if len(parts) != 2 or parts[0].lower() != "bearer":
-        logger.warning(f"Formato inválido do Authorization header: {api_key_value}")
+        logger.warning("Formato inválido do Authorization header: {}", api_key_value)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=OpenAIErrorResponse(
@@ -82,8 +167,8 @@ async def get_api_key(api_key_value: str = Depends(api_key_header_auth)) -> str:
         )
 
     token = parts[1]
-    if token not in settings.ALLOWED_API_KEYS:
-        logger.warning(f"Token de API não autorizado: {token}")
+    if not runtime_config_instance.current.is_allowed_api_key(token):
+        logger.warning("Token de API não autorizado: {}", token)
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail=OpenAIErrorResponse(
@@ -94,14 +179,19 @@ async def get_api_key(api_key_value: str = Depends(api_key_header_auth)) -> str:
                 )
             ).model_dump(),
         )
-    logger.info(f"Token de API validado com sucesso para: ...{token[-4:]}")
+    logger.info("Token de API validado com sucesso para: ...{}", token[-4:])
     return token
 
 # --- Manipuladores de Exceção Globais ---
+def count_handled_error(request: Request, exc: Exception) -> None:
+    """Contabiliza o erro em /metrics, com o modelo Gemini da requisição quando já resolvido."""
+    record_error(exc, getattr(request.state, "gemini_model", None))
+
 # (Handlers de exceção permanecem os mesmos que você já tinha)
 @app.exception_handler(GeminiAuthError)
 async def gemini_auth_exception_handler(request: Request, exc: GeminiAuthError):
-    logger.error(f"Erro de autenticação com Gemini: {exc} na rota {request.url.path}")
+    logger.error("Erro de autenticação com Gemini: {} na rota {}", exc, request.url.path)
+    count_handled_error(request, exc)
     return JSONResponse(
         status_code=401,
         content=OpenAIErrorResponse(
@@ -115,7 +205,8 @@ async def gemini_auth_exception_handler(request: Request, exc: GeminiAuthError):
 
 @app.exception_handler(GeminiUsageLimitExceeded)
 async def gemini_usage_limit_exception_handler(request: Request, exc: GeminiUsageLimitExceeded):
-    logger.warning(f"Limite de uso do Gemini excedido: {exc} na rota {request.url.path}")
+    logger.warning("Limite de uso do Gemini excedido: {} na rota {}", exc, request.url.path)
+    count_handled_error(request, exc)
     return JSONResponse(
         status_code=429,
         content=OpenAIErrorResponse(
@@ -129,7 +220,8 @@ async def gemini_usage_limit_exception_handler(request: Request, exc: GeminiUsag
 
 @app.exception_handler(GeminiModelInvalid)
 async def gemini_model_invalid_exception_handler(request: Request, exc: GeminiModelInvalid):
-    logger.warning(f"Modelo Gemini inválido: {exc} na rota {request.url.path}")
+    logger.warning("Modelo Gemini inválido: {} na rota {}", exc, request.url.path)
+    count_handled_error(request, exc)
     return JSONResponse(
         status_code=400,
         content=OpenAIErrorResponse(
@@ -144,7 +236,8 @@ async def gemini_model_invalid_exception_handler(request: Request, exc: GeminiMo
 
 @app.exception_handler(GeminiTemporarilyBlocked)
 async def gemini_temporarily_blocked_exception_handler(request: Request, exc: GeminiTemporarilyBlocked):
-    logger.warning(f"Acesso ao Gemini temporariamente bloqueado: {exc} na rota {request.url.path}")
+    logger.warning("Acesso ao Gemini temporariamente bloqueado: {} na rota {}", exc, request.url.path)
+    count_handled_error(request, exc)
     return JSONResponse(
         status_code=429,
         content=OpenAIErrorResponse(
@@ -156,9 +249,83 @@ async def gemini_temporarily_blocked_exception_handler(request: Request, exc: Ge
         ).model_dump()
     )
 
+@app.exception_handler(NoAvailableAccountError)
+async def no_available_account_exception_handler(request: Request, exc: NoAvailableAccountError):
+    logger.warning("Nenhuma conta Gemini disponível no pool: {} na rota {}", exc, request.url.path)
+    count_handled_error(request, exc)
+    return JSONResponse(
+        status_code=429,
+        content=OpenAIErrorResponse(
+            error=OpenAIErrorDetail(
+                message=f"No Gemini account is currently available, please retry later: {str(exc)}",
+                type="rate_limit_exceeded",
+                code="gemini_accounts_exhausted"
+            )
+        ).model_dump(),
+        headers={"Retry-After": str(int(exc.retry_after + 0.5))},
+    )
+
+@app.exception_handler(SchedulerQueueFullError)
+async def scheduler_queue_full_exception_handler(request: Request, exc: SchedulerQueueFullError):
+    logger.warning("Fila de espera pelo upstream cheia: {} na rota {}", exc, request.url.path)
+    count_handled_error(request, exc)
+    return JSONResponse(
+        status_code=429,
+        content=OpenAIErrorResponse(
+            error=OpenAIErrorDetail(
+                message=f"The proxy is at capacity, please retry later: {str(exc)}",
+                type="rate_limit_exceeded",
+                code="proxy_queue_full"
+            )
+        ).model_dump(),
+        headers={"Retry-After": str(int(exc.retry_after + 0.5))},
+    )
+
+@app.exception_handler(RateLimitExceededError)
+async def rate_limit_exceeded_exception_handler(request: Request, exc: RateLimitExceededError):
+    logger.warning("Limite da API key atingido ({}): {} na rota {}", exc.limit, exc, request.url.path)
+    count_handled_error(request, exc)
+    return JSONResponse(
+        status_code=429,
+        content=OpenAIErrorResponse(
+            error=OpenAIErrorDetail(
+                message=f"{str(exc)} Please retry later.",
+                type="rate_limit_exceeded",
+                code=f"rate_limit_{exc.limit}"
+            )
+        ).model_dump(),
+        headers={**exc.headers, "Retry-After": str(max(1, int(exc.retry_after + 0.5)))},
+    )
+
+@app.exception_handler(ClientDisconnectedError)
+async def client_disconnected_exception_handler(request: Request, exc: ClientDisconnectedError):
+    # Não é um erro do proxy nem do upstream: só registra o cancelamento. A resposta não chega a ninguém.
+    request_timer = getattr(request.state, "request_timer", None)
+    if request_timer is not None:
+        request_timer.client_disconnected()
+    logger.info("Cliente desconectou antes da resposta; chamada ao upstream cancelada e recursos liberados (rota {}).", request.url.path)
+    return Response(status_code=CLIENT_CLOSED_REQUEST)
+
+@app.exception_handler(AttachmentError)
+async def attachment_exception_handler(request: Request, exc: AttachmentError):
+    logger.warning("Anexo recusado: {} na rota {}", exc, request.url.path)
+    count_handled_error(request, exc)
+    return JSONResponse(
+        status_code=400,
+        content=OpenAIErrorResponse(
+            error=OpenAIErrorDetail(
+                message=str(exc),
+                type="invalid_request_error",
+                param="messages",
+                code="invalid_attachment"
+            )
+        ).model_dump()
+    )
+
 @app.exception_handler(GeminiTimeoutError)
 async def gemini_timeout_exception_handler(request: Request, exc: GeminiTimeoutError):
-    logger.error(f"Timeout (Gemini lib) na comunicação com Gemini: {exc} na rota {request.url.path}")
+    logger.error("Timeout (Gemini lib) na comunicação com Gemini: {} na rota {}", exc, request.url.path)
+    count_handled_error(request, exc)
     return JSONResponse(
         status_code=504,
         content=OpenAIErrorResponse(
@@ -172,7 +339,8 @@ async def gemini_timeout_exception_handler(request: Request, exc: GeminiTimeoutE
 
 @app.exception_handler(HttpxReadTimeout)
 async def httpx_read_timeout_exception_handler(request: Request, exc: HttpxReadTimeout):
-    logger.error(f"Timeout (httpx) na comunicação: {exc} na rota {request.url.path}")
+    logger.error("Timeout (httpx) na comunicação: {} na rota {}", exc, request.url.path)
+    count_handled_error(request, exc)
     return JSONResponse(
         status_code=504,
         content=OpenAIErrorResponse(
@@ -187,7 +355,8 @@ async def httpx_read_timeout_exception_handler(request: Request, exc: HttpxReadT
 
 @app.exception_handler(GeminiAPIError)
 async def gemini_api_error_exception_handler(request: Request, exc: GeminiAPIError):
-    logger.error(f"Erro da API Gemini (biblioteca): {exc} na rota {request.url.path}")
+    logger.error("Erro da API Gemini (biblioteca): {} na rota {}", exc, request.url.path)
+    count_handled_error(request, exc)
     return JSONResponse(
         status_code=502,
         content=OpenAIErrorResponse(
@@ -201,7 +370,8 @@ async def gemini_api_error_exception_handler(request: Request, exc: GeminiAPIErr
 
 @app.exception_handler(GeminiError)
 async def gemini_generic_error_exception_handler(request: Request, exc: GeminiError):
-    logger.error(f"Erro genérico do Gemini: {exc} na rota {request.url.path}")
+    logger.error("Erro genérico do Gemini: {} na rota {}", exc, request.url.path)
+    count_handled_error(request, exc)
     return JSONResponse(
         status_code=500,
         content=OpenAIErrorResponse(
@@ -218,7 +388,8 @@ async def gemini_generic_error_exception_handler(request: Request, exc: GeminiEr
 async def generic_exception_handler(request: Request, exc: Exception):
     if isinstance(exc, HTTPException):
         raise exc
-    logger.exception(f"Erro interno não tratado: {exc} na rota {request.url.path}")
+    logger.exception("Erro interno não tratado: {} na rota {}", exc, request.url.path)
+    count_handled_error(request, exc)
     return JSONResponse(
         status_code=500,
         content=OpenAIErrorResponse(
@@ -231,69 +402,37 @@ async def generic_exception_handler(request: Request, exc: Exception):
     )
 
 # --- Middleware ---
-@app.middleware("http")
-async def log_requests_responses(request: Request, call_next):
-    request_id = request.headers.get("X-Request-ID") or str(uuid.uuid4())
-
-    with logger.contextualize(request_id=request_id):
-        logger.info(f"Requisição recebida: {request.method} {request.url.path} (Cliente: {request.client.host if request.client else 'N/A'})")
-        if settings.LOG_LEVEL.upper() == "DEBUG":
-            try:
-                logger.debug(f"Headers da requisição: {dict(request.headers)}")
-            except Exception as e:
-                logger.warning(f"Não foi possível logar headers da requisição: {e}")
-
-        start_time = time.time()
-        response_sent = False
-        try:
-            response = await call_next(request)
-            response_sent = True
-        except Exception as e:
-            process_time = (time.time() - start_time) * 1000
-            logger.error(
-                f"Erro durante o processamento da requisição {request.method} {request.url.path} "
-                f"(Tempo: {process_time:.2f}ms). Exceção será propagada."
-            )
-            raise
-
-        process_time = (time.time() - start_time) * 1000
-
-        if response_sent:
-            status_code = response.status_code
-            current_response_headers = {}
-            if hasattr(response, "headers") and isinstance(response.headers, dict):
-                current_response_headers = response.headers
-            elif isinstance(response, Response):
-                current_response_headers = response.headers
-
-            current_response_headers["X-Request-ID"] = request_id
-
-            log_message_suffix = f"(Tempo: {process_time:.2f}ms)"
-            if isinstance(response, StreamingResponse):
-                logger.info(f"Resposta enviada: {status_code} para {request.method} {request.url.path} (Streaming) {log_message_suffix}")
-            else:
-                logger.info(f"Resposta enviada: {status_code} para {request.method} {request.url.path} {log_message_suffix}")
-        return response
-
-# --- Evento de Startup ---
-@app.on_event("startup")
-async def startup_event():
-    logger.info("Aplicação iniciando...")
-    try:
-        await gemini_service_instance.get_client()
-        logger.info("Verificação inicial do cliente Gemini concluída.")
-    except Exception as e:
-        logger.critical(f"Falha ao inicializar o cliente Gemini durante o startup: {e}")
+app.add_middleware(DrainMiddleware, coordinator=shutdown_coordinator_instance)
+app.add_middleware(RequestLoggingMiddleware)
 
 # --- Endpoints ---
 @app.get("/health", summary="Verifica a saúde da aplicação", tags=["Health"])
 async def health_check():
     logger.info("Health check solicitado.")
-    return {"status": "ok"}
+    health = {
+        "status": "draining" if shutdown_coordinator_instance.draining else "ok",
+        "shutdown": shutdown_coordinator_instance.stats(),
+        "config": runtime_config_instance.stats(),
+        "gemini_clients": client_supervisor_instance.stats(),
+        "sessions": active_chat_sessions.stats(),
+        "response_cache": response_cache_instance.stats(),
+        "single_flight": single_flight_instance.stats(),
+        "batches": batch_runner_instance.stats(),
+        "attachments": attachment_store_instance.stats(),
+        "rate_limits": rate_limiter_instance.stats(),
+    }
+    if shutdown_coordinator_instance.draining:
+        # 503 tira a réplica do balanceador enquanto as requisições em andamento terminam.
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=health)
+    return health
+
+@app.get("/metrics", summary="Métricas no formato Prometheus", tags=["Health"])
+async def metrics():
+    return Response(content=metrics_registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
 
 @app.get("/dashboard/billing/usage", include_in_schema=False, tags=["Mock Endpoints"])
 async def mock_billing_usage(start_date: str, end_date: str):
-    logger.info(f"Recebida requisição mock para /dashboard/billing/usage?start_date={start_date}&end_date={end_date}")
+    logger.info("Recebida requisição mock para /dashboard/billing/usage?start_date={}&end_date={}", start_date, end_date)
     return {
         "object": "list",
         "daily_costs": [],
@@ -305,25 +444,105 @@ async def mock_billing_usage(start_date: str, end_date: str):
          summary="Lista os modelos atualmente disponíveis.",
          tags=["Models"])
 async def list_models():
-    model_data = []
-    created_timestamp = int(time.time())
-
-    if settings.OPENAI_TO_GEMINI_MODEL_MAP:
-        for openai_model_name in settings.OPENAI_TO_GEMINI_MODEL_MAP.keys():
-            if not any(m.id == openai_model_name for m in model_data):
-                model_data.append(ModelCard(
-                    id=openai_model_name,
-                    created=created_timestamp,
-                    owned_by="proxy-engine"
-                ))
-
-    if not settings.OPENAI_TO_GEMINI_MODEL_MAP and settings.DEFAULT_GEMINI_MODEL_NAME != "unspecified":
-        generic_default_id = "gpt-3.5-turbo"
-        if not any(m.id == generic_default_id for m in model_data):
-             model_data.append(ModelCard(id=generic_default_id, created=created_timestamp, owned_by="proxy-engine"))
-
-    logger.info(f"Listando modelos: {[model.id for model in model_data]}")
-    return ModelListResponse(data=model_data)
+    # Montada e serializada uma vez por versão da configuração.
+    config_snapshot = runtime_config_instance.current
+    logger.info("Listando modelos (configuração versão {}): {}", config_snapshot.version, list(config_snapshot.model_map))
+    return Response(content=config_snapshot.models_response_body, media_type="application/json")
+
+def stream_usage_prompt_tokens(request_payload: ChatCompletionRequest) -> Optional[int]:
+    """Tokens do prompt para o chunk de `usage`, só quando o cliente pede `stream_options.include_usage`."""
+    if request_payload.stream_options and request_payload.stream_options.include_usage:
+        return count_message_tokens(request_payload.messages)
+    return None
+
+def build_full_text_response(
+    request_payload: ChatCompletionRequest,
+    gemini_response_text: str,
+    prompt_text: str,
+    response_chat_id: str,
+    http_response: Response,
+    response_headers: dict[str, str],
+    request_timer: RequestTimer,
+    extra_choice_texts: Sequence[str] = (),
+):
+    """Monta a resposta (JSON ou streaming sintético) a partir de um texto já completo (e das demais escolhas, com n > 1)."""
+    if request_payload.stream:
+        # Fallback: a resposta completa (upstream sem streaming ou vinda do cache)
+        # é fatiada artificialmente.
+        logger.info("Iniciando streaming sintético de resposta completa.")
+        return StreamingResponse(
+            request_timer.wrap_chunks(
+                generate_openai_streaming_chunks(
+                    gemini_response_text=gemini_response_text,
+                    model_name=request_payload.model,
+                    original_request_id=response_chat_id,
+                    usage_prompt_tokens=stream_usage_prompt_tokens(request_payload),
+                    stop=request_payload.stop,
+                    max_tokens=request_payload.max_tokens,
+                    extra_choice_texts=extra_choice_texts,
+                ),
+                mode="synthetic_stream",
+            ),
+            media_type="text/event-stream",
+            headers=response_headers,
+        )
+    else:
+        logger.info("Formatando resposta não-streaming.")
+        with request_timer.serialization(mode="json"):
+            openai_response = format_to_openai_response(
+                prompt_text=prompt_text,
+                gemini_response_text=gemini_response_text,
+                model_name=request_payload.model,
+                original_request_id=response_chat_id,
+                prompt_tokens=count_message_tokens(request_payload.messages),
+                stop=request_payload.stop,
+                max_tokens=request_payload.max_tokens,
+                extra_choice_texts=extra_choice_texts,
+            )
+        http_response.headers.update(response_headers)
+        logger.opt(lazy=True).debug("Resposta OpenAI formatada: {}", lambda: openai_response.model_dump_json(indent=2, exclude_none=True))
+        return openai_response
+
+async def build_flight_follower_response(
+    flight: Flight,
+    request_payload: ChatCompletionRequest,
+    prompt_text: str,
+    http_response: Response,
+    response_headers: dict[str, str],
+    request_timer: RequestTimer,
+):
+    """Responde a partir de uma chamada idêntica em andamento, com um id de completion próprio."""
+    response_chat_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    if request_payload.stream:
+        # Falhas antes do primeiro chunk são lançadas aqui e tratadas pelos exception handlers.
+        try:
+            await flight.wait_started()
+        except BaseException:
+            flight.leave() # Inclusive desconexão do cliente: o stream nunca será lido
+            raise
+        return StreamingResponse(
+            request_timer.wrap_chunks(
+                generate_openai_streaming_chunks_from_deltas(
+                    text_deltas=request_timer.measure_wait(flight.subscribe()),
+                    model_name=request_payload.model,
+                    original_request_id=response_chat_id,
+                    usage_prompt_tokens=stream_usage_prompt_tokens(request_payload),
+                    stop=request_payload.stop,
+                    max_tokens=request_payload.max_tokens,
+                )
+            ),
+            media_type="text/event-stream",
+            headers=response_headers,
+        )
+    return build_full_text_response(
+        request_payload=request_payload,
+        gemini_response_text=await flight.text(),
+        prompt_text=prompt_text,
+        response_chat_id=response_chat_id,
+        http_response=http_response,
+        response_headers=response_headers,
+        request_timer=request_timer,
+    )
 
 @app.post("/v1/chat/completions",
         summary="Gera uma resposta de chat completion",
@@ -332,6 +551,7 @@ async def list_models():
             400: {"model": OpenAIErrorResponse},
             401: {"model": OpenAIErrorResponse},
             403: {"model": OpenAIErrorResponse},
+            429: {"model": OpenAIErrorResponse},
             500: {"model": OpenAIErrorResponse},
             502: {"model": OpenAIErrorResponse},
             504: {"model": OpenAIErrorResponse},
@@ -340,13 +560,36 @@ async def list_models():
 async def chat_completions(
     request_payload: ChatCompletionRequest,
     http_request_object: Request, # Renomeado para evitar conflito com 'request' dos handlers
+    http_response: Response,
     api_key_token: str = Depends(get_api_key)
 ):
-    with open("request_payloads.log", "a", encoding="utf-8") as log_file:
-        log_file.write(request_payload.model_dump_json(indent=2, exclude_none=True) + "\n")
+    # Se o cliente desconectar antes da resposta começar, a espera na fila e a chamada ao Gemini
+    # são canceladas, liberando turno, conta e slot. Depois disso, o próprio StreamingResponse
+    # cancela o stream na desconexão.
+    return await cancel_on_disconnect(
+        http_request_object,
+        generate_chat_completion(request_payload, http_request_object, http_response, api_key_token),
+        keep_running=partial(has_flight_followers, http_request_object),
+    )
+
+def has_flight_followers(http_request_object: Request) -> bool:
+    """Requisições idênticas aguardam o resultado desta: a chamada ao upstream não deve ser cancelada."""
+    flight = getattr(http_request_object.state, "flight", None)
+    return flight is not None and flight.has_other_listeners
+
+async def generate_chat_completion(
+    request_payload: ChatCompletionRequest,
+    http_request_object: Request,
+    http_response: Response,
+    api_key_token: str,
+):
+    # Anexos em base64 (até vários MB cada) não ficam na fila da auditoria nem vão para o log.
+    audit_log_instance.record(request_payload, redact=redact_inline_attachments)
 
-    if settings.LOG_LEVEL.upper() == "DEBUG":
-        logger.debug(f"Payload da requisição: {request_payload.model_dump_json(indent=2, exclude_none=True)}")
+    logger.opt(lazy=True).debug(
+        "Payload da requisição: {}",
+        lambda: redact_inline_attachments(request_payload).model_dump_json(indent=2, exclude_none=True),
+    )
 
     if not request_payload.messages:
         logger.warning("Requisição sem mensagens.")
@@ -359,57 +602,53 @@ async def chat_completions(
             )
         ).model_dump())
 
-    chat_session: ChatSession
-    gemini_client_instance = await gemini_service_instance.get_client()
+    choice_count = request_payload.n or 1
+    if choice_count > settings.CHAT_COMPLETION_MAX_CHOICES:
+        logger.warning("Requisição com n={} acima do limite {}.", choice_count, settings.CHAT_COMPLETION_MAX_CHOICES)
+        raise HTTPException(status_code=400, detail=OpenAIErrorResponse(
+            error=OpenAIErrorDetail(
+                message=f"n must be at most {settings.CHAT_COMPLETION_MAX_CHOICES}.",
+                type="invalid_request_error",
+                param="n",
+                code="invalid_value"
+            )
+        ).model_dump())
 
+    # A requisição usa uma única versão da configuração do início ao fim, mesmo com uma recarga no meio.
+    config_snapshot = runtime_config_instance.current
     requested_openai_model = request_payload.model
-    gemini_model_name_to_use = settings.DEFAULT_GEMINI_MODEL_NAME
+    gemini_model_name_to_use = config_snapshot.gemini_model_name(requested_openai_model)
 
-    if requested_openai_model in settings.OPENAI_TO_GEMINI_MODEL_MAP:
-        gemini_model_name_to_use = settings.OPENAI_TO_GEMINI_MODEL_MAP[requested_openai_model]
-        logger.info(f"Modelo OpenAI '{requested_openai_model}' mapeado para modelo Gemini '{gemini_model_name_to_use}'.")
+    if requested_openai_model in config_snapshot.model_map:
+        logger.info("Modelo OpenAI '{}' mapeado para modelo Gemini '{}'.", requested_openai_model, gemini_model_name_to_use)
     else:
-        logger.info(f"Modelo OpenAI '{requested_openai_model}' não encontrado no mapa. Usando modelo Gemini padrão: '{gemini_model_name_to_use}'.")
+        logger.info("Modelo OpenAI '{}' não encontrado no mapa. Usando modelo Gemini padrão: '{}'.", requested_openai_model, gemini_model_name_to_use)
 
-    try:
-        internal_gemini_model_enum = Model.from_name(gemini_model_name_to_use)
-    except ValueError as e:
-        logger.warning(f"Nome do modelo Gemini configurado ('{gemini_model_name_to_use}') é inválido: {e}. Usando 'unspecified' como fallback.")
-        internal_gemini_model_enum = Model.UNSPECIFIED
-
-    # >>> INÍCIO DA LÓGICA DO SYSTEM PROMPT <<<
-    is_new_session_instance = False
-    if api_key_token not in active_chat_sessions:
-        is_new_session_instance = True
-        logger.info(f"Criando nova ChatSession para API Key: ...{api_key_token[-4:]} usando modelo Gemini interno: {internal_gemini_model_enum.name}")
-        chat_session = gemini_client_instance.start_chat(model=internal_gemini_model_enum)
-        active_chat_sessions[api_key_token] = chat_session
-    else:
-        chat_session = active_chat_sessions[api_key_token]
-        if chat_session.geminiclient != gemini_client_instance or chat_session.model != internal_gemini_model_enum:
-            is_new_session_instance = True # Tratar como nova instância para o system prompt
-            logger.warning(
-                f"Recriando ChatSession para API Key ...{api_key_token[-4:]}. "
-                f"Motivo: {'Mudança de cliente Gemini' if chat_session.geminiclient != gemini_client_instance else 'Mudança de modelo interno desejado (' + (chat_session.model.name if chat_session.model else 'N/A') + ' -> ' + internal_gemini_model_enum.name + ')'}. "
-            )
-            chat_session = gemini_client_instance.start_chat(metadata=chat_session.metadata, model=internal_gemini_model_enum)
-            active_chat_sessions[api_key_token] = chat_session
+    internal_gemini_model_enum = config_snapshot.model_enum(gemini_model_name_to_use)
+
+    # Usado como label de modelo nas métricas (inclusive pelos exception handlers).
+    http_request_object.state.gemini_model = gemini_model_name_to_use
+    request_timer = RequestTimer(model=gemini_model_name_to_use)
+    http_request_object.state.request_timer = request_timer
 
     system_prompt_content = None
     for msg in request_payload.messages:
         if msg.role == "system" and msg.content:
-            system_prompt_content = msg.content
+            system_prompt_content = msg.text
             break
 
     current_user_prompt = None # Renomeado de temp_user_prompt para clareza
+    current_user_message = None
     for message in reversed(request_payload.messages):
         if message.role == "user" and message.content:
-            current_user_prompt = message.content
+            current_user_message = message
+            current_user_prompt = message.text
             break
 
     if not current_user_prompt:
         if request_payload.messages and request_payload.messages[-1].content:
-            current_user_prompt = request_payload.messages[-1].content
+            current_user_message = request_payload.messages[-1]
+            current_user_prompt = current_user_message.text
         else:
             logger.warning("Requisição sem prompt de usuário válido.")
             # (HTTPException já existente)
@@ -422,51 +661,419 @@ async def chat_completions(
                 )
             ).model_dump())
 
-    final_prompt_to_send = current_user_prompt
-    if is_new_session_instance and system_prompt_content:
-        logger.info(f"Primeiro turno para sessão ...{api_key_token[-4:]}. Prefixando com system prompt.")
-        final_prompt_to_send = f"{system_prompt_content}\n\n{current_user_prompt}"
-    # >>> FIM DA LÓGICA DO SYSTEM PROMPT <<<
+    # Limites da API key: a requisição e os tokens do prompt são cobrados já na admissão.
+    api_key_policy = rate_limiter_instance.policy_for(api_key_token)
+    rate_limit = rate_limiter_instance.admit(
+        api_key_token,
+        prompt_tokens=count_message_tokens(request_payload.messages) if api_key_policy.tokens_per_minute else 0,
+    )
 
-    # Sanitize para o log, se necessário (você tinha safe_prompt antes, mantendo a ideia)
-    safe_prompt_to_log = final_prompt_to_send.replace("<", "&lt;").replace(">", "&gt;")
-    logger.info(f"Prompt final para Gemini (via ChatSession ...{api_key_token[-4:]}): '{safe_prompt_to_log[:200]}...'")
+    conversation_id = http_request_object.headers.get(CONVERSATION_ID_HEADER)
+    conversation_key = derive_conversation_key(
+        api_key=api_key_token,
+        messages=request_payload.messages,
+        conversation_id=conversation_id,
+    )
+    # Com fingerprinting, a conversa é gravada sob o hash do histórico + resposta deste turno,
+    # que é o `messages[:-1]` que o cliente enviará no próximo.
+    reply_session_key = None
+    if settings.SESSION_FINGERPRINTING and not conversation_id:
+        reply_session_key = partial(derive_reply_conversation_key, api_key_token, request_payload.messages)
+    session_label = f"{conversation_key[:12]} (API Key ...{api_key_token[-4:]})"
 
-    try:
-        gemini_model_output = await chat_session.send_message(final_prompt_to_send)
-    except GeminiModelInvalid as e:
-        logger.error(f"Erro de Modelo Gemini Inválido com ChatSession para API Key ...{api_key_token[-4:]} usando modelo {chat_session.model.name if chat_session.model else 'N/A'}: {e}")
-        raise
-    except Exception as e:
-        logger.error(f"Erro ao chamar Gemini com ChatSession para API Key ...{api_key_token[-4:]}: {e}")
-        raise
+    response_headers: dict[str, str] = rate_limit.headers()
+    response_cache_key = None
+    single_flight_key = None
+    if is_cacheable_request(request_payload) and (response_cache_instance.enabled or settings.SINGLE_FLIGHT_ENABLED):
+        # Cache e agrupamento só valem para a mesma API key e, no modo session, para a mesma conversa:
+        # a resposta vem da ChatSession da conversa e não pode ser entregue a outro cliente ou conversa.
+        # Uma conversa nova (chave aleatória) depende só das mensagens, que já estão na chave.
+        depends_on_session = settings.CONVERSATION_MODE != "stateless" and not starts_new_conversation(
+            request_payload.messages, conversation_id
+        )
+        cache_key = build_cache_key(
+            request_payload,
+            gemini_model_name_to_use,
+            api_key=api_key_token,
+            conversation_key=conversation_key if depends_on_session else None,
+        )
+        if settings.SINGLE_FLIGHT_ENABLED:
+            single_flight_key = cache_key
 
-    gemini_response_text = gemini_model_output.text
+    if response_cache_instance.enabled and is_cacheable_request(request_payload):
+        # Requisições sem estado podem ser respondidas do cache, sem sessão, conta ou fila.
+        read_from_cache, write_to_cache = cache_bypass_mode(http_request_object.headers.get("Cache-Control"))
+        response_headers[CACHE_STATUS_HEADER] = "BYPASS"
+        if read_from_cache:
+            cached_response_text = await response_cache_instance.get(cache_key)
+            if cached_response_text is not None:
+                logger.info("Resposta servida do cache ({}).", cache_key[:12])
+                response_headers[CACHE_STATUS_HEADER] = "HIT"
+                return build_full_text_response(
+                    request_payload=request_payload,
+                    gemini_response_text=cached_response_text,
+                    prompt_text=current_user_prompt,
+                    response_chat_id=f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                    http_response=http_response,
+                    response_headers=response_headers,
+                    request_timer=request_timer,
+                )
+            response_headers[CACHE_STATUS_HEADER] = "MISS"
+        if write_to_cache:
+            response_cache_key = cache_key
+
+
+    # Requisições idênticas simultâneas compartilham uma única chamada ao upstream.
+    flight = None
+    if single_flight_key is not None:
+        flight, is_flight_leader = single_flight_instance.join(single_flight_key)
+        if is_flight_leader:
+            http_request_object.state.flight = flight
+        else:
+            response_headers[COALESCED_HEADER] = "1"
+            return await build_flight_follower_response(
+                flight=flight,
+                request_payload=request_payload,
+                prompt_text=current_user_prompt,
+                http_response=http_response,
+                response_headers=response_headers,
+                request_timer=request_timer,
+            )
 
-    if not gemini_response_text and not gemini_model_output.images:
+    # Recursos mantidos durante a chamada ao upstream (turno da conversa, conta, slot). No streaming,
+    # a posse passa para o gerador da resposta, que os libera quando o stream termina.
+    async with AsyncExitStack() as request_resources:
+        if flight is not None:
+            # Qualquer erro do líder é repassado às requisições que aguardam o mesmo resultado.
+            request_resources.push(lambda exc_type, exc, tb: flight.fail(exc) if exc is not None else None)
+
+        # n > 1: as escolhas 1..n-1 vêm de chamadas extras, sem estado. Com streaming elas são
+        # disparadas já, em paralelo com a principal (o Gemini só transmite o candidato escolhido);
+        # sem streaming, só depois dela, para as escolhas que os candidatos não cobrirem.
+        # Se a principal falhar, as chamadas já disparadas são canceladas.
+        choice_fan_out = None
+        if choice_count > 1:
+            choice_fan_out = ChoiceFanOut(
+                messages=request_payload.messages,
+                config_snapshot=config_snapshot,
+                model_chain=config_snapshot.model_fallback_chain(gemini_model_name_to_use),
+                client_key=api_key_token,
+                weight=api_key_policy.weight,
+                lane=api_key_policy.lane,
+            )
+            if request_payload.stream:
+                choice_fan_out.start(choice_count - 1, stream=True)
+            request_resources.push(lambda exc_type, exc, tb: choice_fan_out.cancel() if exc is not None else None)
+
+        # Modo stateless: o histórico inteiro vai no prompt, numa conversa nova do Gemini a cada
+        # requisição. Não há sessão a travar, buscar ou gravar, e qualquer conta serve.
+        stateless_mode = settings.CONVERSATION_MODE == "stateless"
+
+        # Anexos gravados em arquivos temporários, apagados quando a resposta termina (no streaming,
+        # junto com os demais recursos). Com sessão, só os da mensagem atual: os anteriores já
+        # estão na conversa do Gemini (ver `history_attachment_files` para quando não estão).
+        attachment_files = await request_resources.enter_async_context(
+            attachment_store_instance.materialize(
+                attachment_parts(request_payload.messages) if stateless_mode else current_user_message.attachments
+            )
+        )
+        history_attachment_files = None
+
+        existing_chat_session = None
+        stored_session_record = None
+        preferred_account = None
+        if not stateless_mode:
+            # Um turno por vez por conversa: o metadata da ChatSession muda a cada resposta.
+            session_wait = await request_resources.enter_async_context(upstream_scheduler_instance.session_turn(conversation_key))
+            request_timer.queue_wait(session_wait, stage="session")
+
+            # Seleciona uma conta do pool, preferindo a conta dona da conversa atual.
+            existing_chat_session = active_chat_sessions.get(conversation_key)
+            if existing_chat_session is not None:
+                preferred_account = gemini_service_instance.account_for_client(existing_chat_session.geminiclient)
+            else:
+                # Conversa pode ter sido iniciada em outro worker/nó: busca o metadata no backend compartilhado.
+                stored_session_record = await active_chat_sessions.load_record(conversation_key)
+                preferred_account = gemini_service_instance.account_by_name(
+                    stored_session_record.account if stored_session_record else None
+                )
+
+        # Erros transitórios do upstream são tentados de novo (outra conta e, se configurado, outro
+        # modelo) enquanto nada foi enviado ao cliente. Cada tentativa ocupa sua própria conta e slot.
+        upstream_retry = create_upstream_retry(config_snapshot.model_fallback_chain(gemini_model_name_to_use))
+        text_deltas = None
+        while True:
+            try:
+                async with AsyncExitStack() as attempt_resources:
+                    gemini_account = await gemini_service_instance.acquire_account(preferred_account=preferred_account)
+                    attempt_resources.push(
+                        lambda exc_type, exc, tb, account=gemini_account: gemini_service_instance.release_account(account, exc)
+                    )
+                    slot_wait = await attempt_resources.enter_async_context(upstream_scheduler_instance.upstream_slot(
+                        gemini_account.name, client_key=api_key_token, weight=api_key_policy.weight, lane=api_key_policy.lane
+                    ))
+                    request_timer.queue_wait(slot_wait, stage="account_slot")
+
+                    if upstream_retry.used_fallback:
+                        internal_gemini_model_enum = config_snapshot.model_enum(upstream_retry.model_name)
+
+                    chat_session: ChatSession
+                    gemini_client_instance = gemini_account.client
+
+                    # >>> INÍCIO DA LÓGICA DO SYSTEM PROMPT <<<
+                    is_new_session_instance = False
+                    starts_without_history = False # Conversa nova no Gemini para um histórico já em andamento
+                    if stateless_mode:
+                        chat_session = gemini_client_instance.start_chat(model=internal_gemini_model_enum)
+                    elif existing_chat_session is None and stored_session_record is not None and stored_session_record.account == gemini_account.name:
+                        logger.info("Reconstruindo ChatSession da conversa {} a partir do metadata compartilhado (conta '{}').", session_label, gemini_account.name)
+                        chat_session = gemini_client_instance.start_chat(metadata=stored_session_record.metadata, model=internal_gemini_model_enum)
+                        # Mesma regra da recriação abaixo: mudança de modelo reenvia o system prompt.
+                        is_new_session_instance = stored_session_record.model != internal_gemini_model_enum.model_name
+                        active_chat_sessions.set(conversation_key, chat_session)
+                    elif existing_chat_session is None:
+                        is_new_session_instance = True
+                        starts_without_history = True
+                        logger.info("Criando nova ChatSession para conversa {} na conta '{}' usando modelo Gemini interno: {}", session_label, gemini_account.name, internal_gemini_model_enum.name)
+                        chat_session = gemini_client_instance.start_chat(model=internal_gemini_model_enum)
+                        active_chat_sessions.set(conversation_key, chat_session)
+                    else:
+                        chat_session = existing_chat_session
+                        if chat_session.geminiclient != gemini_client_instance or chat_session.model != internal_gemini_model_enum:
+                            is_new_session_instance = True # Tratar como nova instância para o system prompt
+                            logger.warning(
+                                "Recriando ChatSession para conversa {}. Motivo: {}. ",
+                                session_label,
+                                'Mudança de cliente Gemini' if chat_session.geminiclient != gemini_client_instance else 'Mudança de modelo interno desejado (' + (chat_session.model.name if chat_session.model else 'N/A') + ' -> ' + internal_gemini_model_enum.name + ')',
+                            )
+                            # O metadata da conversa só é válido na conta que a criou.
+                            same_account = preferred_account is gemini_account
+                            starts_without_history = not same_account
+                            chat_session = gemini_client_instance.start_chat(
+                                metadata=chat_session.metadata if same_account else None,
+                                model=internal_gemini_model_enum,
+                            )
+                            active_chat_sessions.set(conversation_key, chat_session)
+
+                    final_prompt_to_send = current_user_prompt
+                    attempt_attachment_files = attachment_files
+                    has_previous_turns = any(message.role != "system" for message in request_payload.messages[:-1])
+                    if stateless_mode or (starts_without_history and has_previous_turns):
+                        # System prompt, turnos anteriores e mensagem atual num único prompt. Também
+                        # quando o histórico não corresponde a nenhuma conversa conhecida (editado,
+                        # ramificado, ou cuja sessão expirou): a conversa nova começa com o contexto todo.
+                        final_prompt_to_send = render_messages(request_payload.messages)
+                        if not stateless_mode:
+                            # Sem sessão correspondente, os anexos dos turnos anteriores também precisam ir
+                            # (senão viram só `[image]` no prompt). Gravados uma vez, reaproveitados nas retentativas.
+                            if history_attachment_files is None:
+                                history_attachment_files = await request_resources.enter_async_context(
+                                    attachment_store_instance.materialize(attachment_parts(
+                                        message for message in request_payload.messages if message is not current_user_message
+                                    ))
+                                )
+                            attempt_attachment_files = history_attachment_files + attachment_files
+                    elif is_new_session_instance and system_prompt_content:
+                        logger.info("Primeiro turno para sessão {}. Prefixando com system prompt.", session_label)
+                        final_prompt_to_send = f"{system_prompt_content}\n\n{current_user_prompt}"
+                    # >>> FIM DA LÓGICA DO SYSTEM PROMPT <<<
+
+                    # O prompt vai como argumento: não é interpretado como template nem como tags de cor do log.
+                    logger.info("Prompt final para Gemini (via ChatSession {}): '{}...'", session_label, final_prompt_to_send[:200])
+
+                    if request_payload.stream and gemini_service_instance.supports_streaming(chat_session):
+                        # Streaming real: os deltas são repassados enquanto o Gemini ainda está gerando.
+                        # Só erros até o primeiro delta são tentados de novo.
+                        request_timer.upstream_started()
+                        try:
+                            text_deltas = await gemini_service_instance.open_text_stream(chat_session, final_prompt_to_send, attempt_attachment_files)
+                        except Exception as e:
+                            logger.error("Erro ao iniciar streaming do Gemini com ChatSession para conversa {}: {}", session_label, e)
+                            raise
+                        # A conta e o slot passam a pertencer ao stream, junto com os demais recursos.
+                        request_resources.push_async_exit(attempt_resources.pop_all())
+                    else:
+                        try:
+                            request_timer.upstream_started()
+                            gemini_model_output = await chat_session.send_message(final_prompt_to_send, files=attempt_attachment_files or None)
+                            request_timer.upstream_finished()
+                            if reply_session_key is not None and not stateless_mode:
+                                # A chave do próximo turno usa a resposta como o cliente a recebe (já cortada).
+                                reply_text, _ = truncate_completion(output_text(gemini_model_output), request_payload.stop, request_payload.max_tokens)
+                                await active_chat_sessions.save(
+                                    reply_session_key(reply_text), chat_session, gemini_account.name, previous_key=conversation_key
+                                )
+                            elif not stateless_mode:
+                                await active_chat_sessions.save(conversation_key, chat_session, gemini_account.name)
+                        except GeminiModelInvalid as e:
+                            logger.error("Erro de Modelo Gemini Inválido com ChatSession para conversa {} usando modelo {}: {}", session_label, chat_session.model.name if chat_session.model else 'N/A', e)
+                            raise
+                        except Exception as e:
+                            logger.error("Erro ao chamar Gemini com ChatSession para conversa {}: {}", session_label, e)
+                            raise
+                break
+            except Exception as e:
+                retry_delay = upstream_retry.next_delay(e)
+                if retry_delay is None:
+                    raise
+                await asyncio.sleep(retry_delay)
+
+        if upstream_retry.used_fallback:
+            # A resposta veio de outro modelo: não deve ser servida do cache como a do modelo pedido.
+            response_cache_key = None
+
+        response_chat_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+        if text_deltas is not None:
+            logger.info("Iniciando streaming incremental de resposta via ChatSession.")
+            # `stop`/`max_tokens` são aplicados só no formatter, a cada escolha. Ao atingir o limite, ele
+            # fecha o stream: a geração é cancelada e a conta, o slot e o turno da conversa são liberados.
+            text_deltas = request_timer.wrap_deltas(text_deltas)
+            text_deltas = rate_limiter_instance.charge_after_stream(text_deltas, rate_limit)
+            if not stateless_mode:
+                def limited_reply_key(reply_text: str) -> str:
+                    # Como no não-streaming: a chave do próximo turno usa a resposta já cortada.
+                    limited_text, _ = truncate_completion(reply_text, request_payload.stop, request_payload.max_tokens)
+                    return reply_session_key(limited_text)
+
+                text_deltas = active_chat_sessions.save_after_stream(
+                    text_deltas, conversation_key, chat_session, gemini_account.name,
+                    reply_key=limited_reply_key if reply_session_key is not None else None,
+                )
+            text_deltas = release_after_stream(text_deltas, request_resources.pop_all())
+            if response_cache_key is not None:
+                text_deltas = response_cache_instance.store_after_stream(text_deltas, response_cache_key)
+            if flight is not None:
+                # O upstream é consumido em background e difundido para o líder e os seguidores.
+                flight.pump(text_deltas)
+                text_deltas = flight.subscribe()
+            # A gemini-webapi só transmite o candidato escolhido; as demais escolhas são os streams
+            # das chamadas extras, intercalados por `index`.
+            extra_choice_deltas = [
+                rate_limiter_instance.charge_after_stream(choice_deltas, rate_limit)
+                for choice_deltas in (choice_fan_out.streams() if choice_fan_out is not None else ())
+            ]
+            return StreamingResponse(
+                request_timer.wrap_chunks(
+                    generate_openai_streaming_chunks_from_deltas(
+                        text_deltas=request_timer.measure_wait(text_deltas),
+                        model_name=request_payload.model,
+                        original_request_id=response_chat_id,
+                        usage_prompt_tokens=stream_usage_prompt_tokens(request_payload),
+                        stop=request_payload.stop,
+                        max_tokens=request_payload.max_tokens,
+                        extra_choice_deltas=extra_choice_deltas,
+                    )
+                ),
+                media_type="text/event-stream",
+                headers=response_headers,
+            )
+
+    gemini_response_text = output_text(gemini_model_output)
+    rate_limiter_instance.charge_completion(rate_limit, gemini_response_text)
+
+    if not gemini_response_text:
         logger.warning("Gemini retornou uma resposta vazia via ChatSession.")
         gemini_response_text = ""
 
-    response_chat_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    if flight is not None:
+        flight.finish(gemini_response_text)
+    if response_cache_key is not None and gemini_response_text:
+        await response_cache_instance.set(response_cache_key, gemini_response_text)
 
-    if request_payload.stream:
-        logger.info("Iniciando streaming de resposta via ChatSession.")
-        return StreamingResponse(
-            generate_openai_streaming_chunks(
-                gemini_response_text=gemini_response_text,
-                model_name=request_payload.model,
-                original_request_id=response_chat_id
-            ),
-            media_type="text/event-stream"
+    extra_choice_texts = []
+    if choice_fan_out is not None:
+        candidate_texts = extra_candidate_texts(gemini_model_output, choice_count - 1)
+        if not request_payload.stream:
+            # Os outros candidatos que o Gemini já devolveu cobrem parte das escolhas; só o resto vai ao upstream.
+            choice_fan_out.start(choice_count - 1 - len(candidate_texts), stream=False)
+        # (Com `stream` num upstream sem streaming, as chamadas já disparadas que os candidatos cobrirem são canceladas.)
+        extra_choice_texts = await choice_fan_out.collect(choice_count - 1, candidate_texts)
+        rate_limiter_instance.charge_completion(rate_limit, "".join(extra_choice_texts))
+
+    return build_full_text_response(
+        request_payload=request_payload,
+        gemini_response_text=gemini_response_text,
+        prompt_text=current_user_prompt, # Usar o prompt do usuário original do turno atual
+        response_chat_id=response_chat_id,
+        http_response=http_response,
+        response_headers=response_headers,
+        request_timer=request_timer,
+        extra_choice_texts=extra_choice_texts,
+    )
+
+
+# --- Batch API ---
+def batch_not_found(kind: str, object_id: str) -> HTTPException:
+    return HTTPException(status_code=404, detail=OpenAIErrorResponse(
+        error=OpenAIErrorDetail(
+            message=f"No such {kind}: '{object_id}'.",
+            type="invalid_request_error",
+            param="id",
+            code="not_found"
         )
-    else:
-        logger.info("Formatando resposta não-streaming via ChatSession.")
-        openai_response = format_to_openai_response(
-            prompt_text=current_user_prompt, # Usar o prompt do usuário original do turno atual
-            gemini_response_text=gemini_response_text,
-            model_name=request_payload.model,
-            original_request_id=response_chat_id
+    ).model_dump())
+
+def batch_invalid_request(message: str, param: str) -> HTTPException:
+    return HTTPException(status_code=400, detail=OpenAIErrorResponse(
+        error=OpenAIErrorDetail(
+            message=message,
+            type="invalid_request_error",
+            param=param,
+            code="invalid_request"
         )
-        if settings.LOG_LEVEL.upper() == "DEBUG":
-            logger.debug(f"Resposta OpenAI formatada (ChatSession): {openai_response.model_dump_json(indent=2, exclude_none=True)}")
-        return openai_response
+    ).model_dump())
+
+@app.post("/v1/files", response_model=FileObject, summary="Envia um arquivo JSONL para a Batch API", tags=["Batch"])
+async def upload_file(
+    file: UploadFile = File(...),
+    purpose: str = Form(...),
+    api_key_token: str = Depends(get_api_key),
+):
+    if purpose != "batch":
+        raise batch_invalid_request("Only files with purpose 'batch' are supported.", "purpose")
+    try:
+        return await batch_runner_instance.create_file(owner_for_api_key(api_key_token), file.filename or "batch.jsonl", purpose, file.file)
+    except ValueError as e:
+        raise batch_invalid_request(str(e), "file")
+
+@app.get("/v1/files/{file_id}", response_model=FileObject, summary="Consulta um arquivo", tags=["Batch"])
+async def retrieve_file(file_id: str, api_key_token: str = Depends(get_api_key)):
+    file_object = batch_runner_instance.get_file(owner_for_api_key(api_key_token), file_id)
+    if file_object is None:
+        raise batch_not_found("file", file_id)
+    return file_object
+
+@app.get("/v1/files/{file_id}/content", summary="Baixa o conteúdo de um arquivo (ex.: resultados de um batch)", tags=["Batch"])
+async def retrieve_file_content(file_id: str, api_key_token: str = Depends(get_api_key)):
+    content_path = batch_runner_instance.file_content_path(owner_for_api_key(api_key_token), file_id)
+    if content_path is None:
+        raise batch_not_found("file", file_id)
+    return FileResponse(content_path, media_type="application/octet-stream")
+
+@app.post("/v1/batches", response_model=BatchObject, summary="Cria um batch de chat completions", tags=["Batch"])
+async def create_batch(request_payload: BatchCreateRequest, api_key_token: str = Depends(get_api_key)):
+    try:
+        return await batch_runner_instance.create_batch(owner_for_api_key(api_key_token), request_payload)
+    except KeyError:
+        raise batch_not_found("file", request_payload.input_file_id)
+    except ValueError as e:
+        raise batch_invalid_request(str(e), "input_file_id")
+
+@app.get("/v1/batches", response_model=BatchListResponse, summary="Lista os batches", tags=["Batch"])
+async def list_batches(limit: int = 20, api_key_token: str = Depends(get_api_key)):
+    return BatchListResponse(data=batch_runner_instance.list_batches(owner_for_api_key(api_key_token), limit=limit))
+
+@app.get("/v1/batches/{batch_id}", response_model=BatchObject, summary="Consulta o estado de um batch", tags=["Batch"])
+async def retrieve_batch(batch_id: str, api_key_token: str = Depends(get_api_key)):
+    batch = batch_runner_instance.get_batch(owner_for_api_key(api_key_token), batch_id)
+    if batch is None:
+        raise batch_not_found("batch", batch_id)
+    return batch
+
+@app.post("/v1/batches/{batch_id}/cancel", response_model=BatchObject, summary="Cancela um batch", tags=["Batch"])
+async def cancel_batch(batch_id: str, api_key_token: str = Depends(get_api_key)):
+    batch = await batch_runner_instance.cancel_batch(owner_for_api_key(api_key_token), batch_id)
+    if batch is None:
+        raise batch_not_found("batch", batch_id)
+    return batch
@@ -1,23 +1,76 @@
 # Adicionar importações no topo do arquivo se necessário:
 import time
 import uuid
-from typing import List
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from typing import List, Optional, Literal, Dict, Any, Union
 
+class ImageURL(BaseModel):
+    url: str # http(s), data URL em base64 ou caminho local (file://) permitido em ATTACHMENT_LOCAL_DIRS
+    detail: Optional[Literal["auto", "low", "high"]] = None
+
+class FileData(BaseModel):
+    file_data: Optional[str] = None # Base64 puro ou data URL
+    file_id: Optional[str] = None
+    filename: Optional[str] = None
+
+class ContentPart(BaseModel):
+    type: Literal["text", "image_url", "file"]
+    text: Optional[str] = None
+    image_url: Optional[ImageURL] = None
+    file: Optional[FileData] = None
+
+    @field_validator("image_url", mode="before")
+    @classmethod
+    def accept_plain_url(cls, value: Any) -> Any:
+        # Alguns clientes enviam `"image_url": "https://..."` em vez de `{"url": ...}`.
+        return {"url": value} if isinstance(value, str) else value
+
+    @property
+    def source(self) -> str:
+        """Origem do anexo (URL, data URL, base64 ou file_id), usada para identificá-lo."""
+        if self.image_url is not None:
+            return self.image_url.url
+        if self.file is not None:
+            return self.file.file_data or self.file.file_id or ""
+        return ""
+
+    @property
+    def placeholder(self) -> str:
+        """Marca o lugar do anexo no texto enviado ao Gemini (o arquivo vai separado)."""
+        if self.type == "file":
+            return f"[file: {self.file.filename}]" if self.file is not None and self.file.filename else "[file]"
+        return "[image]"
+
 class ChatMessage(BaseModel):
     role: Literal["system", "user", "assistant", "tool"]
-    content: Optional[str] = None
+    content: Optional[Union[str, List[ContentPart]]] = None
     # Adicionar outros campos como 'tool_calls', 'tool_call_id' se necessário
 
+    @property
+    def text(self) -> Optional[str]:
+        """Conteúdo como texto: a string, ou as partes unidas, com cada anexo marcado pelo placeholder."""
+        if self.content is None or isinstance(self.content, str):
+            return self.content
+        return "\n".join(part.text or "" if part.type == "text" else part.placeholder for part in self.content) or None
+
+    @property
+    def attachments(self) -> List[ContentPart]:
+        if self.content is None or isinstance(self.content, str):
+            return []
+        return [part for part in self.content if part.type != "text"]
+
+class StreamOptions(BaseModel):
+    include_usage: Optional[bool] = False # Envia um chunk final com `usage` antes do [DONE]
+
 class ChatCompletionRequest(BaseModel):
     model: str
     messages: List[ChatMessage]
     temperature: Optional[float] = Field(default=0.7, ge=0, le=2)
     top_p: Optional[float] = Field(default=1.0, ge=0, le=1)
-    n: Optional[int] = Field(default=1, ge=1) # Gemini-API retorna múltiplos candidatos, mas nós formataremos 1 escolha
+    n: Optional[int] = Field(default=1, ge=1) # Escolhas: candidatos do Gemini e, se faltarem, chamadas extras (até CHAT_COMPLETION_MAX_CHOICES)
     stream: Optional[bool] = False
+    stream_options: Optional[StreamOptions] = None
     stop: Optional[Union[str, List[str]]] = None
     max_tokens: Optional[int] = None
     presence_penalty: Optional[float] = Field(default=0, ge=-2, le=2)
@@ -70,7 +123,7 @@ class ChatCompletionChunkResponse(BaseModel):
     created: int = Field(default_factory=lambda: int(time.time()))
     model: str
     choices: List[StreamingChoice]
-    # usage: Optional[Usage] = None # Usage geralmente não é enviado em chunks, mas pode ser no último.
+    usage: Optional[Usage] = None # Só no chunk final, quando stream_options.include_usage é pedido
     # system_fingerprint: Optional[str] = None
 
 class OpenAIErrorDetail(BaseModel):
@@ -93,3 +146,58 @@ class ModelCard(BaseModel):
 class ModelListResponse(BaseModel):
     object: Literal["list"] = "list"
     data: List[ModelCard]
+
+# Batch API (/v1/files e /v1/batches)
+class FileObject(BaseModel):
+    id: str
+    object: Literal["file"] = "file"
+    bytes: int
+    created_at: int
+    filename: str
+    purpose: str
+
+class BatchCreateRequest(BaseModel):
+    input_file_id: str
+    endpoint: Literal["/v1/chat/completions"] = "/v1/chat/completions"
+    completion_window: str = "24h" # Aceito por compatibilidade; o proxy executa assim que possível
+    metadata: Optional[Dict[str, str]] = None
+
+class BatchRequestCounts(BaseModel):
+    total: int = 0
+    completed: int = 0
+    failed: int = 0
+
+class BatchError(BaseModel):
+    code: Optional[str] = None
+    message: str
+    param: Optional[str] = None
+    line: Optional[int] = None
+
+class BatchErrors(BaseModel):
+    object: Literal["list"] = "list"
+    data: List[BatchError]
+
+class BatchObject(BaseModel):
+    id: str
+    object: Literal["batch"] = "batch"
+    endpoint: str
+    errors: Optional[BatchErrors] = None
+    input_file_id: str
+    completion_window: str
+    status: Literal["validating", "failed", "in_progress", "finalizing", "completed", "cancelling", "cancelled"]
+    output_file_id: Optional[str] = None
+    error_file_id: Optional[str] = None
+    created_at: int
+    in_progress_at: Optional[int] = None
+    finalizing_at: Optional[int] = None
+    completed_at: Optional[int] = None
+    failed_at: Optional[int] = None
+    cancelling_at: Optional[int] = None
+    cancelled_at: Optional[int] = None
+    request_counts: BatchRequestCounts = Field(default_factory=BatchRequestCounts)
+    metadata: Optional[Dict[str, str]] = None
+
+class BatchListResponse(BaseModel):
+    object: Literal["list"] = "list"
+    data: List[BatchObject]
+    has_more: bool = False
@@ -0,0 +1,276 @@
+import asyncio
+import binascii
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
+from typing import Optional, List, Dict, AsyncIterator, Tuple
+from urllib.parse import urlparse, unquote
+
+import httpx
+from loguru import logger
+
+from app.core.config import settings
+from app.models.openai_schemas import ContentPart, ChatCompletionRequest
+
+# Caracteres de base64 decodificados por vez (múltiplo de 4): a memória extra por anexo fica nesse limite
+DECODE_CHUNK_CHARS = 256 * 1024
+DATA_URL_PATTERN = re.compile(r"^data:(?P<mime>[^;,]*)(?P<params>(?:;[^;,]*)*?);base64,", re.IGNORECASE)
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^\w.\- ]")
+_WHITESPACE = re.compile(r"\s")
+
+
+class AttachmentError(Exception):
+    """Anexo inválido, grande demais ou de origem não permitida (respondido como 400)."""
+
+
+def _extension_for(mime_type: str) -> str:
+    return mimetypes.guess_extension(mime_type or "") or ".bin"
+
+
+def _safe_filename(filename: Optional[str], fallback: str) -> str:
+    name = _UNSAFE_FILENAME_CHARS.sub("_", os.path.basename(filename or "")).strip(" .")
+    return name[:128] or fallback
+
+
+def _decode_base64_to_file(data: str, start: int, path: str, max_bytes: int) -> int:
+    """
+    Decodifica `data[start:]` direto para `path`, DECODE_CHUNK_CHARS por vez, sem montar os bytes
+    do anexo inteiro na memória. Executado em thread. Retorna o tamanho do arquivo.
+    """
+    written = 0
+    carry = ""
+    with open(path, "wb") as output_file:
+        for offset in range(start, len(data), DECODE_CHUNK_CHARS):
+            chunk = carry + data[offset:offset + DECODE_CHUNK_CHARS]
+            if _WHITESPACE.search(chunk):
+                chunk = "".join(chunk.split())
+            usable = len(chunk) - len(chunk) % 4
+            carry = chunk[usable:]
+            try:
+                decoded = binascii.a2b_base64(chunk[:usable], strict_mode=True)
+            except ValueError as e: # binascii.Error, ou caracteres fora do ASCII
+                raise AttachmentError(f"Attachment is not valid base64: {e}.") from e
+            written += len(decoded)
+            if written > max_bytes:
+                raise AttachmentError(f"Attachment exceeds the maximum size of {max_bytes} bytes.")
+            output_file.write(decoded)
+    if carry:
+        raise AttachmentError("Attachment is not valid base64: truncated data.")
+    return written
+
+
+class AttachmentStore:
+    """
+    Converte as partes `image_url`/`file` das mensagens em arquivos locais para o upload ao Gemini.
+
+    - base64/data URL: decodificado em pedaços direto para um arquivo temporário da requisição;
+    - caminho local (`file://` ou absoluto): usado no lugar, sem cópia, se estiver dentro de um
+      dos diretórios de ATTACHMENT_LOCAL_DIRS;
+    - http(s): baixado em streaming para o arquivo temporário, se ATTACHMENT_ALLOW_REMOTE_URLS.
+
+    O tamanho é verificado antes (pelo tamanho do base64 ou Content-Length) e durante a escrita.
+    Os arquivos temporários são apagados ao fim da requisição.
+    """
+
+    def __init__(
+        self,
+        temp_dir: str,
+        max_bytes: int,
+        max_files: int,
+        local_dirs: List[str],
+        allow_remote_urls: bool,
+        remote_timeout_seconds: float,
+    ):
+        self.temp_dir = temp_dir or None
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.local_dirs = [os.path.realpath(directory) for directory in local_dirs]
+        self.allow_remote_urls = allow_remote_urls
+        self.remote_timeout_seconds = remote_timeout_seconds
+        self.files = 0
+        self.bytes_written = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def materialize(self, parts: List[ContentPart]) -> AsyncIterator[List[str]]:
+        """Caminhos dos arquivos dos anexos, válidos enquanto o contexto estiver aberto."""
+        if not parts:
+            yield []
+            return
+        if len(parts) > self.max_files:
+            self.rejected += 1
+            raise AttachmentError(f"Too many attachments: {len(parts)} (maximum is {self.max_files}).")
+        if self.temp_dir:
+            os.makedirs(self.temp_dir, exist_ok=True)
+        directory = await asyncio.to_thread(tempfile.mkdtemp, prefix="attachments-", dir=self.temp_dir)
+        try:
+            paths = []
+            for index, part in enumerate(parts):
+                try:
+                    paths.append(await self._materialize_part(part, os.path.join(directory, str(index))))
+                except AttachmentError:
+                    self.rejected += 1
+                    raise
+            self.files += len(paths)
+            yield paths
+        finally:
+            await asyncio.to_thread(shutil.rmtree, directory, True)
+
+    async def _materialize_part(self, part: ContentPart, directory: str) -> str:
+        # Cada anexo num subdiretório próprio: o nome do arquivo é o que o Gemini vê.
+        os.makedirs(directory)
+        filename = part.file.filename if part.file is not None else None
+        source = part.source
+        if part.type == "file" and part.file is not None and part.file.file_id and not part.file.file_data:
+            raise AttachmentError("File parts referencing a file_id are not supported; send the content in 'file_data'.")
+        if not source:
+            raise AttachmentError(f"Content part of type '{part.type}' has no data.")
+
+        data_url = DATA_URL_PATTERN.match(source)
+        if data_url is not None:
+            mime_type = data_url.group("mime") or "application/octet-stream"
+            path = os.path.join(directory, _safe_filename(filename, f"attachment{_extension_for(mime_type)}"))
+            return await self._write_base64(source, data_url.end(), path)
+
+        parsed = urlparse(source)
+        if parsed.scheme in ("http", "https"):
+            path = os.path.join(directory, _safe_filename(filename or os.path.basename(parsed.path), "attachment.bin"))
+            return await self._download(source, path)
+        if parsed.scheme == "file" or os.path.isabs(source):
+            return self._resolve_local_path(unquote(parsed.path) if parsed.scheme == "file" else source)
+        if part.type == "file":
+            # `file_data` sem o prefixo data: base64 puro.
+            path = os.path.join(directory, _safe_filename(filename, "attachment.bin"))
+            return await self._write_base64(source, 0, path)
+        raise AttachmentError("Unsupported image URL: use http(s), a base64 data URL or an allowed local path.")
+
+    async def _write_base64(self, data: str, start: int, path: str) -> str:
+        # Cada 4 caracteres viram no máximo 3 bytes: anexos grandes demais são recusados antes de
+        # decodificar (com folga para as quebras de linha do base64 MIME; o limite exato vale na escrita).
+        if (len(data) - start) // 4 * 3 > self.max_bytes + self.max_bytes // 32 + 3:
+            raise AttachmentError(f"Attachment exceeds the maximum size of {self.max_bytes} bytes.")
+        size = await asyncio.to_thread(_decode_base64_to_file, data, start, path, self.max_bytes)
+        if size == 0:
+            raise AttachmentError("Attachment is empty.")
+        self.bytes_written += size
+        return path
+
+    async def _download(self, url: str, path: str) -> str:
+        if not self.allow_remote_urls:
+            raise AttachmentError("Remote image URLs are disabled on this proxy; send the image as a base64 data URL.")
+        written = 0
+        try:
+            async with httpx.AsyncClient(timeout=self.remote_timeout_seconds, follow_redirects=True) as client:
+                async with client.stream("GET", url) as response:
+                    response.raise_for_status()
+                    declared_size = int(response.headers.get("content-length") or 0)
+                    if declared_size > self.max_bytes:
+                        raise AttachmentError(f"Attachment exceeds the maximum size of {self.max_bytes} bytes.")
+                    with open(path, "wb") as output_file:
+                        async for chunk in response.aiter_bytes():
+                            written += len(chunk)
+                            if written > self.max_bytes:
+                                raise AttachmentError(f"Attachment exceeds the maximum size of {self.max_bytes} bytes.")
+                            output_file.write(chunk)
+        except httpx.HTTPError as e:
+            raise AttachmentError(f"Could not download attachment from '{url}': {e}") from e
+        self.bytes_written += written
+        return path
+
+    def _resolve_local_path(self, path: str) -> str:
+        real_path = os.path.realpath(path)
+        allowed = any(os.path.commonpath([real_path, directory]) == directory for directory in self.local_dirs)
+        if not allowed:
+            logger.warning("Anexo com caminho local fora de ATTACHMENT_LOCAL_DIRS recusado: '{}'.", path)
+            raise AttachmentError("Local file paths are only accepted inside the directories allowed by the proxy.")
+        if not os.path.isfile(real_path):
+            raise AttachmentError(f"Attachment file not found: '{path}'.")
+        if os.path.getsize(real_path) > self.max_bytes:
+            raise AttachmentError(f"Attachment exceeds the maximum size of {self.max_bytes} bytes.")
+        return real_path
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "files": self.files,
+            "bytes_written": self.bytes_written,
+            "rejected": self.rejected,
+        }
+
+
+def attachment_parts(messages) -> List[ContentPart]:
+    """Anexos de `messages`, na ordem em que aparecem."""
+    return [part for message in messages for part in message.attachments]
+
+
+def _inline_base64(part: ContentPart) -> Optional[Tuple[str, int]]:
+    """(tipo MIME, início do base64) se o anexo vem embutido na requisição; None para URL, caminho ou file_id."""
+    source = part.source
+    data_url = DATA_URL_PATTERN.match(source)
+    if data_url is not None:
+        return data_url.group("mime") or "application/octet-stream", data_url.end()
+    if part.type == "file" and part.file is not None and part.file.file_data and not (
+        urlparse(source).scheme in ("http", "https", "file") or os.path.isabs(source)
+    ):
+        return mimetypes.guess_type(part.file.filename or "")[0] or "application/octet-stream", 0
+    return None
+
+
+def _inline_summary(source: str, mime_type: str, start: int) -> str:
+    # O hash é do base64, em pedaços: nenhuma cópia do anexo inteiro é montada.
+    digest = hashlib.sha256()
+    for offset in range(start, len(source), DECODE_CHUNK_CHARS):
+        digest.update(source[offset:offset + DECODE_CHUNK_CHARS].encode("ascii", "replace"))
+    size = (len(source) - start) * 3 // 4 - len(source[-2:]) + len(source[-2:].rstrip("="))
+    return f"[base64 omitido: {mime_type}, {size} bytes, sha256 do base64 {digest.hexdigest()}]"
+
+
+def _redact_part(part: ContentPart) -> ContentPart:
+    inline = _inline_base64(part) if part.type != "text" else None
+    if inline is None:
+        return part
+    summary = _inline_summary(part.source, *inline)
+    if part.image_url is not None:
+        return part.model_copy(update={"image_url": part.image_url.model_copy(update={"url": summary})})
+    return part.model_copy(update={"file": part.file.model_copy(update={"file_data": summary})})
+
+
+def redact_inline_attachments(request_payload: ChatCompletionRequest) -> ChatCompletionRequest:
+    """
+    Cópia da requisição para auditoria e logs, com cada anexo em base64 trocado por um resumo
+    (tipo MIME, tamanho, sha256). Sem anexos embutidos, devolve a própria requisição.
+    """
+    if not any(_inline_base64(part) for part in attachment_parts(request_payload.messages)):
+        return request_payload
+    messages = [
+        message.model_copy(update={"content": [_redact_part(part) for part in message.content]})
+        if message.attachments else message
+        for message in request_payload.messages
+    ]
+    return request_payload.model_copy(update={"messages": messages})
+
+
+def render_output_images(images) -> str:
+    """Imagens da resposta do Gemini (web e geradas) como links Markdown, conforme RESPONSE_IMAGES_FORMAT."""
+    if not images or settings.RESPONSE_IMAGES_FORMAT != "markdown":
+        return ""
+    return "\n\n" + "\n".join(f"![{image.alt or image.title}]({image.url})" for image in images)
+
+
+def output_text(model_output) -> str:
+    """Texto da resposta do Gemini com as imagens retornadas anexadas ao fim."""
+    return (model_output.text or "") + render_output_images(getattr(model_output, "images", None))
+
+
+# Instância global do store de anexos para ser usada pela aplicação FastAPI
+attachment_store_instance = AttachmentStore(
+    temp_dir=settings.ATTACHMENT_TEMP_DIR,
+    max_bytes=settings.ATTACHMENT_MAX_BYTES,
+    max_files=settings.ATTACHMENT_MAX_FILES,
+    local_dirs=settings.ATTACHMENT_LOCAL_DIRS,
+    allow_remote_urls=settings.ATTACHMENT_ALLOW_REMOTE_URLS,
+    remote_timeout_seconds=settings.ATTACHMENT_REMOTE_TIMEOUT_SECONDS,
+)
@@ -0,0 +1,164 @@
+import asyncio
+import glob
+import os
+import random
+import time
+from typing import Optional, List, Tuple, Dict, Callable
+
+from loguru import logger
+from pydantic import BaseModel
+
+from app.core.config import settings
+
+
+class AuditLogWriter:
+    """
+    Log de auditoria dos payloads recebidos, gravado fora do caminho da requisição.
+
+    `record()` apenas enfileira o payload (fila limitada; o excedente é descartado e contado).
+    Uma task em background agrupa os registros em lotes, serializa em JSONL compacto e grava
+    em thread, rotacionando o arquivo por tamanho e/ou idade.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        enabled: bool,
+        sample_rate: float,
+        queue_size: int,
+        batch_size: int,
+        flush_interval_seconds: float,
+        max_bytes: int,
+        rotate_seconds: float,
+        backup_count: int,
+    ):
+        self.path = path
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backup_count = backup_count
+        self._queue: "asyncio.Queue[Tuple[float, BaseModel]]" = asyncio.Queue(maxsize=queue_size)
+        self._task: Optional[asyncio.Task] = None
+        self._file = None
+        self._file_opened_at = 0.0
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+
+    def record(self, payload: BaseModel, redact: Optional[Callable[[BaseModel], BaseModel]] = None) -> None:
+        """
+        Enfileira um payload para auditoria sem bloquear (nem serializar) no event loop.
+        `redact` reduz o payload antes de ele entrar na fila (ex.: anexos em base64 viram um resumo);
+        só é aplicado aos registros amostrados que cabem na fila.
+        """
+        if not self.enabled:
+            return
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return
+        if self._queue.full():
+            self.dropped += 1
+            return
+        self._queue.put_nowait((time.time(), redact(payload) if redact is not None else payload))
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run(), name="audit-log-writer")
+            logger.info("Audit log assíncrono ativo em '{}' (amostragem: {:.0%}).", self.path, self.sample_rate)
+
+    async def stop(self) -> None:
+        """Para a task de background e grava o que ainda estiver na fila."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        remaining = self._drain(limit=None)
+        if remaining:
+            await asyncio.to_thread(self._write_batch, remaining)
+        if self._file is not None:
+            await asyncio.to_thread(self._file.close)
+            self._file = None
+
+    def _drain(self, limit: Optional[int]) -> List[Tuple[float, BaseModel]]:
+        batch = []
+        while not self._queue.empty() and (limit is None or len(batch) < limit):
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            first_item = await self._queue.get()
+            # Espera um pouco para acumular um lote, exceto se a fila já tiver um lote cheio.
+            if self._queue.qsize() < self.batch_size - 1:
+                await asyncio.sleep(self.flush_interval_seconds)
+            batch = [first_item] + self._drain(limit=self.batch_size - 1)
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception as e:
+                logger.error("Falha ao gravar {} registro(s) no audit log '{}': {}", len(batch), self.path, e)
+
+    def _write_batch(self, batch: List[Tuple[float, BaseModel]]) -> None:
+        # Executado em thread: serialização e I/O não ocupam o event loop.
+        lines = [
+            f'{{"ts":{timestamp:.3f},"payload":{payload.model_dump_json(exclude_none=True)}}}\n'
+            for timestamp, payload in batch
+        ]
+        self._rotate_if_needed()
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+            self._file_opened_at = time.time()
+        self._file.write("".join(lines))
+        self._file.flush()
+        self.written += len(lines)
+
+    def _rotate_if_needed(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        too_big = self.max_bytes > 0 and os.path.getsize(self.path) >= self.max_bytes
+        opened_at = self._file_opened_at or os.path.getmtime(self.path)
+        too_old = self.rotate_seconds > 0 and time.time() - opened_at >= self.rotate_seconds
+        if not (too_big or too_old):
+            return
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        backup_path = f"{self.path}.{time.strftime('%Y%m%d-%H%M%S')}"
+        suffix = 1
+        while os.path.exists(backup_path):
+            backup_path = f"{self.path}.{time.strftime('%Y%m%d-%H%M%S')}-{suffix}"
+            suffix += 1
+        os.replace(self.path, backup_path)
+        backups = sorted(glob.glob(f"{glob.escape(self.path)}.*"))
+        for old_backup in backups[:-self.backup_count] if self.backup_count > 0 else []:
+            os.remove(old_backup)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+        }
+
+
+# Instância global do audit log para ser usada pela aplicação FastAPI
+audit_log_instance = AuditLogWriter(
+    path=settings.AUDIT_LOG_PATH,
+    enabled=settings.AUDIT_LOG_ENABLED,
+    sample_rate=settings.AUDIT_LOG_SAMPLE_RATE,
+    queue_size=settings.AUDIT_LOG_QUEUE_SIZE,
+    batch_size=settings.AUDIT_LOG_BATCH_SIZE,
+    flush_interval_seconds=settings.AUDIT_LOG_FLUSH_INTERVAL_SECONDS,
+    max_bytes=settings.AUDIT_LOG_MAX_BYTES,
+    rotate_seconds=settings.AUDIT_LOG_ROTATE_SECONDS,
+    backup_count=settings.AUDIT_LOG_BACKUP_COUNT,
+)
@@ -0,0 +1,541 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import Optional, Dict, List, Tuple, BinaryIO, Any
+
+from loguru import logger
+from pydantic import BaseModel, ValidationError
+
+from app.core.config import settings
+from app.models.openai_schemas import (
+    ChatCompletionRequest,
+    ChatCompletionResponse,
+    FileObject,
+    BatchCreateRequest,
+    BatchObject,
+    BatchError,
+    BatchErrors,
+)
+from app.services.gemini_service import gemini_service_instance, NoAvailableAccountError
+from app.services.history_renderer import render_messages
+from app.services.attachments import attachment_store_instance, attachment_parts, output_text
+from app.services.metrics import metrics_registry
+from app.services.retry import UpstreamRetry
+from app.services.runtime_config import runtime_config_instance, ConfigSnapshot
+from app.services.choice_fanout import ChoiceFanOut, extra_candidate_texts
+from app.services.scheduler import upstream_scheduler_instance, SchedulerQueueFullError
+from app.utils.openai_formatter import format_to_openai_response
+from app.utils.token_counter import count_message_tokens
+
+try:
+    import fcntl
+except ImportError: # Windows: sem trava entre workers (rode um único worker com batches)
+    fcntl = None
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# Estados em que o batch ainda precisa de um executor (retomados no startup)
+ACTIVE_STATUSES = ("validating", "in_progress", "finalizing", "cancelling")
+
+BATCH_ITEMS = metrics_registry.counter(
+    "proxy_batch_items_total",
+    "Itens de batch executados, por resultado.",
+    ("outcome",),
+)
+
+
+class BatchItem(BaseModel):
+    """Uma linha do arquivo de entrada de um batch."""
+    custom_id: str
+    method: str = "POST"
+    url: str = BATCH_ENDPOINT
+    body: ChatCompletionRequest
+
+
+class FileRecord(BaseModel):
+    owner: str # Hash da API key dona do arquivo
+    file: FileObject
+
+
+class BatchRecord(BaseModel):
+    owner: str
+    batch: BatchObject
+
+
+def owner_for_api_key(api_key: str) -> str:
+    """Arquivos e batches só são visíveis para a API key que os criou; no disco fica só um hash dela."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:32]
+
+
+def _write_json_atomic(path: str, payload: str) -> None:
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as output_file:
+        output_file.write(payload)
+    os.replace(temporary_path, path)
+
+
+def _append_line(path: str, line: str) -> None:
+    with open(path, "a", encoding="utf-8") as output_file:
+        output_file.write(line + "\n")
+        output_file.flush()
+        os.fsync(output_file.fileno())
+
+
+def _read_checkpoint(path: str) -> List[str]:
+    """
+    custom_ids já gravados num arquivo de resultados. Uma última linha incompleta (queda no meio
+    da escrita) é descartada do arquivo, e o item correspondente é executado de novo.
+    """
+    if not os.path.exists(path):
+        return []
+    done: List[str] = []
+    valid_bytes = 0
+    with open(path, "rb") as input_file:
+        for raw_line in input_file:
+            try:
+                done.append(json.loads(raw_line)["custom_id"])
+            except (ValueError, KeyError):
+                break
+            valid_bytes += len(raw_line)
+    if valid_bytes < os.path.getsize(path):
+        with open(path, "r+b") as output_file:
+            output_file.truncate(valid_bytes)
+    return done
+
+
+class BatchRunner:
+    """
+    Batch API no formato da OpenAI: o arquivo JSONL enviado em /v1/files é executado dentro do
+    proxy por um pool limitado de workers, que usa as contas do pool e os slots do scheduler
+    como qualquer requisição. Cada resultado é gravado (com fsync) assim que fica pronto; após
+    um restart, o batch é retomado a partir dos itens que ainda não têm resultado.
+    """
+
+    def __init__(self, storage_dir: str, max_concurrency: int, item_max_attempts: int):
+        self.storage_dir = storage_dir
+        self.max_concurrency = max(max_concurrency, 1)
+        self.item_max_attempts = max(item_max_attempts, 1)
+        self._files_dir = os.path.join(storage_dir, "files")
+        self._batches_dir = os.path.join(storage_dir, "batches")
+        # Limite global: vale para a soma dos batches em execução neste processo.
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._records: Dict[str, BatchRecord] = {}
+        self._locks: Dict[str, Any] = {}
+
+    def _ensure_dirs(self) -> None:
+        os.makedirs(self._files_dir, exist_ok=True)
+        os.makedirs(self._batches_dir, exist_ok=True)
+
+    def _file_paths(self, file_id: str) -> Tuple[str, str]:
+        base = os.path.join(self._files_dir, file_id)
+        return f"{base}.json", f"{base}.jsonl"
+
+    def _batch_path(self, batch_id: str, suffix: str = "json") -> str:
+        return os.path.join(self._batches_dir, f"{batch_id}.{suffix}")
+
+    # --- Arquivos ---
+
+    async def create_file(self, owner: str, filename: str, purpose: str, source: BinaryIO) -> FileObject:
+        self._ensure_dirs()
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        metadata_path, content_path = self._file_paths(file_id)
+
+        def _copy() -> int:
+            size = 0
+            with open(content_path, "wb") as output_file:
+                while chunk := source.read(1024 * 1024):
+                    size += len(chunk)
+                    if size > settings.BATCH_MAX_FILE_BYTES:
+                        break
+                    output_file.write(chunk)
+            if size > settings.BATCH_MAX_FILE_BYTES:
+                os.remove(content_path)
+                raise ValueError(f"File exceeds the maximum size of {settings.BATCH_MAX_FILE_BYTES} bytes.")
+            return size
+
+        size = await asyncio.to_thread(_copy)
+        file_object = FileObject(id=file_id, bytes=size, created_at=int(time.time()), filename=filename, purpose=purpose)
+        await asyncio.to_thread(_write_json_atomic, metadata_path, FileRecord(owner=owner, file=file_object).model_dump_json())
+        logger.info("Arquivo {} recebido ({} bytes, purpose '{}').", file_id, size, purpose)
+        return file_object
+
+    def get_file(self, owner: str, file_id: str) -> Optional[FileObject]:
+        metadata_path, _ = self._file_paths(os.path.basename(file_id))
+        try:
+            with open(metadata_path, "r", encoding="utf-8") as input_file:
+                record = FileRecord.model_validate_json(input_file.read())
+        except (OSError, ValidationError):
+            return None
+        return record.file if record.owner == owner else None
+
+    def file_content_path(self, owner: str, file_id: str) -> Optional[str]:
+        if self.get_file(owner, file_id) is None:
+            return None
+        return self._file_paths(os.path.basename(file_id))[1]
+
+    def _register_file(self, owner: str, file_id: str, source_path: str, filename: str, purpose: str) -> None:
+        metadata_path, content_path = self._file_paths(file_id)
+        os.replace(source_path, content_path)
+        file_object = FileObject(
+            id=file_id, bytes=os.path.getsize(content_path), created_at=int(time.time()), filename=filename, purpose=purpose
+        )
+        _write_json_atomic(metadata_path, FileRecord(owner=owner, file=file_object).model_dump_json())
+
+    # --- Batches ---
+
+    async def create_batch(self, owner: str, request: BatchCreateRequest) -> BatchObject:
+        input_file = self.get_file(owner, request.input_file_id)
+        if input_file is None:
+            raise KeyError(request.input_file_id)
+        if input_file.purpose != "batch":
+            raise ValueError(f"File {request.input_file_id} was not uploaded with purpose 'batch'.")
+        batch = BatchObject(
+            id=f"batch_{uuid.uuid4().hex[:24]}",
+            endpoint=request.endpoint,
+            input_file_id=request.input_file_id,
+            completion_window=request.completion_window,
+            status="validating",
+            created_at=int(time.time()),
+            metadata=request.metadata,
+        )
+        record = BatchRecord(owner=owner, batch=batch)
+        await self._save(record)
+        self._start(record)
+        return batch
+
+    def _load(self, batch_id: str) -> Optional[BatchRecord]:
+        record = self._records.get(batch_id)
+        if record is not None:
+            return record
+        try:
+            with open(self._batch_path(os.path.basename(batch_id)), "r", encoding="utf-8") as input_file:
+                return BatchRecord.model_validate_json(input_file.read())
+        except (OSError, ValidationError):
+            return None
+
+    def get_batch(self, owner: str, batch_id: str) -> Optional[BatchObject]:
+        record = self._load(batch_id)
+        return record.batch if record is not None and record.owner == owner else None
+
+    def list_batches(self, owner: str, limit: int = 20) -> List[BatchObject]:
+        if not os.path.isdir(self._batches_dir):
+            return []
+        batches = []
+        for name in os.listdir(self._batches_dir):
+            if name.endswith(".json"):
+                batch = self.get_batch(owner, name[:-len(".json")])
+                if batch is not None:
+                    batches.append(batch)
+        batches.sort(key=lambda batch: batch.created_at, reverse=True)
+        return batches[:limit]
+
+    async def cancel_batch(self, owner: str, batch_id: str) -> Optional[BatchObject]:
+        record = self._load(batch_id)
+        if record is None or record.owner != owner:
+            return None
+        if record.batch.status in ("validating", "in_progress"):
+            # O executor (neste ou em outro worker) encerra os itens pendentes ao ver o novo estado.
+            self._set_status(record, "cancelling")
+            await self._save(record)
+        return record.batch
+
+    async def _save(self, record: BatchRecord) -> None:
+        self._ensure_dirs()
+        await asyncio.to_thread(_write_json_atomic, self._batch_path(record.batch.id), record.model_dump_json())
+
+    @staticmethod
+    def _set_status(record: BatchRecord, status: str) -> None:
+        record.batch.status = status
+        setattr(record.batch, f"{status}_at", int(time.time()))
+
+    def _try_lock(self, batch_id: str) -> bool:
+        """Garante um único executor por batch quando vários workers compartilham o diretório."""
+        if fcntl is None:
+            return True
+        lock_file = open(self._batch_path(batch_id, "lock"), "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._locks[batch_id] = lock_file
+        return True
+
+    def _release_lock(self, batch_id: str) -> None:
+        lock_file = self._locks.pop(batch_id, None)
+        if lock_file is not None:
+            lock_file.close()
+
+    def _start(self, record: BatchRecord) -> None:
+        batch_id = record.batch.id
+        if batch_id in self._tasks or not self._try_lock(batch_id):
+            return
+        self._records[batch_id] = record
+        self._tasks[batch_id] = asyncio.create_task(self._run(record))
+
+    def resume_pending(self) -> None:
+        """Retoma, no startup, os batches que estavam em execução quando o processo parou."""
+        if not os.path.isdir(self._batches_dir):
+            return
+        for name in os.listdir(self._batches_dir):
+            if not name.endswith(".json"):
+                continue
+            record = self._load(name[:-len(".json")])
+            if record is not None and record.batch.status in ACTIVE_STATUSES:
+                logger.info("Retomando batch {} ({}).", record.batch.id, record.batch.status)
+                self._start(record)
+
+    def _parse_input(self, record: BatchRecord) -> Tuple[List[BatchItem], List[BatchError]]:
+        _, content_path = self._file_paths(record.batch.input_file_id)
+        items: List[BatchItem] = []
+        errors: List[BatchError] = []
+        seen_ids = set()
+        with open(content_path, "r", encoding="utf-8") as input_file:
+            for line_number, line in enumerate(input_file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    item = BatchItem.model_validate_json(line)
+                except ValidationError as e:
+                    first_error = e.errors()[0]
+                    location = ".".join(str(part) for part in first_error["loc"])
+                    errors.append(BatchError(
+                        code="invalid_request",
+                        message=f"{location}: {first_error['msg']}" if location else first_error["msg"],
+                        line=line_number,
+                    ))
+                    continue
+                if item.url != record.batch.endpoint or item.method.upper() != "POST":
+                    errors.append(BatchError(code="invalid_url", message=f"Only POST {BATCH_ENDPOINT} is supported.", line=line_number))
+                elif item.custom_id in seen_ids:
+                    errors.append(BatchError(code="duplicate_custom_id", message=f"Duplicate custom_id '{item.custom_id}'.", line=line_number))
+                else:
+                    seen_ids.add(item.custom_id)
+                    items.append(item)
+        if len(items) > settings.BATCH_MAX_REQUESTS:
+            errors.append(BatchError(code="too_many_requests", message=f"A batch may contain at most {settings.BATCH_MAX_REQUESTS} requests."))
+        if not items and not errors:
+            errors.append(BatchError(code="empty_file", message="The input file has no requests."))
+        return items, errors
+
+    async def _run(self, record: BatchRecord) -> None:
+        batch = record.batch
+        try:
+            items, errors = await asyncio.to_thread(self._parse_input, record)
+            if errors:
+                logger.warning("Batch {} inválido: {} erro(s) no arquivo de entrada.", batch.id, len(errors))
+                batch.errors = BatchErrors(data=errors[:100])
+                self._set_status(record, "failed")
+                await self._save(record)
+                return
+
+            output_path, error_path = self._batch_path(batch.id, "output.jsonl"), self._batch_path(batch.id, "errors.jsonl")
+            completed_ids = await asyncio.to_thread(_read_checkpoint, output_path)
+            failed_ids = await asyncio.to_thread(_read_checkpoint, error_path)
+            done_ids = set(completed_ids) | set(failed_ids)
+            batch.request_counts.total = len(items)
+            batch.request_counts.completed = len(completed_ids)
+            batch.request_counts.failed = len(failed_ids)
+            if batch.status == "validating":
+                self._set_status(record, "in_progress")
+            await self._save(record)
+
+            pending = [item for item in items if item.custom_id not in done_ids]
+            if pending and batch.status == "in_progress":
+                logger.info("Batch {}: executando {} de {} requisições.", batch.id, len(pending), len(items))
+                await self._execute_items(record, pending, output_path, error_path)
+
+            # Cancelado ou não, os resultados já obtidos ficam disponíveis para download.
+            cancelled = self._refresh_cancel(record)
+            if not cancelled:
+                self._set_status(record, "finalizing")
+                await self._save(record)
+            await asyncio.to_thread(self._finalize_files, record, output_path, error_path)
+            self._set_status(record, "cancelled" if cancelled else "completed")
+            await self._save(record)
+            logger.info(
+                "Batch {} {}: {} concluída(s), {} com erro.",
+                batch.id, batch.status, batch.request_counts.completed, batch.request_counts.failed,
+            )
+        except asyncio.CancelledError:
+            # Encerramento do processo: o estado em disco permite retomar no próximo startup.
+            logger.info("Batch {} interrompido; será retomado no próximo startup.", batch.id)
+            await self._save(record)
+            raise
+        except Exception as e:
+            logger.exception("Falha inesperada no batch {}: {}", batch.id, e)
+            batch.errors = BatchErrors(data=[BatchError(code="internal_error", message=str(e))])
+            self._set_status(record, "failed")
+            await self._save(record)
+        finally:
+            self._tasks.pop(batch.id, None)
+            self._records.pop(batch.id, None)
+            self._release_lock(batch.id)
+
+    def _refresh_cancel(self, record: BatchRecord) -> bool:
+        """Indica se o batch foi cancelado, inclusive por outro worker (que só grava o estado em disco)."""
+        if record.batch.status == "cancelling":
+            return True
+        try:
+            with open(self._batch_path(record.batch.id), "r", encoding="utf-8") as input_file:
+                on_disk = BatchRecord.model_validate_json(input_file.read())
+        except (OSError, ValidationError):
+            return False
+        if on_disk.batch.status == "cancelling":
+            record.batch.status = on_disk.batch.status
+            record.batch.cancelling_at = on_disk.batch.cancelling_at
+            return True
+        return False
+
+    async def _execute_items(self, record: BatchRecord, pending: List[BatchItem], output_path: str, error_path: str) -> None:
+        queue: "asyncio.Queue[BatchItem]" = asyncio.Queue()
+        for item in pending:
+            queue.put_nowait(item)
+        write_lock = asyncio.Lock()
+        last_saved_at = time.monotonic()
+
+        async def worker() -> None:
+            nonlocal last_saved_at
+            while not queue.empty():
+                if record.batch.status == "cancelling":
+                    return
+                item = queue.get_nowait()
+                async with self._slots:
+                    line, succeeded = await self._execute_item(item, record.owner)
+                async with write_lock:
+                    await asyncio.to_thread(_append_line, output_path if succeeded else error_path, line)
+                    if succeeded:
+                        record.batch.request_counts.completed += 1
+                    else:
+                        record.batch.request_counts.failed += 1
+                    # O progresso (request_counts) é gravado no máximo uma vez por segundo;
+                    # os arquivos de resultado são o checkpoint de verdade.
+                    if time.monotonic() - last_saved_at >= 1.0:
+                        last_saved_at = time.monotonic()
+                        self._refresh_cancel(record)
+                        await self._save(record)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.max_concurrency, len(pending)))))
+
+    async def _execute_item(self, item: BatchItem, owner: str) -> Tuple[str, bool]:
+        """Executa um item e monta sua linha de resultado no formato da Batch API da OpenAI."""
+        line: Dict[str, Any] = {"id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": item.custom_id}
+        try:
+            completion = await self._complete(item.body, owner)
+        except Exception as e:
+            logger.warning("Item '{}' do batch falhou: {}: {}", item.custom_id, type(e).__name__, e)
+            BATCH_ITEMS.inc(outcome="failed")
+            line.update(response=None, error={"code": type(e).__name__, "message": str(e)})
+            return json.dumps(line, ensure_ascii=False), False
+        BATCH_ITEMS.inc(outcome="completed")
+        line.update(
+            response={"status_code": 200, "request_id": uuid.uuid4().hex, "body": completion.model_dump(exclude_none=True)},
+            error=None,
+        )
+        return json.dumps(line, ensure_ascii=False), True
+
+    async def _complete(self, request_payload: ChatCompletionRequest, owner: str) -> ChatCompletionResponse:
+        """
+        Uma requisição sem estado (histórico inteiro no prompt), com as mesmas tentativas do endpoint.
+        Ocupa os slots das contas pela fila "batch": requisições interativas são atendidas antes.
+        """
+        config_snapshot = runtime_config_instance.current
+        gemini_model_name = config_snapshot.gemini_model_name(request_payload.model)
+        upstream_retry = UpstreamRetry(
+            model_chain=config_snapshot.model_fallback_chain(gemini_model_name),
+            max_attempts=self.item_max_attempts,
+            base_delay_seconds=settings.UPSTREAM_RETRY_BASE_DELAY_SECONDS,
+            max_delay_seconds=settings.UPSTREAM_RETRY_MAX_DELAY_SECONDS,
+            deadline_seconds=0, # Sem prazo: o batch não tem um cliente esperando
+        )
+        prompt = render_messages(request_payload.messages)
+        async with attachment_store_instance.materialize(attachment_parts(request_payload.messages)) as attachment_files:
+            while True:
+                try:
+                    account = await gemini_service_instance.acquire_account()
+                    error: Optional[BaseException] = None
+                    try:
+                        async with upstream_scheduler_instance.upstream_slot(account.name, client_key=owner, lane="batch"):
+                            chat_session = account.client.start_chat(model=config_snapshot.model_enum(upstream_retry.model_name))
+                            model_output = await chat_session.send_message(prompt, files=attachment_files or None)
+                    except BaseException as e:
+                        error = e
+                        raise
+                    finally:
+                        gemini_service_instance.release_account(account, error)
+                    return format_to_openai_response(
+                        prompt_text=None,
+                        gemini_response_text=output_text(model_output),
+                        model_name=request_payload.model,
+                        prompt_tokens=count_message_tokens(request_payload.messages),
+                        stop=request_payload.stop,
+                        max_tokens=request_payload.max_tokens,
+                        extra_choice_texts=await self._extra_choices(
+                            request_payload, model_output, config_snapshot, upstream_retry.model_name, owner
+                        ),
+                    )
+                except (NoAvailableAccountError, SchedulerQueueFullError) as e:
+                    # Falta de capacidade não é falha do item: espera e tenta de novo.
+                    await asyncio.sleep(e.retry_after)
+                except Exception as e:
+                    retry_delay = upstream_retry.next_delay(e)
+                    if retry_delay is None:
+                        raise
+                    await asyncio.sleep(retry_delay)
+
+    async def _extra_choices(
+        self,
+        request_payload: ChatCompletionRequest,
+        model_output,
+        config_snapshot: ConfigSnapshot,
+        model_name: str,
+        owner: str,
+    ) -> List[str]:
+        """Escolhas 1..n-1 de um item com `n` > 1: os demais candidatos e, se faltarem, chamadas extras."""
+        choice_count = min(request_payload.n or 1, settings.CHAT_COMPLETION_MAX_CHOICES)
+        if choice_count <= 1:
+            return []
+        extra_choice_texts = extra_candidate_texts(model_output, choice_count - 1)
+        choice_fan_out = ChoiceFanOut(
+            messages=request_payload.messages,
+            config_snapshot=config_snapshot,
+            model_chain=config_snapshot.model_fallback_chain(model_name),
+            client_key=owner,
+            lane="batch",
+        )
+        # Só as escolhas que os candidatos não cobrem vão ao upstream.
+        choice_fan_out.start(choice_count - 1 - len(extra_choice_texts), stream=False)
+        return await choice_fan_out.collect(choice_count - 1, extra_choice_texts)
+
+    def _finalize_files(self, record: BatchRecord, output_path: str, error_path: str) -> None:
+        batch = record.batch
+        if os.path.exists(output_path):
+            batch.output_file_id = f"file-{uuid.uuid4().hex[:24]}"
+            self._register_file(record.owner, batch.output_file_id, output_path, f"{batch.id}_output.jsonl", "batch_output")
+        if os.path.exists(error_path):
+            batch.error_file_id = f"file-{uuid.uuid4().hex[:24]}"
+            self._register_file(record.owner, batch.error_file_id, error_path, f"{batch.id}_error.jsonl", "batch_output")
+
+    async def close(self) -> None:
+        """Interrompe os batches em execução; o checkpoint em disco permite retomá-los depois."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": len(self._tasks),
+            "max_concurrency": self.max_concurrency,
+        }
+
+
+# Instância global do executor de batches para ser usada pela aplicação FastAPI
+batch_runner_instance = BatchRunner(
+    storage_dir=settings.BATCH_STORAGE_DIR,
+    max_concurrency=settings.BATCH_MAX_CONCURRENCY,
+    item_max_attempts=settings.BATCH_ITEM_MAX_ATTEMPTS,
+)
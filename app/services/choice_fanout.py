@@ -0,0 +1,186 @@
+import asyncio
+from contextlib import AsyncExitStack
+from typing import AsyncIterator, List, Sequence, Tuple
+
+from loguru import logger
+
+from app.models.openai_schemas import ChatMessage
+from app.services.attachments import attachment_store_instance, attachment_parts, render_output_images
+from app.services.gemini_service import gemini_service_instance
+from app.services.history_renderer import render_messages
+from app.services.metrics import metrics_registry
+from app.services.retry import create_upstream_retry
+from app.services.runtime_config import ConfigSnapshot
+from app.services.scheduler import upstream_scheduler_instance
+
+CHOICE_SOURCES = metrics_registry.counter(
+    "proxy_choices_total",
+    "Escolhas adicionais (n > 1) por origem: candidato da resposta do Gemini ou chamada extra ao upstream.",
+    ("source",),
+)
+
+
+def extra_candidate_texts(model_output, limit: int) -> List[str]:
+    """
+    Textos dos candidatos da resposta além do escolhido (que é a escolha 0), na ordem do Gemini,
+    no máximo `limit`. Cada um com suas imagens, como em `output_text`.
+    """
+    texts = []
+    for index, candidate in enumerate(getattr(model_output, "candidates", None) or ()):
+        if len(texts) >= limit:
+            break
+        if index == getattr(model_output, "chosen", 0):
+            continue
+        texts.append((candidate.text or "") + render_output_images(getattr(candidate, "images", None)))
+    return texts
+
+
+async def _single_delta(text: str) -> AsyncIterator[str]:
+    if text:
+        yield text
+
+
+class ChoiceFanOut:
+    """
+    Gera as escolhas 1..n-1 de uma requisição com `n` > 1. Cada escolha é uma chamada
+    independente: uma conversa nova do Gemini com o histórico inteiro no prompt (como no modo
+    stateless), com as mesmas tentativas do endpoint. Cada uma ocupa sua própria conta e slot do
+    scheduler, na fila e com o peso da API key: a concorrência fica limitada como a de
+    requisições avulsas, e a ChatSession da conversa não é alterada.
+
+    Sem streaming, as chamadas só são disparadas depois da principal e só para as escolhas que
+    os outros candidatos (rascunhos) da resposta do Gemini não cobrem: menos cota, ao custo de
+    uma segunda ida ao upstream quando faltam escolhas. Com streaming, a gemini-webapi só
+    transmite o candidato escolhido, então as n-1 chamadas são disparadas junto com a principal
+    para não atrasar o primeiro chunk das demais escolhas.
+    """
+
+    def __init__(
+        self,
+        messages: List[ChatMessage],
+        config_snapshot: ConfigSnapshot,
+        model_chain: Sequence[str],
+        client_key: str,
+        weight: float = 1.0,
+        lane: str = "interactive",
+    ):
+        self.prompt = render_messages(messages)
+        self.attachments = attachment_parts(messages)
+        self.config_snapshot = config_snapshot
+        self.model_chain = model_chain
+        self.client_key = client_key
+        self.weight = weight
+        self.lane = lane
+        self._tasks: List[asyncio.Task] = []
+
+    async def _open(self, resources: AsyncExitStack, stream: bool) -> AsyncIterator[str]:
+        """Faz a chamada (com novas tentativas até o primeiro delta) e devolve seus deltas de texto."""
+        attachment_files = await resources.enter_async_context(attachment_store_instance.materialize(self.attachments))
+        upstream_retry = create_upstream_retry(self.model_chain)
+        while True:
+            try:
+                async with AsyncExitStack() as attempt_resources:
+                    account = await gemini_service_instance.acquire_account()
+                    attempt_resources.push(
+                        lambda exc_type, exc, tb, account=account: gemini_service_instance.release_account(account, exc)
+                    )
+                    await attempt_resources.enter_async_context(upstream_scheduler_instance.upstream_slot(
+                        account.name, client_key=self.client_key, weight=self.weight, lane=self.lane
+                    ))
+                    chat_session = account.client.start_chat(model=self.config_snapshot.model_enum(upstream_retry.model_name))
+                    if stream and gemini_service_instance.supports_streaming(chat_session):
+                        text_deltas = await gemini_service_instance.open_text_stream(chat_session, self.prompt, attachment_files)
+                        # A conta e o slot ficam com o stream até ele terminar.
+                        resources.push_async_exit(attempt_resources.pop_all())
+                        return text_deltas
+                    model_output = await chat_session.send_message(self.prompt, files=attachment_files or None)
+                    return _single_delta(
+                        (model_output.text or "") + render_output_images(getattr(model_output, "images", None))
+                    )
+            except Exception as e:
+                retry_delay = upstream_retry.next_delay(e)
+                if retry_delay is None:
+                    raise
+                await asyncio.sleep(retry_delay)
+
+    async def _run(self, stream: bool) -> Tuple[AsyncIterator[str], AsyncExitStack]:
+        resources = AsyncExitStack()
+        try:
+            return await self._open(resources, stream), resources
+        except BaseException:
+            await resources.aclose()
+            raise
+
+    def start(self, count: int, stream: bool) -> None:
+        """Dispara `count` chamadas; com `stream`, cada uma fica aberta após o primeiro delta."""
+        if count > 0:
+            logger.info("Gerando {} escolha(s) adicional(is) em chamadas simultâneas ao upstream.", count)
+        self._tasks = [asyncio.create_task(self._run(stream)) for _ in range(count)]
+
+    def cancel(self) -> None:
+        """Cancela as chamadas (ex.: a principal falhou) e libera as que já estavam abertas."""
+        for task in self._tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled() and task.exception() is None:
+                text_deltas, resources = task.result()
+                asyncio.create_task(_discard(text_deltas, resources))
+        self._tasks = []
+
+    async def collect(self, count: int, candidate_texts: Sequence[str] = ()) -> List[str]:
+        """
+        Textos de `count` escolhas: primeiro `candidate_texts` (os demais candidatos da resposta
+        principal), depois os resultados das chamadas. Chamadas que sobram porque os candidatos
+        já cobriram a escolha são canceladas se ainda não terminaram.
+        """
+        tasks, self._tasks = self._tasks, []
+        surplus = len(candidate_texts) + len(tasks) - count
+        replaced = set()
+        for task in reversed(tasks):
+            if len(replaced) >= surplus:
+                break
+            if not task.done():
+                task.cancel()
+                replaced.add(task)
+        try:
+            texts = [await _read_all(*await task) for task in tasks if task not in replaced]
+        except BaseException:
+            self._tasks = tasks
+            self.cancel()
+            raise
+        await asyncio.gather(*replaced, return_exceptions=True)
+        choice_texts = [*candidate_texts, *texts][:count]
+        used_candidates = min(len(candidate_texts), len(choice_texts))
+        CHOICE_SOURCES.inc(used_candidates, source="candidate")
+        CHOICE_SOURCES.inc(len(choice_texts) - used_candidates, source="upstream")
+        return choice_texts
+
+    def streams(self) -> List[AsyncIterator[str]]:
+        """Deltas de cada chamada extra iniciada com `start(..., stream=True)`."""
+        tasks, self._tasks = self._tasks, []
+        CHOICE_SOURCES.inc(len(tasks), source="upstream")
+        return [_stream_task(task) for task in tasks]
+
+
+async def _read_all(text_deltas: AsyncIterator[str], resources: AsyncExitStack) -> str:
+    async with resources:
+        return "".join([delta async for delta in text_deltas])
+
+
+async def _discard(text_deltas: AsyncIterator[str], resources: AsyncExitStack) -> None:
+    async with resources:
+        await text_deltas.aclose()
+
+
+async def _stream_task(task: "asyncio.Task[Tuple[AsyncIterator[str], AsyncExitStack]]") -> AsyncIterator[str]:
+    try:
+        text_deltas, resources = await task
+    except BaseException:
+        task.cancel()
+        raise
+    async with resources:
+        try:
+            async for delta in text_deltas:
+                yield delta
+        finally:
+            await text_deltas.aclose()
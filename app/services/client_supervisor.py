@@ -0,0 +1,201 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Optional, Dict, Any
+
+from loguru import logger
+
+from app.core.config import settings
+from app.services.gemini_service import GeminiService, GeminiAccount, gemini_service_instance
+
+PSIDTS_COOKIE = "__Secure-1PSIDTS"
+
+
+def _digest(value: Optional[str]) -> str:
+    return hashlib.sha256((value or "").encode("utf-8")).hexdigest()[:32]
+
+
+class CookieStore:
+    """
+    Guarda em disco o último __Secure-1PSIDTS de cada conta (a biblioteca o rotaciona a cada
+    ~9 min), para que um restart não volte ao valor do .env, que o Google já pode ter invalidado.
+
+    Cada entrada registra o hash do __Secure-1PSID e do __Secure-1PSIDTS configurados: se o .env
+    mudar (cookies novos colados à mão), a entrada antiga é ignorada e o valor configurado vale.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def load(self) -> None:
+        if not self.enabled or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as input_file:
+                entries = json.load(input_file)
+        except (OSError, ValueError) as e:
+            logger.warning("Não foi possível ler os cookies persistidos em '{}': {}", self.path, e)
+            return
+        self._entries = entries if isinstance(entries, dict) else {}
+
+    def persisted_1psidts(self, account: GeminiAccount, configured_1psidts: Optional[str]) -> Optional[str]:
+        entry = self._entries.get(account.name)
+        if not entry:
+            return None
+        if entry.get("psid") != _digest(account.secure_1psid) or entry.get("configured_psidts") != _digest(configured_1psidts):
+            return None
+        return entry.get("secure_1psidts") or None
+
+    def remember(self, account: GeminiAccount, configured_1psidts: Optional[str], secure_1psidts: str) -> None:
+        self._entries[account.name] = {
+            "psid": _digest(account.secure_1psid),
+            "configured_psidts": _digest(configured_1psidts),
+            "secure_1psidts": secure_1psidts,
+            "updated_at": int(time.time()),
+        }
+
+    def save(self) -> None:
+        """Grava atomicamente (arquivo temporário + rename), legível só pelo dono: são credenciais."""
+        if not self.enabled:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary_path = f"{self.path}.tmp"
+        file_descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(file_descriptor, "w", encoding="utf-8") as output_file:
+            json.dump(self._entries, output_file, indent=2)
+        os.replace(temporary_path, self.path)
+
+
+class ClientSupervisor:
+    """
+    Mantém os clients do pool aquecidos, em background:
+
+    - client que parou (fechado, falha na inicialização, AuthError após o cool-down) é
+      reinicializado antes que uma requisição precise dele;
+    - clients mais velhos que GEMINI_CLIENT_MAX_AGE_SECONDS são substituídos por um novo, criado
+      em paralelo e trocado atomicamente (`GeminiService.replace_client`);
+    - o __Secure-1PSIDTS rotacionado pela biblioteca é copiado para a conta (clients novos já
+      nascem com ele) e persistido em GEMINI_COOKIE_STORE_PATH.
+    """
+
+    def __init__(
+        self,
+        service: GeminiService,
+        enabled: bool,
+        interval_seconds: float,
+        client_max_age_seconds: float,
+        cookie_store_path: str,
+    ):
+        self.service = service
+        self.enabled = enabled
+        self.interval_seconds = interval_seconds
+        self.client_max_age_seconds = client_max_age_seconds
+        self.cookie_store = CookieStore(cookie_store_path)
+        # Valor do .env de cada conta, para detectar cookies trocados manualmente
+        self._configured_1psidts: Dict[str, Optional[str]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.checks = 0
+        self.cookie_updates = 0
+
+    def apply_persisted_cookies(self) -> None:
+        """Antes do warm-up: substitui o __Secure-1PSIDTS do .env pelo último valor persistido."""
+        self.cookie_store.load()
+        for account in self.service.accounts:
+            self._configured_1psidts[account.name] = account.secure_1psidts
+            persisted = self.cookie_store.persisted_1psidts(account, account.secure_1psidts)
+            if persisted and persisted != account.secure_1psidts:
+                account.secure_1psidts = persisted
+                logger.info("Usando o __Secure-1PSIDTS persistido da conta '{}'.", account.name)
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run(), name="gemini-client-supervisor")
+            logger.info("Supervisor dos clients Gemini ativo (verificação a cada {:.0f}s).", self.interval_seconds)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for account in self.service.accounts:
+            if account.is_refreshing:
+                account.refresh_task.cancel()
+        await self._persist_rotated_cookies()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error("Erro na verificação dos clients Gemini: {}", e)
+
+    async def check(self) -> None:
+        """Uma rodada do supervisor: persiste cookies rotacionados e agenda as substituições necessárias."""
+        self.checks += 1
+        await self._persist_rotated_cookies()
+        now = time.monotonic()
+        for account in self.service.accounts:
+            if account.is_refreshing or account.is_cooling_down(now) or not account.secure_1psid:
+                continue
+            if not account.is_ready:
+                self.service.schedule_client_refresh(account, reason="not_ready")
+            elif self.client_max_age_seconds > 0 and now - account.client_created_at >= self.client_max_age_seconds:
+                self.service.schedule_client_refresh(account, reason="max_age")
+
+    async def _persist_rotated_cookies(self) -> None:
+        changed = False
+        for account in self.service.accounts:
+            cookies = getattr(account.client, "cookies", None) or {}
+            rotated = cookies.get(PSIDTS_COOKIE)
+            if not rotated or rotated == account.secure_1psidts:
+                continue
+            account.secure_1psidts = rotated
+            self.cookie_store.remember(account, self._configured_1psidts.get(account.name), rotated)
+            self.cookie_updates += 1
+            changed = True
+            logger.info("__Secure-1PSIDTS da conta '{}' rotacionado; novos clients usarão o valor atualizado.", account.name)
+        if changed and self.cookie_store.enabled:
+            try:
+                await asyncio.to_thread(self.cookie_store.save)
+            except OSError as e:
+                logger.error("Falha ao persistir os cookies em '{}': {}", self.cookie_store.path, e)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "checks": self.checks,
+            "cookie_updates": self.cookie_updates,
+            "accounts": {
+                account.name: {
+                    "ready": account.is_ready,
+                    "refreshing": account.is_refreshing,
+                    "client_age_seconds": round(now - account.client_created_at, 1) if account.client is not None else None,
+                    "in_flight": account.in_flight,
+                    "cooling_down": account.is_cooling_down(now),
+                }
+                for account in self.service.accounts
+            },
+        }
+
+
+# Instância global do supervisor para ser usada pela aplicação FastAPI
+client_supervisor_instance = ClientSupervisor(
+    service=gemini_service_instance,
+    enabled=settings.GEMINI_SUPERVISOR_ENABLED,
+    interval_seconds=settings.GEMINI_SUPERVISOR_INTERVAL_SECONDS,
+    client_max_age_seconds=settings.GEMINI_CLIENT_MAX_AGE_SECONDS,
+    cookie_store_path=settings.GEMINI_COOKIE_STORE_PATH,
+)
@@ -0,0 +1,64 @@
+import asyncio
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from fastapi import Request
+from loguru import logger
+
+T = TypeVar("T")
+
+# Status registrado quando o cliente desconecta antes da resposta (convenção do nginx); nunca chega ao cliente
+CLIENT_CLOSED_REQUEST = 499
+
+
+class ClientDisconnectedError(Exception):
+    """O cliente fechou a conexão antes da resposta; o trabalho da requisição foi cancelado."""
+
+
+async def wait_for_disconnect(request: Request) -> None:
+    """
+    Retorna quando o servidor ASGI avisa que o cliente desconectou. O corpo da requisição já
+    foi lido pelo FastAPI, então a única mensagem que ainda pode chegar é `http.disconnect`.
+    """
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def cancel_on_disconnect(
+    request: Request,
+    work: Awaitable[T],
+    keep_running: Optional[Callable[[], bool]] = None,
+) -> T:
+    """
+    Executa `work` enquanto o cliente estiver conectado. Se ele desconectar antes, `work` é
+    cancelado (liberando o que ele segura: turno da conversa, conta, slot, chamada ao Gemini)
+    e ClientDisconnectedError é lançado.
+
+    `keep_running` permite terminar o trabalho mesmo assim, quando outros dependem do resultado
+    (ex.: requisições idênticas aguardando o mesmo upstream).
+    """
+    work_task = asyncio.ensure_future(work)
+    disconnect_task = asyncio.create_task(wait_for_disconnect(request))
+    try:
+        await asyncio.wait((work_task, disconnect_task), return_when=asyncio.FIRST_COMPLETED)
+    except BaseException:
+        work_task.cancel()
+        disconnect_task.cancel()
+        raise
+    if work_task.done():
+        disconnect_task.cancel()
+        return work_task.result()
+    if disconnect_task.exception() is not None:
+        # Sem como acompanhar a conexão: a requisição segue como antes.
+        return await work_task
+
+    if keep_running is not None and keep_running():
+        logger.info("Cliente desconectou, mas outras requisições aguardam o mesmo upstream; a chamada continua.")
+        return await work_task
+    work_task.cancel()
+    try:
+        await work_task
+    except (asyncio.CancelledError, Exception):
+        pass
+    raise ClientDisconnectedError("Client closed the connection before the response was sent.")
@@ -0,0 +1,143 @@
+import asyncio
+import itertools
+import random
+import uuid
+from typing import Optional, List, Any, AsyncIterator, Dict
+
+from gemini_webapi.constants import Model
+from gemini_webapi.exceptions import (
+    APIError,
+    AuthError,
+    ModelInvalid,
+    TemporarilyBlocked,
+    TimeoutError as GeminiTimeoutError,
+    UsageLimitExceeded,
+)
+from gemini_webapi.types import ModelOutput, Candidate
+
+# Erros que podem ser injetados pelo backend falso (FAKE_GEMINI_ERROR_TYPE)
+INJECTABLE_ERRORS: Dict[str, type] = {
+    "APIError": APIError,
+    "AuthError": AuthError,
+    "ModelInvalid": ModelInvalid,
+    "TemporarilyBlocked": TemporarilyBlocked,
+    "TimeoutError": GeminiTimeoutError,
+    "UsageLimitExceeded": UsageLimitExceeded,
+}
+
+_WORDS = (
+    "o", "proxy", "responde", "com", "texto", "gerado", "localmente", "para", "medir",
+    "latência", "vazão", "e", "consumo", "de", "memória", "sem", "acessar", "Gemini",
+)
+
+
+class FakeChatSession:
+    """
+    ChatSession local com a mesma interface usada pelo proxy (`send_message`, `send_message_stream`,
+    `metadata`, `model`, `geminiclient`). Gera `response_tokens` palavras a `tokens_per_second`
+    depois de `latency_seconds` (em `candidates` candidatos), e falha com a probabilidade configurada no client.
+    """
+
+    def __init__(
+        self,
+        geminiclient: "FakeGeminiClient",
+        metadata: Optional[List[Optional[str]]] = None,
+        model: Model = Model.UNSPECIFIED,
+        **kwargs: Any,
+    ):
+        self.geminiclient = geminiclient
+        self.model = model
+        self.cid, self.rid, self.rcid = (list(metadata or []) + [None, None, None])[:3]
+        if not geminiclient.streaming:
+            # Simula versões da gemini-webapi sem streaming incremental.
+            self.send_message_stream = None
+
+    @property
+    def metadata(self) -> List[Optional[str]]:
+        return [self.cid, self.rid, self.rcid]
+
+    def _maybe_fail(self) -> None:
+        client = self.geminiclient
+        if client.error_rate > 0 and random.random() < client.error_rate:
+            raise client.error_class(f"Erro injetado pelo backend falso ({client.error_class.__name__}).")
+
+    def _output(self, text: str) -> ModelOutput:
+        # Os rascunhos além do primeiro diferem só por um prefixo, o bastante para distingui-los.
+        candidates = [Candidate(rcid=self.rcid, text=text)] + [
+            Candidate(rcid=f"{self.rcid}_{index}", text=f"({index}) {text}")
+            for index in range(1, self.geminiclient.candidates)
+        ]
+        return ModelOutput(metadata=self.metadata, candidates=candidates)
+
+    def _start_turn(self) -> None:
+        self.cid = self.cid or f"c_{uuid.uuid4().hex[:16]}"
+        self.rid = f"r_{uuid.uuid4().hex[:16]}"
+        self.rcid = f"rc_{uuid.uuid4().hex[:16]}"
+
+    def _chunks(self) -> List[str]:
+        client = self.geminiclient
+        words = [word + " " for word in itertools.islice(itertools.cycle(_WORDS), client.response_tokens)]
+        size = max(client.tokens_per_chunk, 1)
+        return ["".join(words[i:i + size]) for i in range(0, len(words), size)]
+
+    async def send_message(self, prompt: str, files: Optional[List[Any]] = None, **kwargs: Any) -> ModelOutput:
+        client = self.geminiclient
+        await asyncio.sleep(client.latency_seconds)
+        self._maybe_fail()
+        self._start_turn()
+        if client.tokens_per_second > 0:
+            await asyncio.sleep(client.response_tokens / client.tokens_per_second)
+        return self._output("".join(self._chunks()))
+
+    async def send_message_stream(self, prompt: str, files: Optional[List[Any]] = None, **kwargs: Any) -> AsyncIterator[ModelOutput]:
+        client = self.geminiclient
+        await asyncio.sleep(client.latency_seconds)
+        self._maybe_fail()
+        self._start_turn()
+        text = ""
+        for chunk in self._chunks():
+            if client.tokens_per_second > 0:
+                await asyncio.sleep(client.tokens_per_chunk / client.tokens_per_second)
+            text += chunk
+            yield self._output(text)
+
+
+class FakeGeminiClient:
+    """GeminiClient local para benchmarks e testes de carga (GEMINI_BACKEND=fake)."""
+
+    def __init__(
+        self,
+        secure_1psid: Optional[str] = None,
+        secure_1psidts: Optional[str] = None,
+        latency_seconds: float = 0.2,
+        tokens_per_second: float = 200.0,
+        response_tokens: int = 100,
+        tokens_per_chunk: int = 4,
+        error_rate: float = 0.0,
+        error_type: str = "APIError",
+        streaming: bool = True,
+        candidates: int = 1,
+    ):
+        if error_type not in INJECTABLE_ERRORS:
+            raise ValueError(f"FAKE_GEMINI_ERROR_TYPE inválido: '{error_type}'. Use um de {sorted(INJECTABLE_ERRORS)}.")
+        self.secure_1psid = secure_1psid
+        self.secure_1psidts = secure_1psidts
+        self.latency_seconds = latency_seconds
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.tokens_per_chunk = tokens_per_chunk
+        self.error_rate = error_rate
+        self.error_class = INJECTABLE_ERRORS[error_type]
+        self.streaming = streaming
+        self.candidates = max(candidates, 1)
+        self.cookies: Dict[str, str] = {}
+        self.running = False
+
+    async def init(self, timeout: float = 30, auto_close: bool = False, auto_refresh: bool = True, **kwargs: Any) -> None:
+        self.running = True
+
+    async def close(self, delay: float = 0) -> None:
+        self.running = False
+
+    def start_chat(self, **kwargs: Any) -> FakeChatSession:
+        return FakeChatSession(self, **kwargs)
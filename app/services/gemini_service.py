@@ -1,63 +1,358 @@
 import asyncio
-from typing import Optional
+import os
+import time
+from typing import Optional, AsyncIterator, List, Set
 from httpx import ReadTimeout
 
-from gemini_webapi import GeminiClient, AuthError, APIError # Importe as exceções relevantes
+from gemini_webapi import GeminiClient, ChatSession, AuthError, APIError # Importe as exceções relevantes
+from gemini_webapi.constants import Model
+from gemini_webapi.exceptions import (
+    GeminiError,
+    UsageLimitExceeded,
+    TemporarilyBlocked,
+)
 from gemini_webapi.types import ModelOutput
 from loguru import logger # Gemini-API usa loguru
 
 from app.core.config import settings
+from app.services.metrics import CLIENT_INITIALIZATIONS, CLIENT_REPLACEMENTS
+from app.services.fake_gemini import FakeGeminiClient
+from app.services.attachments import render_output_images
+
+# Peso de cada falha consecutiva no score de uma conta (equivale a N requisições em andamento)
+FAILURE_SCORE_PENALTY = 2
+# Clients substituídos que continuam associados à conta (ChatSessions antigas ainda apontam para eles)
+RETIRED_CLIENTS_KEPT = 8
+
+
+def resolve_gemini_model_enum(gemini_model_name: str) -> Model:
+    try:
+        return Model.from_name(gemini_model_name)
+    except ValueError as e:
+        logger.warning("Nome do modelo Gemini configurado ('{}') é inválido: {}. Usando 'unspecified' como fallback.", gemini_model_name, e)
+        return Model.UNSPECIFIED
+
+
+class NoAvailableAccountError(Exception):
+    """Todas as contas do pool estão em cool-down ou falharam ao inicializar."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GeminiAccount:
+    """
+    Uma conta Gemini do pool: cookies, o GeminiClient correspondente e o estado de saúde
+    usado na seleção (requisições em andamento, falhas consecutivas e cool-down).
+    """
+
+    def __init__(self, name: str, secure_1psid: str, secure_1psidts: Optional[str]):
+        self.name = name
+        self.secure_1psid = secure_1psid
+        self.secure_1psidts = secure_1psidts or None
+        self.client: Optional[GeminiClient] = None
+        self.client_created_at = 0.0
+        self.retired_clients: List[GeminiClient] = [] # Clients anteriores, do mais antigo ao mais recente
+        self.refresh_task: Optional[asyncio.Task] = None # Substituição do client em background
+        self.lock = asyncio.Lock() # Serializa a inicialização do client desta conta
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.last_acquired = 0.0
+
+    @property
+    def is_ready(self) -> bool:
+        return self.client is not None and self.client.running
+
+    def is_cooling_down(self, now: float) -> bool:
+        return now < self.cooldown_until
+
+    @property
+    def score(self) -> int:
+        return self.in_flight + self.consecutive_failures * FAILURE_SCORE_PENALTY
+
+    @property
+    def is_refreshing(self) -> bool:
+        return self.refresh_task is not None and not self.refresh_task.done()
+
+    def owns_client(self, client: GeminiClient) -> bool:
+        """O client atual ou um dos substituídos recentemente (ainda usados por ChatSessions antigas)."""
+        return client is self.client or any(client is retired for retired in self.retired_clients)
+
 
 class GeminiService:
-    _client: Optional[GeminiClient] = None
-    _lock = asyncio.Lock() # Para garantir que a inicialização seja thread-safe/async-safe
-
-    async def _initialize_client(self) -> GeminiClient:
-        async with self._lock: # Adquire o lock antes de verificar/inicializar
-            if self._client is None or not self._client.running:
-                logger.info("Initializing GeminiClient...")
-                if not settings.GEMINI_SECURE_1PSID:
-                    logger.error("GEMINI_SECURE_1PSID não configurado.")
+    def __init__(self):
+        self._accounts: List[GeminiAccount] = [
+            GeminiAccount(
+                name=account_config.get("name") or f"account-{index}",
+                secure_1psid=account_config.get("secure_1psid") or "",
+                secure_1psidts=account_config.get("secure_1psidts"),
+            )
+            for index, account_config in enumerate(settings.GEMINI_ACCOUNTS)
+        ]
+        self._drain_tasks: Set[asyncio.Task] = set() # Fechamentos pendentes de clients substituídos
+
+    @property
+    def accounts(self) -> List[GeminiAccount]:
+        return self._accounts
+
+    def _create_client(self, account: GeminiAccount) -> GeminiClient:
+        """Cria o client do backend configurado em GEMINI_BACKEND ("webapi" ou "fake")."""
+        backend_name = settings.GEMINI_BACKEND.lower()
+        if backend_name == "fake":
+            return FakeGeminiClient(
+                secure_1psid=account.secure_1psid,
+                secure_1psidts=account.secure_1psidts,
+                latency_seconds=settings.FAKE_GEMINI_LATENCY_SECONDS,
+                tokens_per_second=settings.FAKE_GEMINI_TOKENS_PER_SECOND,
+                response_tokens=settings.FAKE_GEMINI_RESPONSE_TOKENS,
+                tokens_per_chunk=settings.FAKE_GEMINI_TOKENS_PER_CHUNK,
+                error_rate=settings.FAKE_GEMINI_ERROR_RATE,
+                error_type=settings.FAKE_GEMINI_ERROR_TYPE,
+                streaming=settings.FAKE_GEMINI_STREAMING,
+                candidates=settings.FAKE_GEMINI_CANDIDATES,
+            )
+        if backend_name != "webapi":
+            logger.warning("GEMINI_BACKEND '{}' desconhecido. Usando 'webapi'.", backend_name)
+        # A biblioteca GeminiClient pode tentar carregar cookies do browser
+        # se os valores não forem fornecidos e browser-cookie3 estiver instalado.
+        # Aqui, estamos fornecendo explicitamente.
+        return GeminiClient(
+            secure_1psid=account.secure_1psid,
+            secure_1psidts=account.secure_1psidts, # Pode ser None
+            # proxy=settings.PROXY se você tiver um proxy
+        )
+
+    async def _initialize_client(self, account: GeminiAccount) -> GeminiClient:
+        async with account.lock: # Adquire o lock da conta antes de verificar/inicializar
+            if not account.is_ready:
+                logger.info("Initializing GeminiClient para conta '{}'...", account.name)
+                if not account.secure_1psid:
+                    logger.error("GEMINI_SECURE_1PSID não configurado para conta '{}'.", account.name)
                     raise ValueError("GEMINI_SECURE_1PSID é obrigatório.")
 
-                # A biblioteca GeminiClient pode tentar carregar cookies do browser
-                # se os valores não forem fornecidos e browser-cookie3 estiver instalado.
-                # Aqui, estamos fornecendo explicitamente.
-                try:
-                    client = GeminiClient(
-                        secure_1psid=settings.GEMINI_SECURE_1PSID,
-                        secure_1psidts=settings.GEMINI_SECURE_1PSIDTS, # Pode ser None
-                        # proxy=settings.PROXY se você tiver um proxy
-                    )
-                    # O método init lida com a obtenção do token de acesso e validação dos cookies
-                    await client.init(
-                        timeout=30,
-                        auto_close=False, # Manteremos o cliente ativo
-                        auto_refresh=True, # Permitir que a biblioteca atualize cookies
-                        verbose=settings.LOG_LEVEL.upper() == "DEBUG" # Mais logs se DEBUG
-                    )
-                    self._client = client
-                    logger.success("GeminiClient initialized successfully.")
-                except AuthError as e:
-                    logger.error(f"Erro de autenticação ao inicializar GeminiClient: {e}")
-                    # Você pode querer desligar a aplicação ou tentar novamente após um tempo
-                    raise  # Re-lança para ser tratado no endpoint
-                except APIError as e:
-                    logger.error(f"Erro de API ao inicializar GeminiClient: {e}")
-                    raise
-                except Exception as e:
-                    logger.error(f"Erro inesperado ao inicializar GeminiClient: {e}")
-                    raise
-            return self._client
+                self._swap_client(account, await self._start_client(account))
+            return account.client
+
+    async def _start_client(self, account: GeminiAccount) -> GeminiClient:
+        """Cria e inicializa um client novo para a conta, sem publicá-lo (a troca é feita por quem chama)."""
+        try:
+            client = self._create_client(account)
+            # O método init lida com a obtenção do token de acesso e validação dos cookies
+            await client.init(
+                timeout=30,
+                auto_close=False, # Manteremos o cliente ativo
+                auto_refresh=True, # Permitir que a biblioteca atualize cookies
+                verbose=settings.LOG_LEVEL.upper() == "DEBUG" # Mais logs se DEBUG
+            )
+            CLIENT_INITIALIZATIONS.inc(account=account.name, outcome="success")
+            logger.success("GeminiClient initialized successfully para conta '{}'.", account.name)
+            return client
+        except AuthError as e:
+            CLIENT_INITIALIZATIONS.inc(account=account.name, outcome="auth_error")
+            logger.error("Erro de autenticação ao inicializar GeminiClient da conta '{}': {}", account.name, e)
+            raise  # Re-lança para ser tratado no endpoint
+        except APIError as e:
+            CLIENT_INITIALIZATIONS.inc(account=account.name, outcome="api_error")
+            logger.error("Erro de API ao inicializar GeminiClient da conta '{}': {}", account.name, e)
+            raise
+        except Exception as e:
+            CLIENT_INITIALIZATIONS.inc(account=account.name, outcome="error")
+            logger.error("Erro inesperado ao inicializar GeminiClient da conta '{}': {}", account.name, e)
+            raise
+
+    def _swap_client(self, account: GeminiAccount, client: GeminiClient) -> None:
+        """
+        Publica o client novo numa única atribuição (sem await no meio): requisições que começam
+        depois dela já usam o novo; as que estão em andamento seguem com o antigo, que só é fechado
+        quando a conta fica ociosa ou o prazo GEMINI_CLIENT_DRAIN_SECONDS termina.
+        """
+        previous_client = account.client
+        account.client = client
+        account.client_created_at = time.monotonic()
+        if previous_client is None or previous_client is client:
+            return
+        account.retired_clients.append(previous_client)
+        del account.retired_clients[:-RETIRED_CLIENTS_KEPT]
+        drain_task = asyncio.create_task(
+            self._close_when_drained(account, previous_client),
+            name=f"gemini-client-drain-{account.name}",
+        )
+        self._drain_tasks.add(drain_task)
+        drain_task.add_done_callback(self._drain_tasks.discard)
+
+    async def _close_when_drained(self, account: GeminiAccount, client: GeminiClient) -> None:
+        # `in_flight` é por conta, não por client: esperar a conta ficar ociosa garante que nenhuma
+        # requisição iniciada antes da troca ainda use o client antigo.
+        deadline = time.monotonic() + settings.GEMINI_CLIENT_DRAIN_SECONDS
+        while account.in_flight > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(1.0)
+        try:
+            await client.close()
+            logger.debug("GeminiClient substituído da conta '{}' fechado.", account.name)
+        except Exception as e:
+            logger.warning("Falha ao fechar o GeminiClient substituído da conta '{}': {}", account.name, e)
+
+    async def replace_client(self, account: GeminiAccount, reason: str) -> None:
+        """
+        Inicializa um client novo em background e o troca pelo atual. A inicialização não segura
+        o lock da conta: enquanto ela dura, as requisições seguem usando o client atual (ou outras
+        contas do pool, se a conta não tiver client pronto).
+        """
+        logger.info("Substituindo o GeminiClient da conta '{}' em background ({}).", account.name, reason)
+        try:
+            client = await self._start_client(account)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            CLIENT_REPLACEMENTS.inc(account=account.name, reason=reason, outcome="error")
+            self._record_failure(account, e)
+            return
+        self._swap_client(account, client)
+        CLIENT_REPLACEMENTS.inc(account=account.name, reason=reason, outcome="success")
+
+    def schedule_client_refresh(self, account: GeminiAccount, reason: str) -> asyncio.Task:
+        """Agenda `replace_client` para a conta, a menos que já haja uma substituição em andamento."""
+        if not account.is_refreshing:
+            account.refresh_task = asyncio.create_task(
+                self.replace_client(account, reason),
+                name=f"gemini-client-refresh-{account.name}",
+            )
+        return account.refresh_task
+
+    async def warm_up(self) -> None:
+        """Inicializa os clients de todas as contas em paralelo (usado no startup)."""
+        if not self._accounts:
+            raise ValueError("Nenhuma conta Gemini configurada (GEMINI_SECURE_1PSID ou GEMINI_ACCOUNTS_JSON).")
+        results = await asyncio.gather(
+            *(self._initialize_client(account) for account in self._accounts),
+            return_exceptions=True,
+        )
+        for account, result in zip(self._accounts, results):
+            if isinstance(result, BaseException):
+                self._record_failure(account, result)
+        if all(isinstance(result, BaseException) for result in results):
+            raise results[0]
+
+    async def close(self) -> None:
+        """Fecha os clients de todas as contas, os atuais e os substituídos (usado no shutdown)."""
+        for drain_task in list(self._drain_tasks):
+            drain_task.cancel()
+        clients = {}
+        for account in self._accounts:
+            for client in (account.client, *account.retired_clients):
+                if client is not None:
+                    clients[id(client)] = (account, client)
+            account.client = None
+            account.retired_clients.clear()
+        results = await asyncio.gather(*(client.close() for _, client in clients.values()), return_exceptions=True)
+        for (account, _), result in zip(clients.values(), results):
+            if isinstance(result, Exception):
+                logger.warning("Falha ao fechar o GeminiClient da conta '{}': {}", account.name, result)
+        logger.info("{} GeminiClient(s) fechado(s).", len(clients))
+
+    def account_for_client(self, client: Optional[GeminiClient]) -> Optional[GeminiAccount]:
+        """Retorna a conta dona de um GeminiClient (ex.: o `geminiclient` de uma ChatSession)."""
+        if client is None:
+            return None
+        for account in self._accounts:
+            if account.owns_client(client):
+                return account
+        return None
+
+    def account_by_name(self, name: Optional[str]) -> Optional[GeminiAccount]:
+        for account in self._accounts:
+            if account.name == name:
+                return account
+        return None
+
+    def _candidate_accounts(self, preferred_account: Optional[GeminiAccount]) -> List[GeminiAccount]:
+        now = time.monotonic()
+        available = [account for account in self._accounts if not account.is_cooling_down(now)]
+        # Menor score primeiro; em empate, a conta usada há mais tempo.
+        available.sort(key=lambda account: (account.score, account.last_acquired))
+        # A conta preferida (afinidade da conversa) é tentada primeiro enquanto estiver saudável.
+        if preferred_account in available and preferred_account.consecutive_failures == 0:
+            available.remove(preferred_account)
+            available.insert(0, preferred_account)
+        return available
+
+    async def acquire_account(self, preferred_account: Optional[GeminiAccount] = None) -> GeminiAccount:
+        """
+        Seleciona uma conta do pool pelo menor número de requisições em andamento/falhas,
+        ignorando contas em cool-down, e garante que seu client esteja inicializado.
+        A conta retornada deve ser liberada com `release_account`.
+        """
+        if not self._accounts:
+            raise ValueError("Nenhuma conta Gemini configurada (GEMINI_SECURE_1PSID ou GEMINI_ACCOUNTS_JSON).")
+
+        last_error: Optional[BaseException] = None
+        candidates = self._candidate_accounts(preferred_account)
+        any_ready = any(account.is_ready for account in candidates)
+        for account in candidates:
+            if any_ready and not account.is_ready:
+                # Outra conta já está pronta: a inicialização desta fica em background, fora do
+                # caminho da requisição (e sem segurar o lock que as demais esperariam).
+                self.schedule_client_refresh(account, reason="not_ready")
+                continue
+            # Reserva a conta antes de inicializar para que requisições concorrentes se distribuam.
+            account.in_flight += 1
+            account.last_acquired = time.monotonic()
+            try:
+                if not account.is_ready and account.is_refreshing:
+                    # Reaproveita a inicialização que o supervisor já começou.
+                    await asyncio.shield(account.refresh_task)
+                if not account.is_ready:
+                    await self._initialize_client(account)
+                return account
+            except Exception as e:
+                account.in_flight -= 1
+                self._record_failure(account, e)
+                last_error = e
+                logger.warning("Conta '{}' indisponível, tentando a próxima do pool: {}", account.name, e)
+
+        if last_error is not None and not isinstance(last_error, (AuthError, UsageLimitExceeded, TemporarilyBlocked)):
+            raise last_error
+
+        retry_after = self._seconds_until_next_account()
+        raise NoAvailableAccountError(
+            f"All {len(self._accounts)} Gemini account(s) are cooling down after usage limits or blocks.",
+            retry_after=retry_after,
+        )
+
+    def _seconds_until_next_account(self) -> float:
+        now = time.monotonic()
+        pending = [account.cooldown_until - now for account in self._accounts if account.is_cooling_down(now)]
+        return max(min(pending), 1.0) if pending else 1.0
+
+    def release_account(self, account: GeminiAccount, error: Optional[BaseException] = None) -> None:
+        """Devolve a conta ao pool e atualiza seu estado de saúde conforme o resultado da requisição."""
+        account.in_flight = max(account.in_flight - 1, 0)
+        if error is None:
+            account.consecutive_failures = 0
+        else:
+            self._record_failure(account, error)
+
+    def _record_failure(self, account: GeminiAccount, error: BaseException) -> None:
+        if isinstance(error, (UsageLimitExceeded, TemporarilyBlocked, AuthError)):
+            account.cooldown_until = time.monotonic() + settings.GEMINI_ACCOUNT_COOLDOWN_SECONDS
+            account.consecutive_failures += 1
+            if isinstance(error, AuthError):
+                account.client = None # Força re-inicialização quando o cool-down terminar
+            logger.warning(
+                "Conta '{}' afastada do pool por {:.0f}s após {}: {}",
+                account.name, settings.GEMINI_ACCOUNT_COOLDOWN_SECONDS, type(error).__name__, error,
+            )
+        elif isinstance(error, (GeminiError, APIError, ReadTimeout, ValueError)):
+            account.consecutive_failures += 1
+        # Outros erros (ex.: HTTPException de validação) não dizem nada sobre a saúde da conta.
 
     async def get_client(self) -> GeminiClient:
-        if self._client is None or not self._client.running:
-            return await self._initialize_client()
-        # Se o cliente já foi inicializado e está rodando, mas auto_close foi True na lib,
-        # e o close_delay passou, ele pode ter sido fechado.
-        # A lógica de `running` na GeminiClient deve cobrir isso.
-        # Se você definir auto_close=False e auto_refresh=True na init, ele deve permanecer ativo.
-        return self._client
+        """Retorna o client da conta mais saudável do pool (sem reservá-la)."""
+        account = await self.acquire_account()
+        self.release_account(account)
+        return account.client
 
     async def generate_content(self, prompt: str, model_name: Optional[str] = None) -> ModelOutput:
         """
@@ -65,29 +360,101 @@ class GeminiService:
         O parâmetro model_name aqui é para o modelo Gemini, não o modelo OpenAI.
         A Gemini-API tem sua própria forma de especificar modelos se necessário.
         """
-        client = await self.get_client()
+        account = await self.acquire_account()
+        error: Optional[BaseException] = None
         try:
             # A biblioteca gemini-webapi pode ter seu próprio parâmetro de modelo
             # Veja a documentação da gemini-webapi para como especificar modelos Gemini
             # Exemplo: from gemini_webapi.constants import Model
             # response = await client.generate_content(prompt, model=Model.G_2_5_FLASH)
-            logger.debug(f"Enviando prompt para Gemini: '{prompt[:100]}...'")
-            response = await client.generate_content(prompt)
-            logger.debug(f"Resposta recebida do Gemini: '{response.text[:100]}...'")
+            logger.debug("Enviando prompt para Gemini (conta '{}'): '{}...'", account.name, prompt[:100])
+            response = await account.client.generate_content(prompt)
+            logger.debug("Resposta recebida do Gemini: '{}...'", response.text[:100])
             return response
         except ReadTimeout as e: # Import ReadTimeout from httpx
-             logger.error(f"Timeout ao chamar Gemini: {e}")
+             error = e
+             logger.error("Timeout ao chamar Gemini: {}", e)
              raise # Ou trate como um erro específico do proxy
         except APIError as e:
-            logger.error(f"Erro da API Gemini: {e}")
+            error = e
+            logger.error("Erro da API Gemini: {}", e)
             # Pode ser que o cliente precise ser re-inicializado se for um erro de autenticação
             if "authentication" in str(e).lower() or "cookie" in str(e).lower():
                  logger.warning("Possível problema de cookie, forçando re-inicialização na próxima chamada.")
-                 self._client = None # Força re-inicialização
+                 account.client = None # Força re-inicialização
             raise
         except Exception as e:
-            logger.error(f"Erro inesperado ao gerar conteúdo com Gemini: {e}")
+            error = e
+            logger.error("Erro inesperado ao gerar conteúdo com Gemini: {}", e)
+            raise
+        finally:
+            self.release_account(account, error)
+
+    @staticmethod
+    def supports_streaming(chat_session: ChatSession) -> bool:
+        """
+        Indica se a versão instalada da gemini-webapi expõe streaming incremental
+        (`ChatSession.send_message_stream`). Versões antigas só possuem `send_message`.
+        """
+        return callable(getattr(chat_session, "send_message_stream", None))
+
+    async def _iter_text_deltas(self, chat_session: ChatSession, prompt: str, files: Optional[List[str]] = None) -> AsyncIterator[str]:
+        """
+        Itera sobre as saídas parciais do Gemini e produz apenas o texto novo de cada uma.
+        Usa `text_delta` quando a biblioteca o fornece; caso contrário calcula o delta
+        a partir do texto acumulado. As imagens da resposta vão num último delta.
+        """
+        upstream_text = "" # Texto acumulado como o Gemini o mandou por último
+        emitted_length = 0 # Caracteres já enviados ao cliente
+        partial_output = None
+        async for partial_output in chat_session.send_message_stream(prompt, **({"files": files} if files else {})):
+            delta = getattr(partial_output, "text_delta", None)
+            if delta is None:
+                full_text = partial_output.text or ""
+                if not full_text.startswith(upstream_text):
+                    # O Gemini reescreveu parte do texto já enviado (ex.: normalização de markdown).
+                    # O cliente já o recebeu: segue só com o que passa do que foi entregue, sem reenviar.
+                    logger.debug(
+                        "Texto acumulado do Gemini diverge do anterior na posição {}; enviando só o excedente.",
+                        len(os.path.commonprefix((full_text, upstream_text))),
+                    )
+                upstream_text = full_text
+                delta = full_text[emitted_length:]
+            else:
+                upstream_text += delta
+            if not delta:
+                continue
+            emitted_length += len(delta)
+            yield delta
+        images_text = render_output_images(getattr(partial_output, "images", None))
+        if images_text:
+            yield images_text
+
+    async def open_text_stream(self, chat_session: ChatSession, prompt: str, files: Optional[List[str]] = None) -> AsyncIterator[str]:
+        """
+        Inicia o streaming incremental e aguarda o primeiro delta antes de retornar.
+        Assim, erros de conexão/autenticação ocorridos antes do primeiro byte ainda são
+        lançados aqui e tratados pelos exception handlers, em vez de quebrarem o SSE no meio.
+        """
+        text_deltas = self._iter_text_deltas(chat_session, prompt, files)
+        try:
+            first_delta = await text_deltas.__anext__()
+        except StopAsyncIteration:
+            first_delta = None
+        except BaseException:
+            await text_deltas.aclose()
             raise
 
+        async def _chained() -> AsyncIterator[str]:
+            try:
+                if first_delta is not None:
+                    yield first_delta
+                    async for delta in text_deltas:
+                        yield delta
+            finally:
+                await text_deltas.aclose()
+
+        return _chained()
+
 # Instância global do serviço para ser usada pela aplicação FastAPI
 gemini_service_instance = GeminiService()
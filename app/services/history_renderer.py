@@ -0,0 +1,24 @@
+from typing import List
+
+from app.models.openai_schemas import ChatMessage
+
+# Separador entre as mensagens no prompt do modo stateless
+MESSAGE_SEPARATOR = "\n\n"
+
+
+def render_message(message: ChatMessage) -> str:
+    """Template compacto de uma mensagem: o papel entre colchetes e o conteúdo na linha seguinte."""
+    return f"[{message.role}]\n{message.text}"
+
+
+def render_messages(messages: List[ChatMessage]) -> str:
+    """
+    Serializa a lista `messages` inteira num único prompt (CONVERSATION_MODE=stateless, itens de
+    batch, escolhas extras). Renderizar direto é mais barato que buscar um prefixo num cache: isso
+    exigiria o hash de todas as mensagens, para economizar uma f-string por mensagem.
+    """
+    renderable = [message for message in messages if message.content]
+    if len(renderable) == 1:
+        # Uma única mensagem vai sem template, como no modo com sessão.
+        return renderable[0].text
+    return MESSAGE_SEPARATOR.join(render_message(message) for message in renderable)
@@ -0,0 +1,233 @@
+import asyncio
+import json
+import signal
+import threading
+import time
+from typing import Optional, Dict, Any, Set, Awaitable, Callable
+
+from loguru import logger
+
+from app.core.config import settings
+from app.models.openai_schemas import OpenAIErrorResponse, OpenAIErrorDetail
+from app.services.metrics import metrics_registry
+
+# Rotas que continuam respondendo durante a drenagem (o balanceador precisa ver o 503 do /health)
+DRAIN_EXEMPT_PATHS = frozenset({"/health", "/metrics"})
+
+SHUTDOWN_REQUESTS = metrics_registry.counter(
+    "proxy_shutdown_requests_total",
+    "Requisições afetadas pelo shutdown: recusadas durante a drenagem ou interrompidas no fim do prazo.",
+    ("outcome",),
+)
+
+
+def _error_payload(message: str, code: str) -> Dict[str, Any]:
+    return OpenAIErrorResponse(
+        error=OpenAIErrorDetail(message=message, type="server_error", code=code)
+    ).model_dump()
+
+
+class ShutdownCoordinator:
+    """
+    Coordena o desligamento gracioso do processo (deploys, SIGTERM):
+
+    1. `begin_drain` (no SIGTERM, ou no shutdown do lifespan se o sinal não puder ser observado):
+       novas requisições recebem 503 com `Retry-After` e `Connection: close`, e o /health passa
+       a responder 503, tirando a réplica do balanceador.
+    2. As requisições e streams em andamento terminam normalmente até SHUTDOWN_DRAIN_SECONDS.
+       As que passarem do prazo são canceladas: um stream já iniciado recebe um evento de erro
+       e `[DONE]` em vez de ser cortado no meio, e uma requisição ainda sem resposta recebe 503.
+    3. O lifespan fecha os serviços em ordem (`run_step`), cada etapa limitada a
+       SHUTDOWN_STEP_TIMEOUT_SECONDS.
+    """
+
+    def __init__(self, drain_seconds: float, step_timeout_seconds: float, retry_after_seconds: int):
+        self.drain_seconds = drain_seconds
+        self.step_timeout_seconds = step_timeout_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self.draining = False
+        self.deadline_reached = False
+        self.drain_started_at: Optional[float] = None
+        self._requests: Set[asyncio.Task] = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._deadline_task: Optional[asyncio.Task] = None
+        self._previous_handlers: Dict[int, Any] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.rejected = 0
+        self.interrupted = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._requests)
+
+    def request_started(self, task: asyncio.Task) -> None:
+        self._requests.add(task)
+        self._idle.clear()
+
+    def request_finished(self, task: asyncio.Task) -> None:
+        self._requests.discard(task)
+        if not self._requests:
+            self._idle.set()
+
+    def install_signal_handlers(self) -> None:
+        """
+        Começa a drenagem já no SIGTERM/SIGINT, antes de o servidor ASGI esperar as conexões
+        abertas. O handler anterior (o do uvicorn, que encerra o servidor) continua sendo chamado.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return
+        self._loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            previous_handler = signal.getsignal(signum)
+            if not callable(previous_handler):
+                continue # Sem handler Python (ex.: servidor que usa loop.add_signal_handler)
+
+            def handler(received_signum, frame, previous_handler=previous_handler):
+                self._loop.call_soon_threadsafe(self.begin_drain, signal.Signals(received_signum).name)
+                previous_handler(received_signum, frame)
+
+            signal.signal(signum, handler)
+            self._previous_handlers[signum] = previous_handler
+
+    def restore_signal_handlers(self) -> None:
+        if threading.current_thread() is not threading.main_thread():
+            return
+        for signum, previous_handler in self._previous_handlers.items():
+            signal.signal(signum, previous_handler)
+        self._previous_handlers.clear()
+
+    def begin_drain(self, reason: str) -> None:
+        if self.draining:
+            return
+        self.draining = True
+        self.drain_started_at = time.monotonic()
+        logger.info(
+            "Drenagem iniciada ({}): novas requisições recebem 503; aguardando até {:.0f}s por {} requisição(ões) em andamento.",
+            reason, self.drain_seconds, self.in_flight,
+        )
+        self._deadline_task = asyncio.create_task(self._enforce_deadline(), name="shutdown-drain-deadline")
+
+    async def _enforce_deadline(self) -> None:
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=self.drain_seconds)
+            logger.info("Drenagem concluída em {:.1f}s.", time.monotonic() - self.drain_started_at)
+            return
+        except asyncio.TimeoutError:
+            pass
+        self.deadline_reached = True
+        logger.warning("Prazo de drenagem esgotado; interrompendo {} requisição(ões) em andamento.", self.in_flight)
+        for task in list(self._requests):
+            task.cancel()
+
+    async def drain(self) -> None:
+        """Inicia a drenagem (se o sinal não a iniciou) e espera as requisições terminarem ou o prazo acabar."""
+        self.begin_drain("shutdown da aplicação")
+        await self._deadline_task
+        try:
+            # As canceladas no fim do prazo ainda precisam de um instante para enviar o erro e liberar recursos.
+            await asyncio.wait_for(self._idle.wait(), timeout=self.step_timeout_seconds)
+        except asyncio.TimeoutError:
+            logger.warning("{} requisição(ões) não terminaram após o cancelamento.", self.in_flight)
+
+    async def run_step(self, name: str, action: Callable[[], Awaitable[Any]]) -> None:
+        """Executa uma etapa do shutdown; falha ou demora de uma etapa não impede as seguintes."""
+        try:
+            await asyncio.wait_for(action(), timeout=self.step_timeout_seconds)
+        except asyncio.TimeoutError:
+            logger.error("Etapa de shutdown '{}' excedeu {:.0f}s; seguindo.", name, self.step_timeout_seconds)
+        except Exception as e:
+            logger.error("Falha na etapa de shutdown '{}': {}", name, e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "draining": self.draining,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+            "interrupted": self.interrupted,
+        }
+
+
+class DrainMiddleware:
+    """
+    Middleware ASGI puro que conta as requisições HTTP em andamento para o ShutdownCoordinator
+    e recusa trabalho novo durante a drenagem. /health e /metrics não são contados nem recusados.
+    """
+
+    def __init__(self, app, coordinator: "ShutdownCoordinator"):
+        self.app = app
+        self.coordinator = coordinator
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in DRAIN_EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        coordinator = self.coordinator
+        if coordinator.draining:
+            coordinator.rejected += 1
+            SHUTDOWN_REQUESTS.inc(outcome="rejected")
+            await self._send_error(send, "The server is shutting down; retry the request.", "server_shutting_down")
+            return
+
+        response = {"started": False, "finished": False, "streaming": False}
+
+        async def send_tracking(message) -> None:
+            if message["type"] == "http.response.start":
+                response["started"] = True
+                response["streaming"] = any(
+                    key == b"content-type" and value.startswith(b"text/event-stream")
+                    for key, value in message.get("headers", ())
+                )
+                if coordinator.draining:
+                    # Não reaproveita a conexão (keep-alive) para uma próxima requisição.
+                    message = {**message, "headers": [*message.get("headers", ()), (b"connection", b"close")]}
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                response["finished"] = True
+            await send(message)
+
+        task = asyncio.current_task()
+        coordinator.request_started(task)
+        try:
+            await self.app(scope, receive, send_tracking)
+        except asyncio.CancelledError:
+            if not coordinator.deadline_reached or response["finished"]:
+                raise
+            coordinator.interrupted += 1
+            SHUTDOWN_REQUESTS.inc(outcome="interrupted")
+            await self._finish_interrupted(send, response)
+        finally:
+            coordinator.request_finished(task)
+
+    async def _send_error(self, send, message: str, code: str) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"retry-after", str(self.coordinator.retry_after_seconds).encode("latin-1")),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": json.dumps(_error_payload(message, code)).encode("utf-8")})
+
+    async def _finish_interrupted(self, send, response: Dict[str, bool]) -> None:
+        """Encerra de forma legível uma requisição cancelada no fim do prazo de drenagem."""
+        message = "The server shut down before the response was complete; retry the request."
+        try:
+            if not response["started"]:
+                await self._send_error(send, message, "server_shutting_down")
+            elif response["streaming"]:
+                error = _error_payload(message, "server_shutdown_interrupted")
+                body = f"data: {json.dumps(error)}\n\ndata: [DONE]\n\n".encode("utf-8")
+                await send({"type": "http.response.body", "body": body, "more_body": False})
+        except Exception:
+            pass # Conexão já fechada: não há mais o que enviar
+
+
+# Instância global do coordenador de shutdown para ser usada pela aplicação FastAPI
+shutdown_coordinator_instance = ShutdownCoordinator(
+    drain_seconds=settings.SHUTDOWN_DRAIN_SECONDS,
+    step_timeout_seconds=settings.SHUTDOWN_STEP_TIMEOUT_SECONDS,
+    retry_after_seconds=settings.SHUTDOWN_RETRY_AFTER_SECONDS,
+)
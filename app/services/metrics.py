@@ -0,0 +1,308 @@
+import asyncio
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Dict, Tuple, List, Callable, Optional, AsyncIterator, Iterator
+
+# Buckets padrão (segundos) para latências do proxy e do upstream
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Buckets para tempos de serialização, bem menores que os de rede
+SERIALIZATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_INF_BUCKET_LABEL = 'le="+Inf"'
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(_Metric):
+    """Gauge cujo valor é lido no momento da coleta (ex.: tamanho do session store)."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name} {_format_value(self.callback())}"]
+
+
+class _HistogramSeries:
+    __slots__ = ("bucket_counts", "sum", "count")
+
+    def __init__(self, bucket_count: int):
+        self.bucket_counts = [0] * bucket_count
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], _HistogramSeries] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _HistogramSeries(len(self.buckets))
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series.bucket_counts[index] += 1
+        series.sum += value
+        series.count += 1
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(self._key(labels))
+        return series.count if series else 0
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets, series.bucket_counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(upper_bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, _INF_BUCKET_LABEL)} {series.count}')
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series.sum)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Registro mínimo de métricas no formato texto do Prometheus, sem dependências externas.
+    As métricas são por processo: com vários workers, cada um expõe as suas.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, callback: Callable[[], float]) -> Gauge:
+        return self.register(Gauge(name, documentation, callback))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+# Instância global do registro de métricas para ser usada pela aplicação FastAPI
+metrics_registry = MetricsRegistry()
+
+UPSTREAM_LATENCY = metrics_registry.histogram(
+    "gemini_upstream_latency_seconds",
+    "Duração da chamada ao Gemini (send_message; no streaming, até o último delta).",
+    ("model", "mode"),
+)
+STREAM_TTFB = metrics_registry.histogram(
+    "proxy_stream_ttfb_seconds",
+    "Tempo entre a chegada da requisição e o primeiro chunk SSE enviado ao cliente.",
+    ("model",),
+)
+QUEUE_WAIT = metrics_registry.histogram(
+    "proxy_queue_wait_seconds",
+    "Espera pelo turno da conversa (stage=session) ou por um slot da conta (stage=account_slot).",
+    ("model", "stage"),
+)
+SERIALIZATION_TIME = metrics_registry.histogram(
+    "proxy_serialization_seconds",
+    "Tempo gasto montando e serializando a resposta no formato OpenAI.",
+    ("model", "mode"),
+    buckets=SERIALIZATION_BUCKETS,
+)
+CLIENT_INITIALIZATIONS = metrics_registry.counter(
+    "gemini_client_initializations_total",
+    "Inicializações (e reinicializações) de GeminiClient por conta e resultado.",
+    ("account", "outcome"),
+)
+CLIENT_REPLACEMENTS = metrics_registry.counter(
+    "gemini_client_replacements_total",
+    "Substituições de GeminiClient feitas em background, por conta, motivo e resultado.",
+    ("account", "reason", "outcome"),
+)
+CLIENT_DISCONNECTS = metrics_registry.counter(
+    "proxy_client_disconnects_total",
+    "Requisições abandonadas pelo cliente e canceladas, pela etapa em que estavam (queue, upstream, stream).",
+    ("model", "stage"),
+)
+ERRORS = metrics_registry.counter(
+    "proxy_errors_total",
+    "Erros tratados pelo proxy por tipo de exceção.",
+    ("model", "type"),
+)
+
+
+class RequestTimer:
+    """
+    Cronometra uma requisição de chat. No streaming mede a latência do upstream (até o último
+    delta), o TTFB (da chegada da requisição ao primeiro chunk SSE) e o tempo de serialização,
+    que é o tempo gasto gerando os chunks descontada a espera pelos deltas (`measure_wait`).
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.request_started_at = time.perf_counter()
+        self.upstream_started_at: Optional[float] = None
+        self._upstream_wait = 0.0
+
+    def queue_wait(self, waited_seconds: float, stage: str) -> None:
+        QUEUE_WAIT.observe(waited_seconds, model=self.model, stage=stage)
+
+    def upstream_started(self) -> None:
+        self.upstream_started_at = time.perf_counter()
+
+    def client_disconnected(self, stage: Optional[str] = None) -> None:
+        """Conta uma requisição cancelada porque o cliente desconectou (por padrão, antes da resposta começar)."""
+        if stage is None:
+            stage = "upstream" if self.upstream_started_at is not None else "queue"
+        CLIENT_DISCONNECTS.inc(model=self.model, stage=stage)
+
+    def upstream_finished(self) -> None:
+        """Registra a latência de um `send_message` sem streaming."""
+        if self.upstream_started_at is not None:
+            UPSTREAM_LATENCY.observe(time.perf_counter() - self.upstream_started_at, model=self.model, mode="json")
+
+    @contextmanager
+    def serialization(self, mode: str) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            SERIALIZATION_TIME.observe(time.perf_counter() - started_at, model=self.model, mode=mode)
+
+    async def wrap_deltas(self, text_deltas: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Registra a latência do upstream até o último delta e os erros no meio do stream."""
+        try:
+            async for delta in text_deltas:
+                yield delta
+        except Exception as e:
+            ERRORS.inc(model=self.model, type=type(e).__name__)
+            raise
+        if self.upstream_started_at is not None:
+            UPSTREAM_LATENCY.observe(time.perf_counter() - self.upstream_started_at, model=self.model, mode="stream")
+
+    async def measure_wait(self, text_deltas: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Entrada do gerador de chunks: acumula a espera pelos deltas, descontada da serialização."""
+        iterator = text_deltas.__aiter__()
+        while True:
+            step_started_at = time.perf_counter()
+            try:
+                delta = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                self._upstream_wait += time.perf_counter() - step_started_at
+            yield delta
+
+    async def wrap_chunks(self, chunks: AsyncIterator[str], mode: str = "stream") -> AsyncIterator[str]:
+        iterator = chunks.__aiter__()
+        serialization_seconds = 0.0
+        first_chunk = True
+        try:
+            while True:
+                step_started_at = time.perf_counter()
+                upstream_wait_before = self._upstream_wait
+                try:
+                    chunk = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                now = time.perf_counter()
+                serialization_seconds += (now - step_started_at) - (self._upstream_wait - upstream_wait_before)
+                if first_chunk:
+                    STREAM_TTFB.observe(now - self.request_started_at, model=self.model)
+                    first_chunk = False
+                yield chunk
+        except (asyncio.CancelledError, GeneratorExit):
+            # O Starlette cancela o stream quando o cliente desconecta; os geradores internos
+            # (upstream, conta, slot, turno da conversa) são encerrados junto.
+            self.client_disconnected(stage="stream")
+            raise
+        SERIALIZATION_TIME.observe(max(serialization_seconds, 0.0), model=self.model, mode=mode)
+
+
+def record_error(exc: BaseException, model: Optional[str]) -> None:
+    """Conta um erro tratado pelos exception handlers."""
+    ERRORS.inc(model=model or "", type=type(exc).__name__)
@@ -0,0 +1,243 @@
+import math
+import time
+from typing import Optional, Dict, Any, AsyncIterator, Mapping, Tuple
+
+from loguru import logger
+
+from app.core.config import Settings, settings
+from app.services.metrics import metrics_registry
+from app.utils.token_counter import count_tokens, IncrementalTokenCount
+
+LANE_INTERACTIVE = "interactive"
+LANE_BATCH = "batch"
+LANES = (LANE_INTERACTIVE, LANE_BATCH)
+
+RATE_LIMITED = metrics_registry.counter(
+    "proxy_rate_limited_total",
+    "Requisições recusadas pelo limite da API key, por limite atingido (requests ou tokens).",
+    ("limit",),
+)
+
+
+class RateLimitExceededError(Exception):
+    """A API key esgotou seu limite de requisições ou de tokens por minuto."""
+
+    def __init__(self, message: str, limit: str, retry_after: float, headers: Dict[str, str]):
+        super().__init__(message)
+        self.limit = limit
+        self.retry_after = retry_after
+        self.headers = headers
+
+
+def format_reset(seconds: float) -> str:
+    """Duração no formato dos headers `x-ratelimit-reset-*` da OpenAI: "20ms", "1s", "6m0s"."""
+    if seconds < 1:
+        return f"{math.ceil(seconds * 1000)}ms"
+    minutes, seconds = divmod(math.ceil(seconds), 60)
+    return f"{minutes}m{seconds}s" if minutes else f"{seconds}s"
+
+
+class TokenBucket:
+    """
+    Balde de capacidade `limit` reabastecido continuamente a `limit` por minuto.
+
+    Uma requisição passa quando o balde tem o custo dela (ou está cheio, para custos maiores
+    que a capacidade); consumos registrados depois do fato (`charge`) podem deixá-lo negativo,
+    e a dívida é paga pelo reabastecimento antes da próxima requisição passar.
+    """
+
+    __slots__ = ("limit", "rate", "level", "updated_at")
+
+    def __init__(self, limit: int, now: float):
+        self.limit = limit
+        self.rate = limit / 60.0
+        self.level = float(limit)
+        self.updated_at = now
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.limit, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_for(self, cost: float, now: float) -> float:
+        """Segundos até `cost` caber no balde (0 se já cabe)."""
+        self._refill(now)
+        missing = min(cost, self.limit) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def charge(self, cost: float, now: float) -> None:
+        self._refill(now)
+        self.level -= cost
+
+    def remaining(self) -> int:
+        return max(int(self.level), 0)
+
+    def reset_seconds(self) -> float:
+        """Segundos até o balde voltar a ficar cheio."""
+        return max(self.limit - self.level, 0.0) / self.rate
+
+
+class ApiKeyPolicy:
+    """Limites e prioridade de uma API key. Limite 0 desativa a dimensão correspondente."""
+
+    __slots__ = ("requests_per_minute", "tokens_per_minute", "weight", "lane")
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, weight: float, lane: str):
+        if lane not in LANES:
+            raise ValueError(f"lane deve ser um de {LANES}, recebido '{lane}'")
+        if weight <= 0:
+            raise ValueError(f"weight deve ser positivo, recebido {weight}")
+        self.requests_per_minute = max(int(requests_per_minute), 0)
+        self.tokens_per_minute = max(int(tokens_per_minute), 0)
+        self.weight = float(weight)
+        self.lane = lane
+
+
+class RateLimitState:
+    """Buckets de uma API key. Também é o resultado de `RateLimiter.admit`, usado para os headers."""
+
+    __slots__ = ("policy", "requests", "tokens", "admitted", "limited")
+
+    def __init__(self, policy: ApiKeyPolicy, now: float):
+        self.policy = policy
+        self.requests = TokenBucket(policy.requests_per_minute, now) if policy.requests_per_minute else None
+        self.tokens = TokenBucket(policy.tokens_per_minute, now) if policy.tokens_per_minute else None
+        self.admitted = 0
+        self.limited = 0
+
+    def headers(self) -> Dict[str, str]:
+        """Headers `x-ratelimit-*` no formato da OpenAI, só para as dimensões limitadas."""
+        headers = {}
+        for dimension, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+            if bucket is not None:
+                headers[f"x-ratelimit-limit-{dimension}"] = str(bucket.limit)
+                headers[f"x-ratelimit-remaining-{dimension}"] = str(bucket.remaining())
+                headers[f"x-ratelimit-reset-{dimension}"] = format_reset(bucket.reset_seconds())
+        return headers
+
+
+class RateLimiter:
+    """
+    Limites por API key (requisições e tokens por minuto, em token buckets) e a política de
+    acesso ao upstream de cada key (peso e fila de prioridade), usada pelo scheduler.
+
+    Os tokens do prompt são cobrados na admissão; os da resposta, quando ela termina
+    (`charge_completion`), e só atrasam as próximas requisições da mesma key.
+    """
+
+    def __init__(self, default_policy: ApiKeyPolicy, key_policies: Mapping[str, ApiKeyPolicy]):
+        self.default_policy = default_policy
+        self.key_policies = key_policies
+        self._states: Dict[str, RateLimitState] = {}
+
+    @staticmethod
+    def policies_from_settings(source: Settings) -> Tuple[ApiKeyPolicy, Dict[str, ApiKeyPolicy]]:
+        """Política padrão e políticas por key (RATE_LIMIT_DEFAULT_* e API_KEY_LIMITS_JSON)."""
+        default_policy = ApiKeyPolicy(
+            requests_per_minute=source.RATE_LIMIT_DEFAULT_REQUESTS_PER_MINUTE,
+            tokens_per_minute=source.RATE_LIMIT_DEFAULT_TOKENS_PER_MINUTE,
+            weight=source.RATE_LIMIT_DEFAULT_WEIGHT,
+            lane=source.RATE_LIMIT_DEFAULT_LANE,
+        )
+        key_policies = {}
+        for api_key, overrides in source.API_KEY_LIMITS.items():
+            try:
+                key_policies[api_key] = ApiKeyPolicy(
+                    requests_per_minute=overrides.get("requests_per_minute", default_policy.requests_per_minute),
+                    tokens_per_minute=overrides.get("tokens_per_minute", default_policy.tokens_per_minute),
+                    weight=overrides.get("weight", default_policy.weight),
+                    lane=overrides.get("lane", default_policy.lane),
+                )
+            except (TypeError, ValueError) as e:
+                logger.error("Limites inválidos para a API key ...{} em API_KEY_LIMITS_JSON ({}); usando os padrões.", api_key[-4:], e)
+        return default_policy, key_policies
+
+    @classmethod
+    def from_settings(cls) -> "RateLimiter":
+        return cls(*cls.policies_from_settings(settings))
+
+    def configure(self, default_policy: ApiKeyPolicy, key_policies: Mapping[str, ApiKeyPolicy]) -> None:
+        """
+        Troca as políticas (recarga da configuração). Keys cujos limites mudaram ganham buckets
+        novos, que herdam o saldo atual (limitado à nova capacidade): a recarga não zera o consumo.
+        """
+        self.default_policy = default_policy
+        self.key_policies = key_policies
+        now = time.monotonic()
+        for api_key, state in list(self._states.items()):
+            policy = self.policy_for(api_key)
+            if policy is state.policy:
+                continue
+            new_state = self._states[api_key] = RateLimitState(policy, now)
+            new_state.admitted, new_state.limited = state.admitted, state.limited
+            for previous, bucket in ((state.requests, new_state.requests), (state.tokens, new_state.tokens)):
+                if previous is not None and bucket is not None:
+                    previous._refill(now)
+                    bucket.level = min(previous.level, bucket.limit)
+
+    def policy_for(self, api_key: str) -> ApiKeyPolicy:
+        return self.key_policies.get(api_key, self.default_policy)
+
+    def _state_for(self, api_key: str, now: float) -> RateLimitState:
+        state = self._states.get(api_key)
+        if state is None:
+            state = self._states[api_key] = RateLimitState(self.policy_for(api_key), now)
+        return state
+
+    def admit(self, api_key: str, prompt_tokens: int = 0) -> RateLimitState:
+        """Cobra uma requisição e `prompt_tokens` da key, ou levanta RateLimitExceededError."""
+        now = time.monotonic()
+        state = self._state_for(api_key, now)
+        request_wait = state.requests.wait_for(1, now) if state.requests is not None else 0.0
+        token_wait = state.tokens.wait_for(prompt_tokens, now) if state.tokens is not None else 0.0
+        if request_wait > 0 or token_wait > 0:
+            limit = "requests" if request_wait >= token_wait else "tokens"
+            state.limited += 1
+            RATE_LIMITED.inc(limit=limit)
+            bucket = state.requests if limit == "requests" else state.tokens
+            raise RateLimitExceededError(
+                f"Rate limit reached for {limit} on this API key: limit {bucket.limit} per minute.",
+                limit=limit,
+                retry_after=max(request_wait, token_wait),
+                headers=state.headers(),
+            )
+        if state.requests is not None:
+            state.requests.charge(1, now)
+        if state.tokens is not None:
+            state.tokens.charge(prompt_tokens, now)
+        state.admitted += 1
+        return state
+
+    def charge_completion(self, state: RateLimitState, completion_text: Optional[str]) -> None:
+        if state.tokens is not None and completion_text:
+            state.tokens.charge(count_tokens(completion_text), time.monotonic())
+
+    async def charge_after_stream(self, text_deltas: AsyncIterator[str], state: RateLimitState) -> AsyncIterator[str]:
+        """Repassa os deltas e cobra os tokens da resposta quando o stream termina (ou é interrompido)."""
+        if state.tokens is None:
+            async for delta in text_deltas:
+                yield delta
+            return
+        completion_count = IncrementalTokenCount()
+        try:
+            async for delta in text_deltas:
+                completion_count.add(delta)
+                yield delta
+        finally:
+            state.tokens.charge(completion_count.total, time.monotonic())
+
+    def stats(self) -> Dict[str, Any]:
+        # Só o final de cada key: o /health não deve expor credenciais.
+        return {
+            f"...{api_key[-4:]}": {
+                "lane": state.policy.lane,
+                "weight": state.policy.weight,
+                "admitted": state.admitted,
+                "limited": state.limited,
+                **state.headers(),
+            }
+            for api_key, state in self._states.items()
+        }
+
+
+# Instância global do rate limiter para ser usada pela aplicação FastAPI
+rate_limiter_instance = RateLimiter.from_settings()
@@ -0,0 +1,252 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, AsyncIterator, Tuple
+
+from loguru import logger
+
+from app.core.config import settings
+from app.models.openai_schemas import ChatCompletionRequest
+
+# Header de resposta indicando o resultado do cache (HIT, MISS ou BYPASS)
+CACHE_STATUS_HEADER = "X-Proxy-Cache"
+
+
+def is_cacheable_request(request_payload: ChatCompletionRequest) -> bool:
+    """
+    Só requisições sem estado são cacheadas: sem turnos anteriores do assistente/tools.
+    Uma conversa em andamento depende da ChatSession no Gemini e não pode ser respondida do cache.
+    No modo stateless, o prompt depende só das mensagens e qualquer requisição é cacheável.
+    Em ambos os modos a chave é restrita à API key (e, numa conversa já existente, à conversa): ver `build_cache_key`.
+    """
+    if (request_payload.n or 1) > 1:
+        # Com n > 1, o cliente quer respostas diferentes: nem o cache nem o agrupamento as repetem.
+        return False
+    if any(message.attachments for message in request_payload.messages):
+        # Anexos (imagens de vários MB) não entram na chave do cache nem são agrupados.
+        return False
+    if settings.CONVERSATION_MODE == "stateless":
+        return True
+    return all(message.role in ("system", "user") for message in request_payload.messages)
+
+
+def cache_bypass_mode(cache_control: Optional[str]) -> Tuple[bool, bool]:
+    """
+    Interpreta o header `Cache-Control` da requisição. Retorna (ler_do_cache, gravar_no_cache):
+    `no-cache` força uma nova resposta (que é gravada); `no-store` ignora o cache por completo.
+    """
+    directives = {part.strip().lower() for part in (cache_control or "").split(",")}
+    if "no-store" in directives:
+        return False, False
+    if "no-cache" in directives:
+        return False, True
+    return True, True
+
+
+def build_cache_key(
+    request_payload: ChatCompletionRequest,
+    gemini_model_name: str,
+    api_key: Optional[str] = None,
+    conversation_key: Optional[str] = None,
+) -> str:
+    """
+    Chave normalizada: modelo Gemini efetivo + mensagens + parâmetros que alteram a resposta.
+    `api_key` e `conversation_key` restringem a chave a um cliente e a uma conversa: no modo
+    session, fora de uma conversa nova, a resposta vem da ChatSession da conversa, não só das mensagens.
+    """
+    stop = request_payload.stop
+    normalized = {
+        "api_key": api_key,
+        "conversation": conversation_key,
+        "model": gemini_model_name,
+        "messages": [[message.role, (message.text or "").strip()] for message in request_payload.messages],
+        "temperature": request_payload.temperature,
+        "top_p": request_payload.top_p,
+        "max_tokens": request_payload.max_tokens,
+        "stop": [stop] if isinstance(stop, str) else stop,
+    }
+    encoded = json.dumps(normalized, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class _DiskCache:
+    """Persistência opcional em SQLite; as operações rodam em thread para não bloquear o event loop."""
+
+    CLEANUP_EVERY_WRITES = 500
+
+    def __init__(self, path: str, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, text TEXT NOT NULL, expires_at REAL NOT NULL, stored_at REAL NOT NULL)"
+        )
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, expires_at FROM response_cache WHERE key = ? AND (expires_at = 0 OR expires_at > ?)",
+                (key, time.time()),
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set(self, key: str, text: str, expires_at: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, text, expires_at, stored_at) VALUES (?, ?, ?, ?)",
+                (key, text, expires_at, now),
+            )
+            self._writes += 1
+            if self._writes % self.CLEANUP_EVERY_WRITES == 0:
+                self._conn.execute("DELETE FROM response_cache WHERE expires_at != 0 AND expires_at <= ?", (now,))
+                if self.max_entries > 0:
+                    self._conn.execute(
+                        "DELETE FROM response_cache WHERE key NOT IN "
+                        "(SELECT key FROM response_cache ORDER BY stored_at DESC LIMIT ?)",
+                        (self.max_entries,),
+                    )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """
+    Cache de respostas completas do Gemini para requisições sem estado.
+    Camada em memória (LRU limitada por entradas e bytes, com TTL) e, opcionalmente, SQLite em disco.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        max_entries: int,
+        max_bytes: int,
+        ttl_seconds: float,
+        disk_path: str = "",
+        disk_max_entries: int = 0,
+    ):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._bytes = 0
+        self._disk = _DiskCache(disk_path, disk_max_entries) if enabled and disk_path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size(text: str) -> int:
+        return len(text.encode("utf-8"))
+
+    def _remove(self, key: str) -> None:
+        text, _ = self._entries.pop(key)
+        self._bytes -= self._size(text)
+
+    def _store_in_memory(self, key: str, text: str, expires_at: float) -> None:
+        size = self._size(text)
+        if self.max_bytes > 0 and size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (text, expires_at)
+        self._bytes += size
+        while self._entries and (
+            (self.max_entries > 0 and len(self._entries) > self.max_entries)
+            or (self.max_bytes > 0 and self._bytes > self.max_bytes)
+        ):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    async def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        entry = self._entries.get(key)
+        if entry is not None:
+            text, expires_at = entry
+            if expires_at and time.time() > expires_at:
+                self._remove(key)
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return text
+        if self._disk is not None:
+            try:
+                disk_entry = await asyncio.to_thread(self._disk.get, key)
+            except Exception as e:
+                logger.warning("Falha ao ler o cache de respostas em disco: {}", e)
+                disk_entry = None
+            if disk_entry is not None:
+                text, expires_at = disk_entry
+                self._store_in_memory(key, text, expires_at)
+                self.hits += 1
+                self.disk_hits += 1
+                return text
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, text: str) -> None:
+        if not self.enabled:
+            return
+        expires_at = time.time() + self.ttl_seconds if self.ttl_seconds > 0 else 0.0
+        self._store_in_memory(key, text, expires_at)
+        self.stores += 1
+        if self._disk is not None:
+            try:
+                await asyncio.to_thread(self._disk.set, key, text, expires_at)
+            except Exception as e:
+                logger.warning("Falha ao gravar o cache de respostas em disco: {}", e)
+
+    async def store_after_stream(self, text_deltas: AsyncIterator[str], key: str) -> AsyncIterator[str]:
+        """Repassa o stream e grava a resposta completa no cache se ele terminar sem erros."""
+        parts = []
+        async for delta in text_deltas:
+            parts.append(delta)
+            yield delta
+        if parts:
+            await self.set(key, "".join(parts))
+
+    async def close(self) -> None:
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.close)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Instância global do cache de respostas para ser usada pela aplicação FastAPI
+response_cache_instance = ResponseCache(
+    enabled=settings.RESPONSE_CACHE_ENABLED,
+    max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+    ttl_seconds=settings.RESPONSE_CACHE_TTL_SECONDS,
+    disk_path=settings.RESPONSE_CACHE_DISK_PATH,
+    disk_max_entries=settings.RESPONSE_CACHE_DISK_MAX_ENTRIES,
+)
@@ -0,0 +1,108 @@
+import random
+import time
+from typing import Optional, Sequence
+
+from httpx import ReadTimeout
+from gemini_webapi import APIError
+from gemini_webapi.exceptions import (
+    TimeoutError as GeminiTimeoutError,
+    TemporarilyBlocked,
+    UsageLimitExceeded,
+    ModelInvalid,
+)
+from loguru import logger
+
+from app.core.config import settings
+from app.services.metrics import metrics_registry
+
+# Erros transitórios: vale tentar de novo (na mesma ou em outra conta) após um backoff.
+RETRYABLE_ERRORS = (GeminiTimeoutError, ReadTimeout, APIError, TemporarilyBlocked, UsageLimitExceeded, ModelInvalid)
+# Erros ligados ao modelo: a próxima tentativa usa o próximo modelo da cadeia de fallback.
+MODEL_FALLBACK_ERRORS = (ModelInvalid, UsageLimitExceeded)
+
+UPSTREAM_RETRIES = metrics_registry.counter(
+    "gemini_upstream_retries_total",
+    "Novas tentativas de chamada ao Gemini por modelo e tipo do erro que as causou.",
+    ("model", "type"),
+)
+MODEL_FALLBACKS = metrics_registry.counter(
+    "gemini_model_fallbacks_total",
+    "Trocas para o próximo modelo da cadeia de fallback.",
+    ("model", "fallback_model"),
+)
+
+
+class UpstreamRetry:
+    """
+    Estado das tentativas de uma requisição: número máximo de tentativas, backoff exponencial
+    com jitter ("full jitter") e um prazo total, além da posição na cadeia de modelos.
+    """
+
+    def __init__(
+        self,
+        model_chain: Sequence[str],
+        max_attempts: int,
+        base_delay_seconds: float,
+        max_delay_seconds: float,
+        deadline_seconds: float,
+    ):
+        self.model_chain = model_chain
+        self.max_attempts = max(max_attempts, 1)
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.deadline_at = time.monotonic() + deadline_seconds if deadline_seconds > 0 else None
+        self.attempt = 1
+        self._model_index = 0
+
+    @property
+    def model_name(self) -> str:
+        return self.model_chain[self._model_index]
+
+    @property
+    def used_fallback(self) -> bool:
+        return self._model_index > 0
+
+    def _backoff_delay(self) -> float:
+        return random.uniform(0, min(self.max_delay_seconds, self.base_delay_seconds * 2 ** (self.attempt - 1)))
+
+    def next_delay(self, error: BaseException) -> Optional[float]:
+        """
+        Decide se `error` deve ser tentado de novo. Retorna o tempo de espera antes da próxima
+        tentativa, ou None quando o erro deve ser repassado ao cliente.
+        """
+        if not isinstance(error, RETRYABLE_ERRORS) or self.attempt >= self.max_attempts:
+            return None
+        has_next_model = self._model_index + 1 < len(self.model_chain)
+        if isinstance(error, ModelInvalid) and not has_next_model:
+            return None
+        # Sem outro modelo, um limite de uso ainda pode ser contornado em outra conta do pool.
+        switch_model = isinstance(error, MODEL_FALLBACK_ERRORS) and has_next_model
+        # Um modelo inválido não melhora com o tempo: a troca de modelo é imediata.
+        delay = 0.0 if isinstance(error, ModelInvalid) else self._backoff_delay()
+        if self.deadline_at is not None and time.monotonic() + delay >= self.deadline_at:
+            logger.warning("Prazo total de tentativas esgotado; repassando {} ao cliente.", type(error).__name__)
+            return None
+
+        UPSTREAM_RETRIES.inc(model=self.model_name, type=type(error).__name__)
+        if switch_model:
+            previous_model = self.model_name
+            self._model_index += 1
+            MODEL_FALLBACKS.inc(model=previous_model, fallback_model=self.model_name)
+            logger.warning("Modelo Gemini '{}' indisponível ({}); tentando '{}'.", previous_model, type(error).__name__, self.model_name)
+        self.attempt += 1
+        logger.warning(
+            "Erro transitório do upstream ({}: {}). Tentativa {}/{} em {:.2f}s.",
+            type(error).__name__, error, self.attempt, self.max_attempts, delay,
+        )
+        return delay
+
+
+def create_upstream_retry(model_chain: Sequence[str]) -> UpstreamRetry:
+    """Tentativas de uma requisição do endpoint; `model_chain` vem de `ConfigSnapshot.model_fallback_chain`."""
+    return UpstreamRetry(
+        model_chain=model_chain,
+        max_attempts=settings.UPSTREAM_RETRY_MAX_ATTEMPTS,
+        base_delay_seconds=settings.UPSTREAM_RETRY_BASE_DELAY_SECONDS,
+        max_delay_seconds=settings.UPSTREAM_RETRY_MAX_DELAY_SECONDS,
+        deadline_seconds=settings.UPSTREAM_RETRY_DEADLINE_SECONDS,
+    )
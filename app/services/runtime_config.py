@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from types import MappingProxyType
+from typing import Optional, Dict, Any, Tuple, Mapping, FrozenSet
+
+from gemini_webapi.constants import Model
+from loguru import logger
+
+from app.core.config import Settings, settings
+from app.models.openai_schemas import ModelCard, ModelListResponse
+from app.services.gemini_service import resolve_gemini_model_enum
+from app.services.rate_limiter import ApiKeyPolicy, RateLimiter, rate_limiter_instance
+
+# Modelo listado em /v1/models quando não há mapa, mas há um modelo padrão configurado
+GENERIC_DEFAULT_MODEL_ID = "gpt-3.5-turbo"
+
+
+def _key_digest(api_key: str) -> bytes:
+    return hashlib.sha256(api_key.encode("utf-8")).digest()
+
+
+def _validate_reloadable(source: Settings) -> None:
+    """
+    No startup, um JSON inválido vira um aviso e um mapa vazio. Numa recarga isso derrubaria o
+    roteamento de todos os modelos por causa de um erro de digitação, então aqui ele é recusado.
+    """
+    for field_name in ("OPENAI_TO_GEMINI_MODEL_MAP_JSON", "API_KEY_LIMITS_JSON"):
+        value = json.loads(getattr(source, field_name))
+        if not isinstance(value, dict):
+            raise ValueError(f"{field_name} deve ser um objeto JSON")
+
+
+class ConfigSnapshot:
+    """
+    Configuração de roteamento e autenticação pré-processada e imutável: hashes das API keys
+    permitidas (busca O(1)), mapa de modelos já decodificado com os `Model` resolvidos, cadeia
+    de fallback, políticas de limite por key e o corpo de /v1/models já serializado.
+
+    Uma requisição lê `runtime_config_instance.current` uma vez e usa o mesmo snapshot até o
+    fim, mesmo que um reload troque o snapshot no meio dela.
+    """
+
+    __slots__ = (
+        "version",
+        "loaded_at",
+        "_api_key_digests",
+        "model_map",
+        "default_model_name",
+        "_model_enums",
+        "_fallback_models",
+        "default_policy",
+        "key_policies",
+        "models_response_body",
+    )
+
+    def __init__(self, source: Settings, version: int):
+        self.version = version
+        self.loaded_at = time.time()
+        self._api_key_digests: FrozenSet[bytes] = frozenset(_key_digest(api_key) for api_key in source.ALLOWED_API_KEYS)
+        self.model_map: Mapping[str, str] = MappingProxyType(dict(source.OPENAI_TO_GEMINI_MODEL_MAP))
+        self.default_model_name = source.DEFAULT_GEMINI_MODEL_NAME
+        gemini_model_names = dict.fromkeys([self.default_model_name, *self.model_map.values()])
+        self._model_enums: Mapping[str, Model] = MappingProxyType(
+            {gemini_model_name: resolve_gemini_model_enum(gemini_model_name) for gemini_model_name in gemini_model_names}
+        )
+        self._fallback_models: Tuple[str, ...] = (
+            tuple(dict.fromkeys(self.model_map.values())) if source.UPSTREAM_MODEL_FALLBACK_ENABLED else ()
+        )
+        self.default_policy, key_policies = RateLimiter.policies_from_settings(source)
+        self.key_policies: Mapping[str, ApiKeyPolicy] = MappingProxyType(key_policies)
+        self.models_response_body = self._build_models_response(int(self.loaded_at)).model_dump_json().encode("utf-8")
+
+    def _build_models_response(self, created_timestamp: int) -> ModelListResponse:
+        model_ids = list(self.model_map)
+        if not model_ids and self.default_model_name != "unspecified":
+            model_ids = [GENERIC_DEFAULT_MODEL_ID]
+        return ModelListResponse(data=[
+            ModelCard(id=model_id, created=created_timestamp, owned_by="proxy-engine") for model_id in model_ids
+        ])
+
+    def is_allowed_api_key(self, api_key: str) -> bool:
+        return _key_digest(api_key) in self._api_key_digests
+
+    def gemini_model_name(self, openai_model_name: str) -> str:
+        """Modelo Gemini para o modelo OpenAI pedido (o padrão, se não estiver no mapa)."""
+        return self.model_map.get(openai_model_name, self.default_model_name)
+
+    def model_enum(self, gemini_model_name: str) -> Model:
+        model = self._model_enums.get(gemini_model_name)
+        return model if model is not None else resolve_gemini_model_enum(gemini_model_name)
+
+    def model_fallback_chain(self, primary_model_name: str) -> Tuple[str, ...]:
+        """Modelo solicitado seguido dos demais modelos do mapa (somente com UPSTREAM_MODEL_FALLBACK_ENABLED)."""
+        return (primary_model_name, *(name for name in self._fallback_models if name != primary_model_name))
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "loaded_at": int(self.loaded_at),
+            "api_keys": len(self._api_key_digests),
+            "models": len(self.model_map),
+            "key_policies": len(self.key_policies),
+        }
+
+
+class RuntimeConfig:
+    """
+    Mantém o ConfigSnapshot atual e o recarrega quando o arquivo de configuração (.env) muda,
+    sem reiniciar os workers: cada worker verifica o arquivo a cada CONFIG_RELOAD_INTERVAL_SECONDS
+    e troca o snapshot de uma vez (uma atribuição), sem lock no caminho das requisições.
+
+    Só a configuração de roteamento e autenticação é recarregada (API keys, mapa de modelos,
+    modelo padrão, fallback e limites por key); sessões, contas e filas seguem intactas.
+    Um arquivo inválido é ignorado e o snapshot anterior continua valendo.
+    """
+
+    def __init__(self, source: Settings, path: Optional[str], enabled: bool, interval_seconds: float):
+        self.path = path
+        self.enabled = enabled and bool(path)
+        self.interval_seconds = interval_seconds
+        self._current = ConfigSnapshot(source, version=1)
+        self._file_signature = self._read_signature()
+        self._task: Optional[asyncio.Task] = None
+        self.reloads = 0
+        self.failed_reloads = 0
+
+    @property
+    def current(self) -> ConfigSnapshot:
+        return self._current
+
+    def _read_signature(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except (OSError, TypeError):
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run(), name="config-reloader")
+            logger.info("Recarga automática da configuração ativa ('{}', verificação a cada {:.0f}s).", self.path, self.interval_seconds)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            signature = self._read_signature()
+            if signature is not None and signature != self._file_signature:
+                self._file_signature = signature
+                self.reload()
+
+    def reload(self) -> bool:
+        """Relê a configuração e troca o snapshot. Retorna False (mantendo o atual) se ela for inválida."""
+        try:
+            source = Settings()
+            _validate_reloadable(source)
+            snapshot = ConfigSnapshot(source, version=self._current.version + 1)
+        except Exception as e:
+            self.failed_reloads += 1
+            logger.error("Configuração recarregada de '{}' é inválida; mantendo a versão {}: {}", self.path, self._current.version, e)
+            return False
+        rate_limiter_instance.configure(snapshot.default_policy, snapshot.key_policies)
+        self._current = snapshot
+        self.reloads += 1
+        summary = snapshot.summary()
+        logger.info(
+            "Configuração recarregada (versão {}): {} API key(s), {} modelo(s) mapeado(s), {} política(s) por key.",
+            snapshot.version, summary["api_keys"], summary["models"], summary["key_policies"],
+        )
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._current.summary(),
+            "reload_enabled": self.enabled,
+            "reloads": self.reloads,
+            "failed_reloads": self.failed_reloads,
+        }
+
+
+# Instância global da configuração em tempo de execução para ser usada pela aplicação FastAPI
+runtime_config_instance = RuntimeConfig(
+    source=settings,
+    path=Settings.model_config.get("env_file"),
+    enabled=settings.CONFIG_RELOAD_ENABLED,
+    interval_seconds=settings.CONFIG_RELOAD_INTERVAL_SECONDS,
+)
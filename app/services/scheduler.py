@@ -0,0 +1,222 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager, AsyncExitStack
+from typing import Dict, List, Tuple, AsyncIterator
+
+from loguru import logger
+
+from app.core.config import settings
+
+# Peso da amostra mais recente na média móvel do tempo de ocupação de um slot
+SERVICE_TIME_EWMA_ALPHA = 0.2
+# Ordem das filas de prioridade: a fila "batch" só é atendida quando a "interactive" está vazia
+LANE_PRIORITY = {"interactive": 0, "batch": 1}
+
+
+class SchedulerQueueFullError(Exception):
+    """A fila de espera por upstream está cheia, ou a espera excedeu o limite configurado."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _SessionLock:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0 # Requisições segurando ou aguardando o lock
+
+
+class _FairSlots:
+    """
+    Slots de uma conta entregues por weighted fair queueing entre as API keys.
+
+    Cada espera recebe uma etiqueta de término virtual: max(tempo virtual, última etiqueta da key)
+    + 1/peso. Os slots liberados vão para a menor etiqueta da fila de maior prioridade, então uma
+    key com muitas requisições enfileiradas não passa na frente das demais: cada key é atendida
+    na proporção do seu peso, por mais que envie.
+    """
+
+    __slots__ = ("capacity", "active", "virtual_time", "_finish_tags", "_waiters", "_sequence")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.active = 0
+        self.virtual_time = 0.0
+        self._finish_tags: Dict[str, float] = {}
+        self._waiters: List[Tuple[int, float, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    def try_acquire(self) -> bool:
+        if self.active < self.capacity and not self._waiters:
+            self.active += 1
+            return True
+        return False
+
+    async def acquire(self, client_key: str, weight: float, lane: str) -> None:
+        finish_tag = max(self.virtual_time, self._finish_tags.get(client_key, 0.0)) + 1.0 / weight
+        self._finish_tags[client_key] = finish_tag
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (LANE_PRIORITY.get(lane, 0), finish_tag, next(self._sequence), waiter))
+        self._dispatch()
+        try:
+            await waiter
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # O slot chegou junto com o cancelamento (timeout da fila): repassa adiante.
+                self.release()
+            raise
+
+    def release(self) -> None:
+        self.active -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self.active < self.capacity and self._waiters:
+            _, finish_tag, _, waiter = heapq.heappop(self._waiters)
+            if waiter.done():
+                continue # Desistiu da espera
+            self.virtual_time = finish_tag
+            self.active += 1
+            waiter.set_result(None)
+        if not self._waiters:
+            # Fila vazia: as etiquetas antigas não têm mais a quem ordenar.
+            self._finish_tags.clear()
+
+
+class UpstreamScheduler:
+    """
+    Controla o acesso ao upstream (`send_message`):
+    - serializa os turnos de uma mesma conversa (o metadata da ChatSession muda a cada turno);
+    - limita as chamadas simultâneas por conta Gemini;
+    - enfileira o excedente até `max_wait_seconds`, recusando novas entradas quando
+      `max_queue_size` requisições já estão esperando;
+    - entrega os slots liberados de forma justa entre as API keys (peso de cada key) e
+      atende a fila "interactive" antes da "batch".
+    """
+
+    def __init__(self, max_concurrent_per_account: int, max_queue_size: int, max_wait_seconds: float):
+        self.max_concurrent_per_account = max_concurrent_per_account
+        self.max_queue_size = max_queue_size
+        self.max_wait_seconds = max_wait_seconds
+        self._session_locks: Dict[str, _SessionLock] = {}
+        self._account_slots: Dict[str, _FairSlots] = {}
+        self._waiting = 0
+        self._avg_service_seconds = 1.0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    def _retry_after(self) -> float:
+        total_slots = max(len(self._account_slots), 1) * self.max_concurrent_per_account
+        return max(1.0, math.ceil(self._avg_service_seconds * (self._waiting + 1) / total_slots))
+
+    async def _wait_for(self, acquire_coro, what: str) -> float:
+        """Aguarda `acquire_coro` respeitando o tamanho da fila e o tempo máximo de espera."""
+        if self._waiting >= self.max_queue_size:
+            acquire_coro.close()
+            self.rejected += 1
+            raise SchedulerQueueFullError(
+                f"Too many requests waiting for the upstream ({self._waiting} queued).",
+                retry_after=self._retry_after(),
+            )
+        self._waiting += 1
+        started_at = time.perf_counter()
+        try:
+            await asyncio.wait_for(acquire_coro, timeout=self.max_wait_seconds)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise SchedulerQueueFullError(
+                f"Timed out after {self.max_wait_seconds:.0f}s waiting for {what}.",
+                retry_after=self._retry_after(),
+            )
+        finally:
+            self._waiting -= 1
+        return time.perf_counter() - started_at
+
+    @asynccontextmanager
+    async def session_turn(self, session_key: str) -> AsyncIterator[float]:
+        """Garante um único turno em andamento por conversa. Produz o tempo de espera (s)."""
+        session_lock = self._session_locks.get(session_key)
+        if session_lock is None:
+            session_lock = self._session_locks[session_key] = _SessionLock()
+        session_lock.users += 1
+        try:
+            waited = 0.0
+            if session_lock.lock.locked():
+                logger.info("Turno da conversa {} aguardando o turno anterior terminar.", session_key[:12])
+                waited = await self._wait_for(session_lock.lock.acquire(), "the previous turn of this conversation")
+            else:
+                await session_lock.lock.acquire()
+            try:
+                yield waited
+            finally:
+                session_lock.lock.release()
+        finally:
+            session_lock.users -= 1
+            if session_lock.users == 0:
+                self._session_locks.pop(session_key, None)
+
+    @asynccontextmanager
+    async def upstream_slot(
+        self,
+        account_name: str,
+        client_key: str = "",
+        weight: float = 1.0,
+        lane: str = "interactive",
+    ) -> AsyncIterator[float]:
+        """
+        Ocupa um dos `max_concurrent_per_account` slots da conta. Produz o tempo de espera (s).
+        `client_key`, `weight` e `lane` definem a posição na fila quando a conta está ocupada.
+        """
+        slots = self._account_slots.get(account_name)
+        if slots is None:
+            slots = self._account_slots[account_name] = _FairSlots(self.max_concurrent_per_account)
+        if slots.try_acquire():
+            waited = 0.0
+        else:
+            waited = await self._wait_for(
+                slots.acquire(client_key, weight, lane), f"a free upstream slot on account '{account_name}'"
+            )
+        started_at = time.perf_counter()
+        try:
+            yield waited
+        finally:
+            slots.release()
+            service_seconds = time.perf_counter() - started_at
+            self._avg_service_seconds += SERVICE_TIME_EWMA_ALPHA * (service_seconds - self._avg_service_seconds)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "waiting": self._waiting,
+            "active_sessions": len(self._session_locks),
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_service_seconds": round(self._avg_service_seconds, 3),
+        }
+
+
+async def release_after_stream(text_deltas: AsyncIterator[str], resources: AsyncExitStack) -> AsyncIterator[str]:
+    """
+    Mantém os recursos da requisição (lock da conversa, slot, conta) até o stream terminar,
+    inclusive quando o cliente desconecta ou o upstream falha no meio.
+    """
+    async with resources:
+        async for delta in text_deltas:
+            yield delta
+
+
+# Instância global do scheduler para ser usada pela aplicação FastAPI
+upstream_scheduler_instance = UpstreamScheduler(
+    max_concurrent_per_account=settings.SCHEDULER_MAX_CONCURRENT_PER_ACCOUNT,
+    max_queue_size=settings.SCHEDULER_MAX_QUEUE_SIZE,
+    max_wait_seconds=settings.SCHEDULER_MAX_WAIT_SECONDS,
+)
@@ -0,0 +1,241 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, List, Any
+
+from loguru import logger
+from pydantic import BaseModel
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError: # Dependência opcional: pip install redis
+    redis_asyncio = None
+
+
+class SessionRecord(BaseModel):
+    """Estado mínimo para reconstruir uma ChatSession em qualquer worker via `start_chat(metadata=...)`."""
+    metadata: List[Any]
+    account: str # Nome da conta Gemini dona da conversa (o metadata só vale nela)
+    model: Optional[str] = None # Nome do modelo Gemini usado no último turno
+
+
+class SessionMetadataBackend:
+    """Interface dos backends de metadata de sessão compartilhados entre workers/nós."""
+
+    async def get(self, key: str) -> Optional[SessionRecord]:
+        raise NotImplementedError
+
+    async def set(self, key: str, record: SessionRecord) -> None:
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class InMemorySessionMetadataBackend(SessionMetadataBackend):
+    """
+    Backend local ao processo: só serve um worker, mas sobrevive ao despejo das ChatSessions do cache.
+    Com `snapshot_path`, os registros são gravados no arquivo ao fechar (shutdown) e relidos ao criar
+    o backend, para que um restart (deploy) não perca o contexto das conversas.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int, snapshot_path: str = ""):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.snapshot_path = snapshot_path
+        self._records: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        if snapshot_path:
+            self._load_snapshot()
+
+    def _load_snapshot(self) -> None:
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as snapshot_file:
+                entries = json.load(snapshot_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning("Snapshot de sessões '{}' ignorado: {}", self.snapshot_path, e)
+            return
+        now = time.time()
+        for key, expires_at, payload in entries:
+            if not expires_at or expires_at > now:
+                self._records[key] = (expires_at, payload)
+        while self.max_entries > 0 and len(self._records) > self.max_entries:
+            self._records.popitem(last=False)
+        logger.info("{} sessão(ões) restaurada(s) de '{}'.", len(self._records), self.snapshot_path)
+
+    def _write_snapshot(self, entries: List[Any]) -> None:
+        directory = os.path.dirname(self.snapshot_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as snapshot_file:
+            json.dump(entries, snapshot_file)
+        os.replace(temporary_path, self.snapshot_path)
+
+    async def get(self, key: str) -> Optional[SessionRecord]:
+        item = self._records.get(key)
+        if item is None:
+            return None
+        expires_at, payload = item
+        if expires_at and time.time() > expires_at:
+            del self._records[key]
+            return None
+        self._records.move_to_end(key)
+        return SessionRecord.model_validate_json(payload)
+
+    async def set(self, key: str, record: SessionRecord) -> None:
+        expires_at = time.time() + self.ttl_seconds if self.ttl_seconds > 0 else 0.0
+        self._records[key] = (expires_at, record.model_dump_json())
+        self._records.move_to_end(key)
+        while self.max_entries > 0 and len(self._records) > self.max_entries:
+            self._records.popitem(last=False)
+
+    async def delete(self, key: str) -> None:
+        self._records.pop(key, None)
+
+    async def close(self) -> None:
+        if not self.snapshot_path:
+            return
+        now = time.time()
+        # Do menos para o mais recente: a ordem do LRU é preservada na restauração.
+        entries = [
+            [key, expires_at, payload]
+            for key, (expires_at, payload) in self._records.items()
+            if not expires_at or expires_at > now
+        ]
+        await asyncio.to_thread(self._write_snapshot, entries)
+        logger.info("{} sessão(ões) gravada(s) em '{}'.", len(entries), self.snapshot_path)
+
+
+class SQLiteSessionMetadataBackend(SessionMetadataBackend):
+    """
+    Backend em arquivo SQLite (modo WAL), compartilhado por todos os workers de uma mesma máquina.
+    As operações rodam em thread para não bloquear o event loop.
+    """
+
+    # A cada N escritas, remove registros expirados
+    CLEANUP_EVERY_WRITES = 500
+
+    def __init__(self, path: str, ttl_seconds: float):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chat_sessions ("
+            "key TEXT PRIMARY KEY, record TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _get_sync(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT record FROM chat_sessions WHERE key = ? AND (expires_at = 0 OR expires_at > ?)",
+                (key, time.time()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def _set_sync(self, key: str, payload: str) -> None:
+        now = time.time()
+        expires_at = now + self.ttl_seconds if self.ttl_seconds > 0 else 0.0
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO chat_sessions (key, record, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET record = excluded.record, expires_at = excluded.expires_at",
+                (key, payload, expires_at),
+            )
+            self._writes += 1
+            if self._writes % self.CLEANUP_EVERY_WRITES == 0:
+                self._conn.execute("DELETE FROM chat_sessions WHERE expires_at != 0 AND expires_at <= ?", (now,))
+
+    def _delete_sync(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM chat_sessions WHERE key = ?", (key,))
+
+    async def get(self, key: str) -> Optional[SessionRecord]:
+        payload = await asyncio.to_thread(self._get_sync, key)
+        return SessionRecord.model_validate_json(payload) if payload else None
+
+    async def set(self, key: str, record: SessionRecord) -> None:
+        await asyncio.to_thread(self._set_sync, key, record.model_dump_json())
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete_sync, key)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class RedisSessionMetadataBackend(SessionMetadataBackend):
+    """
+    Backend Redis, compartilhado entre máquinas. Aceita qualquer client compatível com a API
+    assíncrona do redis-py (`get`, `set(..., ex=...)`, `delete`), o que permite usar um substituto
+    local; sem `client`, cria um a partir de `url` (requer o pacote opcional `redis`).
+    """
+
+    KEY_PREFIX = "gemini-proxy:session:"
+
+    def __init__(self, ttl_seconds: float, url: Optional[str] = None, client: Any = None):
+        self.ttl_seconds = ttl_seconds
+        if client is None:
+            if redis_asyncio is None:
+                raise RuntimeError("SESSION_BACKEND=redis requer o pacote 'redis' (pip install redis).")
+            client = redis_asyncio.from_url(url)
+        self._client = client
+
+    async def get(self, key: str) -> Optional[SessionRecord]:
+        payload = await self._client.get(self.KEY_PREFIX + key)
+        if payload is None:
+            return None
+        if isinstance(payload, bytes):
+            payload = payload.decode("utf-8")
+        return SessionRecord.model_validate_json(payload)
+
+    async def set(self, key: str, record: SessionRecord) -> None:
+        ttl = int(self.ttl_seconds) if self.ttl_seconds > 0 else None
+        await self._client.set(self.KEY_PREFIX + key, record.model_dump_json(), ex=ttl)
+
+    async def delete(self, key: str) -> None:
+        await self._client.delete(self.KEY_PREFIX + key)
+
+    async def close(self) -> None:
+        close = getattr(self._client, "aclose", None) or getattr(self._client, "close", None)
+        if close is not None:
+            result = close()
+            if asyncio.iscoroutine(result):
+                await result
+
+
+def create_session_metadata_backend(
+    backend_name: str,
+    ttl_seconds: float,
+    max_entries: int,
+    sqlite_path: str,
+    redis_url: str,
+    memory_snapshot_path: str = "",
+) -> SessionMetadataBackend:
+    """Cria o backend configurado em SESSION_BACKEND ("memory", "sqlite" ou "redis")."""
+    backend_name = backend_name.lower()
+    if backend_name == "sqlite":
+        logger.info("Usando backend SQLite para metadata de sessões: {}", sqlite_path)
+        return SQLiteSessionMetadataBackend(sqlite_path, ttl_seconds)
+    if backend_name == "redis":
+        logger.info("Usando backend Redis para metadata de sessões.")
+        return RedisSessionMetadataBackend(ttl_seconds, url=redis_url)
+    if backend_name != "memory":
+        logger.warning("SESSION_BACKEND '{}' desconhecido. Usando 'memory'.", backend_name)
+    return InMemorySessionMetadataBackend(ttl_seconds, max_entries, snapshot_path=memory_snapshot_path)
@@ -0,0 +1,265 @@
+import asyncio
+import hashlib
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, List, Dict, AsyncIterator, Callable
+
+from gemini_webapi import ChatSession
+from loguru import logger
+
+from app.core.config import settings
+from app.models.openai_schemas import ChatMessage
+from app.utils.message_fingerprint import chain_digest, message_identity, message_prefix_digests
+from app.services.session_backends import (
+    SessionMetadataBackend,
+    SessionRecord,
+    create_session_metadata_backend,
+)
+
+# Header opcional que permite ao cliente identificar explicitamente a conversa
+CONVERSATION_ID_HEADER = "X-Conversation-ID"
+
+
+def _fingerprint_key(api_key: str, history_digest: bytes) -> str:
+    digest = hashlib.sha256()
+    digest.update(api_key.encode("utf-8"))
+    digest.update(b"\x00fp\x00")
+    digest.update(history_digest)
+    return digest.hexdigest()
+
+
+def starts_new_conversation(messages: List[ChatMessage], conversation_id: Optional[str] = None) -> bool:
+    """
+    Verdadeiro quando a requisição abre uma conversa nova no Gemini, sob uma chave aleatória (ver
+    `derive_conversation_key`): com SESSION_FINGERPRINTING, sem `X-Conversation-ID` e sem turnos
+    anteriores. A resposta então depende só das mensagens, não de uma ChatSession existente.
+    """
+    return (
+        not conversation_id
+        and settings.SESSION_FINGERPRINTING
+        and all(message.role == "system" for message in messages[:-1])
+    )
+
+
+def derive_conversation_key(api_key: str, messages: List[ChatMessage], conversation_id: Optional[str] = None) -> str:
+    """
+    Deriva a chave da conversa no SessionStore.
+    Com o header `X-Conversation-ID`, a chave é (API Key, id informado). Sem ele, com
+    SESSION_FINGERPRINTING, a chave é o hash do histórico anterior à mensagem atual
+    (`messages[:-1]`): o mesmo hash sob o qual o turno anterior gravou a conversa (ver
+    `derive_reply_conversation_key`). Sem fingerprinting, a conversa é identificada pela sua
+    raiz: o system prompt e a primeira mensagem do usuário.
+    """
+    digest = hashlib.sha256()
+    digest.update(api_key.encode("utf-8"))
+    if conversation_id:
+        digest.update(b"\x00id\x00")
+        digest.update(conversation_id.encode("utf-8"))
+        return digest.hexdigest()
+
+    if settings.SESSION_FINGERPRINTING:
+        if starts_new_conversation(messages):
+            # Sem turnos anteriores não há o que continuar: cada requisição abre uma conversa nova,
+            # sem disputar o turno com as demais que começam pelo mesmo system prompt.
+            return _fingerprint_key(api_key, uuid.uuid4().bytes)
+        return _fingerprint_key(api_key, message_prefix_digests(messages[:-1], strip=True)[-1])
+
+    root_parts = []
+    for role in ("system", "user"):
+        for message in messages:
+            if message.role == role and message.content:
+                root_parts.append(f"{role}:{message_identity(message)}")
+                break
+    for part in root_parts:
+        digest.update(b"\x00")
+        digest.update(part.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def derive_reply_conversation_key(api_key: str, messages: List[ChatMessage], reply_text: str) -> str:
+    """Chave sob a qual o próximo turno (`messages` + esta resposta do assistente) encontra a conversa."""
+    digests = message_prefix_digests(messages, strip=True)
+    return _fingerprint_key(api_key, chain_digest(digests[-1] if digests else b"", "assistant", reply_text.strip()))
+
+
+class _SessionEntry:
+    __slots__ = ("chat_session", "last_access")
+
+    def __init__(self, chat_session: ChatSession, last_access: float):
+        self.chat_session = chat_session
+        self.last_access = last_access
+
+
+class SessionStore:
+    """
+    Mapa limitado de conversa -> ChatSession, com despejo LRU ao atingir `max_entries`
+    e expiração por inatividade (`ttl_seconds`). Mantém contadores de hits/misses/evictions.
+
+    As ChatSessions ficam apenas na memória do processo; o metadata de cada conversa é
+    gravado também no `backend`, para que qualquer worker/nó consiga reconstruí-la.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, backend: SessionMetadataBackend):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self._entries: "OrderedDict[str, _SessionEntry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.backend_hits = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, count=False) is not None
+
+    def _is_expired(self, entry: _SessionEntry, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - entry.last_access > self.ttl_seconds
+
+    def get(self, key: str, count: bool = True) -> Optional[ChatSession]:
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and self._is_expired(entry, now):
+            del self._entries[key]
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            if count:
+                self.misses += 1
+            return None
+        entry.last_access = now
+        self._entries.move_to_end(key)
+        if count:
+            self.hits += 1
+        return entry.chat_session
+
+    def set(self, key: str, chat_session: ChatSession) -> None:
+        now = time.monotonic()
+        self._entries[key] = _SessionEntry(chat_session, now)
+        self._entries.move_to_end(key)
+        self._expire(now)
+        while self.max_entries > 0 and len(self._entries) > self.max_entries:
+            evicted_key, _ = self._entries.popitem(last=False)
+            self.evictions += 1
+            logger.debug("Sessão {} despejada do SessionStore (LRU).", evicted_key[:12])
+
+    def pop(self, key: str) -> Optional[ChatSession]:
+        entry = self._entries.pop(key, None)
+        return entry.chat_session if entry else None
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def _expire(self, now: float) -> None:
+        # As entradas estão em ordem de último acesso: basta varrer a partir da mais antiga.
+        while self._entries:
+            oldest_key, oldest_entry = next(iter(self._entries.items()))
+            if not self._is_expired(oldest_entry, now):
+                break
+            del self._entries[oldest_key]
+            self.expirations += 1
+
+    async def load_record(self, key: str) -> Optional[SessionRecord]:
+        """Busca no backend compartilhado o metadata de uma conversa ausente do cache local."""
+        try:
+            record = await self.backend.get(key)
+        except Exception as e:
+            logger.warning("Falha ao ler metadata da sessão {} do backend: {}", key[:12], e)
+            return None
+        if record is not None:
+            self.backend_hits += 1
+        return record
+
+    async def save(self, key: str, chat_session: ChatSession, account_name: str, previous_key: Optional[str] = None) -> None:
+        """
+        Atualiza o cache local e grava o metadata atual da conversa no backend compartilhado.
+        Com `previous_key` (fingerprinting), a conversa avança para a nova chave: a ChatSession
+        sai da chave antiga, cujo registro no backend continua apontando para o turno anterior
+        (um cliente que ramifica o histórico a partir dali continua daquele ponto).
+        """
+        if previous_key is not None and previous_key != key:
+            self.pop(previous_key)
+        self.set(key, chat_session)
+        model = chat_session.model
+        record = SessionRecord(
+            metadata=list(chat_session.metadata),
+            account=account_name,
+            model=getattr(model, "model_name", model if isinstance(model, str) else None),
+        )
+        try:
+            await self.backend.set(key, record)
+        except Exception as e:
+            # A conversa continua funcionando neste worker; só perde a continuidade entre workers.
+            logger.warning("Falha ao gravar metadata da sessão {} no backend: {}", key[:12], e)
+
+    async def save_after_stream(
+        self,
+        text_deltas: AsyncIterator[str],
+        key: str,
+        chat_session: ChatSession,
+        account_name: str,
+        reply_key: Optional[Callable[[str], str]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Repassa o stream e grava o metadata quando ele termina sem erro do upstream (só então ele está
+        atualizado). Também grava quando o consumidor para antes do fim, como o formatter ao atingir
+        `stop`/`max_tokens`: a ChatSession em memória já avançou este turno.
+        Com `reply_key`, a conversa é gravada sob a chave derivada do texto da resposta.
+        """
+        parts = []
+        try:
+            async for delta in text_deltas:
+                if reply_key is not None:
+                    parts.append(delta)
+                yield delta
+        except (GeneratorExit, asyncio.CancelledError):
+            await self._save_reply(key, chat_session, account_name, reply_key, parts)
+            raise
+        await self._save_reply(key, chat_session, account_name, reply_key, parts)
+
+    async def _save_reply(
+        self,
+        key: str,
+        chat_session: ChatSession,
+        account_name: str,
+        reply_key: Optional[Callable[[str], str]],
+        parts: List[str],
+    ) -> None:
+        if reply_key is None:
+            await self.save(key, chat_session, account_name)
+        else:
+            await self.save(reply_key("".join(parts)), chat_session, account_name, previous_key=key)
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+    def stats(self) -> Dict[str, int]:
+        self._expire(time.monotonic())
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "backend_hits": self.backend_hits,
+        }
+
+
+# Instância global do store de sessões para ser usada pela aplicação FastAPI
+session_store_instance = SessionStore(
+    max_entries=settings.SESSION_STORE_MAX_ENTRIES,
+    ttl_seconds=settings.SESSION_STORE_TTL_SECONDS,
+    backend=create_session_metadata_backend(
+        backend_name=settings.SESSION_BACKEND,
+        ttl_seconds=settings.SESSION_STORE_TTL_SECONDS,
+        max_entries=settings.SESSION_STORE_MAX_ENTRIES,
+        sqlite_path=settings.SESSION_SQLITE_PATH,
+        redis_url=settings.SESSION_REDIS_URL,
+        memory_snapshot_path=settings.SESSION_MEMORY_SNAPSHOT_PATH,
+    ),
+)
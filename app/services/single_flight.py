@@ -0,0 +1,156 @@
+import asyncio
+from typing import Optional, Dict, List, AsyncIterator, Tuple, Callable
+
+from loguru import logger
+
+# Header de resposta presente quando a requisição reaproveitou uma chamada idêntica em andamento
+COALESCED_HEADER = "X-Proxy-Coalesced"
+
+
+class Flight:
+    """
+    Uma chamada ao upstream compartilhada por requisições idênticas.
+    O texto é acumulado em `chunks` e difundido para todos os inscritos; um erro do upstream
+    é repassado a todos eles. Se todos os interessados (líder e seguidores) desistirem, a
+    chamada em background é cancelada.
+    """
+
+    def __init__(self, key: str, on_done: Callable[["Flight"], None]):
+        self.key = key
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+        self.listeners = 1 # O líder e os seguidores que ainda aguardam o resultado
+        self._on_done = on_done
+        self._changed = asyncio.Event()
+        self._pump_task: Optional[asyncio.Task] = None
+
+    @property
+    def has_other_listeners(self) -> bool:
+        """Algum seguidor ainda aguarda o resultado (além do líder)."""
+        return self.listeners > 1
+
+    def leave(self) -> None:
+        """Um interessado desistiu (terminou de ler ou desconectou). Sem nenhum, o upstream é cancelado."""
+        self.listeners -= 1
+        if self.listeners <= 0 and not self.done and self._pump_task is not None and not self._pump_task.done():
+            logger.info("Nenhum cliente aguarda mais a chamada {}; cancelando o upstream (single-flight).", self.key[:12])
+            self._pump_task.cancel()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def push(self, chunk: str) -> None:
+        if chunk:
+            self.chunks.append(chunk)
+            self._notify()
+
+    def finish(self, text: Optional[str] = None) -> None:
+        if self.done:
+            return
+        if text is not None:
+            self.push(text)
+        self.done = True
+        self._notify()
+        self._on_done(self)
+
+    def fail(self, error: BaseException) -> None:
+        if self.done:
+            return
+        if isinstance(error, asyncio.CancelledError):
+            # O cancelamento é do líder; os seguidores recebem um erro comum, não um cancelamento.
+            error = RuntimeError("The identical in-flight request was cancelled before completing.")
+        self.error = error
+        self.done = True
+        self._notify()
+        self._on_done(self)
+
+    def pump(self, text_deltas: AsyncIterator[str]) -> None:
+        """Consome o stream do upstream em background, independente de qual cliente o iniciou."""
+
+        async def _run() -> None:
+            try:
+                async for delta in text_deltas:
+                    self.push(delta)
+            except BaseException as e:
+                self.fail(e)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+            else:
+                self.finish()
+
+        self._pump_task = asyncio.create_task(_run(), name=f"single-flight-{self.key[:12]}")
+
+    async def wait_started(self) -> None:
+        """Aguarda o primeiro chunk (ou o fim). Lança o erro se o upstream falhou antes de produzir algo."""
+        while not self.chunks and not self.done:
+            await self._changed.wait()
+        if self.error is not None and not self.chunks:
+            raise self.error
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        """Produz os chunks já recebidos e depois os novos, até o fim do upstream."""
+        index = 0
+        try:
+            while True:
+                changed = self._changed
+                while index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await changed.wait()
+        finally:
+            self.leave()
+
+    async def text(self) -> str:
+        try:
+            while not self.done:
+                await self._changed.wait()
+        finally:
+            self.leave()
+        if self.error is not None:
+            raise self.error
+        return "".join(self.chunks)
+
+
+class SingleFlight:
+    """Registro das chamadas em andamento por chave (a mesma chave normalizada do cache de respostas)."""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def join(self, key: str) -> Tuple[Flight, bool]:
+        """Retorna (flight, é_líder). O líder faz a chamada ao upstream e deve concluir o flight."""
+        flight = self._flights.get(key)
+        if flight is not None and not flight.done:
+            flight.followers += 1
+            flight.listeners += 1
+            self.coalesced += 1
+            logger.info("Requisição idêntica em andamento ({}); reaproveitando o resultado (single-flight).", key[:12])
+            return flight, False
+        flight = Flight(key, on_done=self._forget)
+        self._flights[key] = flight
+        self.leaders += 1
+        return flight, True
+
+    def _forget(self, flight: Flight) -> None:
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
+
+
+# Instância global do single-flight para ser usada pela aplicação FastAPI
+single_flight_instance = SingleFlight()
@@ -0,0 +1,144 @@
+from typing import AsyncIterator, List, Optional, Tuple, Union
+
+from app.utils.token_counter import MAX_UNCOUNTED_CHARS, count_prefix, count_tokens, token_boundary
+
+
+def normalize_stop_sequences(stop: Optional[Union[str, List[str]]]) -> List[str]:
+    """Converte o campo `stop` da requisição (string ou lista) numa lista sem sequências vazias."""
+    if stop is None:
+        return []
+    if isinstance(stop, str):
+        stop = [stop]
+    return [sequence for sequence in stop if sequence]
+
+
+class CompletionLimiter:
+    """
+    Aplica `stop` e `max_tokens` a uma resposta que chega em pedaços.
+
+    - Stop: segura os últimos `len(maior sequência) - 1` caracteres até saber que eles não
+      começam uma sequência de parada, de modo que sequências divididas entre deltas também
+      são encontradas. O texto é cortado antes da primeira ocorrência (finish_reason "stop").
+    - max_tokens: o texto só é contado em trechos que terminam antes de um espaço em branco,
+      fronteira que o pré-tokenizador nunca atravessa. Assim a contagem não depende de como o
+      upstream fatiou os deltas, e reaplicar o limite a uma resposta já cortada (cache,
+      requisições agrupadas) dá o mesmo texto e o mesmo finish_reason ("length").
+    """
+
+    def __init__(self, stop: Optional[Union[str, List[str]]] = None, max_tokens: Optional[int] = None):
+        self.stop_sequences = normalize_stop_sequences(stop)
+        self.max_tokens = max_tokens
+        self._hold_back = max((len(sequence) for sequence in self.stop_sequences), default=1) - 1
+        self._buffer = ""
+        self.completion_tokens = 0
+        self.finish_reason = "stop"
+        self.done = max_tokens is not None and max_tokens <= 0
+        if self.done:
+            self.finish_reason = "length"
+
+    @property
+    def active(self) -> bool:
+        return bool(self.stop_sequences) or self.max_tokens is not None
+
+    def _find_stop(self) -> int:
+        positions = [position for position in (self._buffer.find(sequence) for sequence in self.stop_sequences) if position >= 0]
+        return min(positions) if positions else -1
+
+    def _commit(self, text: str) -> str:
+        """Conta `text` (que começa numa fronteira) e o corta se o orçamento de tokens acabar."""
+        if self.max_tokens is None or not text:
+            return text
+        remaining = self.max_tokens - self.completion_tokens
+        # Uma única contagem: o maior prefixo que cabe no orçamento (o texto todo, se couber).
+        end, tokens = count_prefix(text, remaining)
+        self.completion_tokens += tokens
+        if end == len(text) and tokens < remaining:
+            return text
+        self.done = True
+        self.finish_reason = "length"
+        return text[:end]
+
+    def feed(self, delta: str) -> str:
+        """Recebe um delta do upstream e devolve o texto que já pode ser enviado ao cliente."""
+        if self.done:
+            return ""
+        self._buffer += delta
+        stop_position = self._find_stop()
+        if stop_position >= 0:
+            text = self._commit(self._buffer[:stop_position])
+            self._buffer = ""
+            self.done = True
+            return text
+
+        safe_end = len(self._buffer) - self._hold_back
+        if self.max_tokens is not None and safe_end < MAX_UNCOUNTED_CHARS:
+            safe_end = token_boundary(self._buffer, safe_end)
+        elif self.max_tokens is not None:
+            safe_end = max(token_boundary(self._buffer, safe_end), safe_end - MAX_UNCOUNTED_CHARS // 2)
+        if safe_end <= 0:
+            return ""
+        text, self._buffer = self._buffer[:safe_end], self._buffer[safe_end:]
+        return self._commit(text)
+
+    def flush(self) -> str:
+        """Fim do upstream: devolve o texto que estava retido (já sem sequência de parada)."""
+        if self.done:
+            return ""
+        text, self._buffer = self._buffer, ""
+        return self._commit(text)
+
+
+def limit_completion(
+    text: str, stop: Optional[Union[str, List[str]]] = None, max_tokens: Optional[int] = None
+) -> Tuple[str, str, int]:
+    """
+    Aplica `stop` e `max_tokens` a uma resposta completa. Retorna (texto, finish_reason, tokens),
+    contando o texto uma única vez (com `max_tokens`, a contagem é a do próprio corte).
+    """
+    limiter = CompletionLimiter(stop, max_tokens)
+    if not limiter.active:
+        return text, "stop", count_tokens(text)
+    text = limiter.feed(text) + limiter.flush()
+    tokens = limiter.completion_tokens if max_tokens is not None else count_tokens(text)
+    return text, limiter.finish_reason, tokens
+
+
+def truncate_completion(
+    text: str, stop: Optional[Union[str, List[str]]] = None, max_tokens: Optional[int] = None
+) -> Tuple[str, str]:
+    """Aplica `stop` e `max_tokens` a uma resposta completa. Retorna (texto, finish_reason)."""
+    limiter = CompletionLimiter(stop, max_tokens)
+    if not limiter.active:
+        return text, "stop"
+    return limiter.feed(text) + limiter.flush(), limiter.finish_reason
+
+
+async def limit_text_deltas(text_deltas: AsyncIterator[str], limiter: CompletionLimiter) -> AsyncIterator[str]:
+    """
+    Repassa os deltas já limitados. Ao atingir o limite, para de consumir e fecha a fonte:
+    aplicado direto sobre o stream do Gemini, isso cancela a geração e libera a conta antes.
+    """
+    if not limiter.active:
+        async for delta in text_deltas:
+            yield delta
+        return
+    try:
+        async for delta in text_deltas:
+            text = limiter.feed(delta)
+            if text:
+                yield text
+            if limiter.done:
+                return
+    except Exception:
+        # Entrega o texto retido antes de repassar o erro do upstream.
+        text = limiter.flush()
+        if text:
+            yield text
+        raise
+    finally:
+        aclose = getattr(text_deltas, "aclose", None)
+        if aclose is not None:
+            await aclose()
+    text = limiter.flush()
+    if text:
+        yield text
@@ -0,0 +1,45 @@
+import hashlib
+from typing import List, Optional
+
+from app.models.openai_schemas import ChatMessage
+
+
+def chain_digest(previous: bytes, role: str, content: Optional[str]) -> bytes:
+    """Estende o hash de um prefixo do histórico com mais uma mensagem."""
+    digest = hashlib.blake2b(previous, digest_size=16)
+    digest.update(role.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update((content or "").encode("utf-8"))
+    return digest.digest()
+
+
+def message_identity(message: ChatMessage, strip: bool = False) -> str:
+    """
+    Texto que identifica a mensagem: o conteúdo textual e, se houver anexos, o hash das origens
+    deles (data URLs de vários MB entram no hash, não na string).
+    """
+    text = message.text or ""
+    if strip:
+        text = text.strip()
+    attachments = message.attachments
+    if not attachments:
+        return text
+    digest = hashlib.blake2b(digest_size=16)
+    for part in attachments:
+        digest.update(part.source.encode("utf-8"))
+        digest.update(b"\x00")
+    return f"{text}\x00{digest.hexdigest()}"
+
+
+def message_prefix_digests(messages: List[ChatMessage], strip: bool = False) -> List[bytes]:
+    """
+    Hash encadeado do histórico: o item `i` identifica `messages[:i + 1]` (papel e conteúdo de
+    cada mensagem, na ordem). Todos os prefixos saem de uma única passada pelas mensagens.
+    Com `strip=True`, espaços nas pontas do conteúdo são ignorados (clientes costumam apará-los).
+    """
+    digests: List[bytes] = []
+    previous = b""
+    for message in messages:
+        previous = chain_digest(previous, message.role, message_identity(message, strip=strip))
+        digests.append(previous)
+    return digests
@@ -1,42 +1,55 @@
+import asyncio
+import itertools
+import json
 import time
 import uuid
-from typing import Optional, Dict, Any, AsyncGenerator, List
+from typing import Optional, AsyncGenerator, AsyncIterator, List, Union, Sequence, Tuple
+
+from loguru import logger
 
 from app.models.openai_schemas import (
     ChatCompletionResponse,
     Choice,
     ResponseMessage,
     Usage,
-    ChatCompletionChunkResponse,
-    StreamingChoice,
-    DeltaMessage,
+    OpenAIErrorResponse,
+    OpenAIErrorDetail,
 )
-from gemini_webapi.types import ModelOutput # Supondo que ModelOutput está acessível
-
-# Placeholder para contagem de tokens, já que Gemini-API não fornece diretamente.
-# Você pode querer integrar uma biblioteca como 'tiktoken' se precisar de contagens mais precisas,
-# mas lembre-se que a tokenização do Gemini é diferente da do OpenAI.
-def count_tokens(text: Optional[str]) -> int:
-    if text is None:
-        return 0
-    # Estimativa muito simples, substitua por algo melhor se necessário
-    return len(text.split())
-
+from app.core.config import settings
+from app.utils.token_counter import count_tokens, IncrementalTokenCount
+from app.utils.completion_limits import CompletionLimiter, limit_completion, limit_text_deltas
+from app.utils.stream_chunking import split_full_text, rechunk_text_deltas, coalesce_by_interval
 
 def format_to_openai_response(
     prompt_text: Optional[str],
     gemini_response_text: str,
     model_name: str, # Modelo solicitado ou o modelo Gemini usado
-    original_request_id: Optional[str] = None # Para manter o mesmo ID se gerado antes
+    original_request_id: Optional[str] = None, # Para manter o mesmo ID se gerado antes
+    prompt_tokens: Optional[int] = None, # Tokens do prompt completo; se omitido, conta só `prompt_text`
+    stop: Optional[Union[str, List[str]]] = None, # Sequências de parada da requisição
+    max_tokens: Optional[int] = None,
+    extra_choice_texts: Sequence[str] = (), # Escolhas 1..n-1 (n > 1), na ordem do `index`
 ) -> ChatCompletionResponse:
     """
-    Formata a resposta completa do Gemini no padrão OpenAI ChatCompletionResponse.
+    Formata a resposta completa do Gemini no padrão OpenAI ChatCompletionResponse,
+    cortando cada escolha em `stop` / `max_tokens` quando informados. O `usage` soma os
+    tokens de todas as escolhas, como na API da OpenAI.
     """
     completion_id = original_request_id or f"chatcmpl-{uuid.uuid4().hex[:12]}"
     created_timestamp = int(time.time())
 
-    prompt_tokens = count_tokens(prompt_text)
-    completion_tokens = count_tokens(gemini_response_text)
+    if prompt_tokens is None:
+        prompt_tokens = count_tokens(prompt_text)
+    choices = []
+    completion_tokens = 0
+    for index, choice_text in enumerate((gemini_response_text, *extra_choice_texts)):
+        choice_text, finish_reason, choice_tokens = limit_completion(choice_text, stop, max_tokens)
+        completion_tokens += choice_tokens
+        choices.append(Choice(
+            index=index,
+            message=ResponseMessage(role="assistant", content=choice_text),
+            finish_reason=finish_reason, # "length" se cortada em max_tokens
+        ))
     total_tokens = prompt_tokens + completion_tokens
 
     return ChatCompletionResponse(
@@ -44,13 +57,7 @@ def format_to_openai_response(
         object="chat.completion",
         created=created_timestamp,
         model=model_name,
-        choices=[
-            Choice(
-                index=0,
-                message=ResponseMessage(role="assistant", content=gemini_response_text),
-                finish_reason="stop", # Assumindo que o Gemini sempre para quando termina
-            )
-        ],
+        choices=choices,
         usage=Usage(
             prompt_tokens=prompt_tokens,
             completion_tokens=completion_tokens,
@@ -58,59 +65,175 @@ def format_to_openai_response(
         ),
     )
 
+def _json_string(value: str) -> str:
+    # Mesmo escape do model_dump_json do Pydantic: UTF-8 literal, só aspas, barra e controles escapados.
+    return json.dumps(value, ensure_ascii=False)
+
+
+class ChunkEncoder:
+    """
+    Serializa os eventos SSE de um stream sem montar a árvore Pydantic por chunk.
+    A parte fixa do JSON (id, object, created, model) é pré-montada uma única vez; a cada
+    evento só o conteúdo do delta é escapado. A saída é idêntica byte a byte à de
+    `ChatCompletionChunkResponse(...).model_dump_json(exclude_none=True)`.
+    """
+
+    def __init__(self, completion_id: str, model_name: str, created: int):
+        self._head = (
+            f'data: {{"id":{_json_string(completion_id)},"object":"chat.completion.chunk",'
+            f'"created":{int(created)},"model":{_json_string(model_name)},"choices":[{{"index":'
+        )
+
+    def content(self, text: str, index: int = 0) -> str:
+        return f'{self._head}{index},"delta":{{"content":{_json_string(text)}}}}}]}}\n\n'
+
+    def finish(self, finish_reason: str = "stop", index: int = 0) -> str:
+        return f'{self._head}{index},"delta":{{}},"finish_reason":{_json_string(finish_reason)}}}]}}\n\n'
+
+    def usage(self, prompt_tokens: int, completion_tokens: int) -> str:
+        """Chunk final de `stream_options.include_usage`: sem choices, só o `usage`."""
+        return (
+            f'{self._head[:self._head.rindex("[")]}[],"usage":{{"prompt_tokens":{prompt_tokens},'
+            f'"completion_tokens":{completion_tokens},"total_tokens":{prompt_tokens + completion_tokens}}}}}\n\n'
+        )
+
+
 async def generate_openai_streaming_chunks(
     gemini_response_text: str,
     model_name: str,
     original_request_id: Optional[str] = None,
     # gemini_model_output: Optional[ModelOutput] = None # Se precisar de mais dados do ModelOutput
+    usage_prompt_tokens: Optional[int] = None, # Se informado, envia o chunk de `usage` no final
+    stop: Optional[Union[str, List[str]]] = None,
+    max_tokens: Optional[int] = None,
+    extra_choice_texts: Sequence[str] = (), # Escolhas 1..n-1 (n > 1)
 ) -> AsyncGenerator[str, None]:
     """
     Gera chunks de resposta no formato OpenAI ChatCompletionChunkResponse para streaming.
-    Este é um streaming "artificial" da resposta completa.
+    Este é um streaming "artificial" da resposta completa, fatiada conforme STREAM_CHUNK_GRANULARITY
+    (por padrão, uma palavra por evento). Com várias escolhas, os pedaços são intercalados por `index`.
     """
     completion_id = original_request_id or f"chatcmpl-{uuid.uuid4().hex[:12]}"
-    created_timestamp = int(time.time())
+    encoder = ChunkEncoder(completion_id, model_name, int(time.time()))
+    choices = [
+        limit_completion(choice_text, stop, max_tokens)
+        for choice_text in (gemini_response_text, *extra_choice_texts)
+    ]
+    pieces_by_choice = [
+        split_full_text(choice_text, settings.STREAM_CHUNK_GRANULARITY, settings.STREAM_CHUNK_CHARS)
+        for choice_text, _, _ in choices
+    ]
 
-    # Chunk inicial (opcional, algumas implementações enviam um delta com role)
-    # yield f"data: {ChatCompletionChunkResponse(id=completion_id, model=model_name, created=created_timestamp, choices=[StreamingChoice(index=0, delta=DeltaMessage(role='assistant'), finish_reason=None)]).model_dump_json(exclude_none=True)}\n\n"
-
-    # Simplesmente dividindo por palavras para simular o streaming.
-    # Para uma melhor simulação, você pode querer quebrar em tokens ou frases menores.
-    words = gemini_response_text.split(" ")
-    accumulated_content = ""
-
-    for i, word in enumerate(words):
-        delta_content = word + (" " if i < len(words) - 1 else "")
-        accumulated_content += delta_content
-
-        chunk = ChatCompletionChunkResponse(
-            id=completion_id,
-            model=model_name,
-            created=created_timestamp, # Pode ser o mesmo timestamp ou atualizar
-            choices=[
-                StreamingChoice(
-                    index=0,
-                    delta=DeltaMessage(content=delta_content),
-                    finish_reason=None,
-                )
-            ],
-        )
-        yield f"data: {chunk.model_dump_json(exclude_none=True)}\n\n"
-        # Pequeno delay para tornar o streaming mais perceptível, remova para produção
-        # await asyncio.sleep(0.02)
+    for pieces in itertools.zip_longest(*pieces_by_choice):
+        for index, piece in enumerate(pieces):
+            if piece is not None:
+                yield encoder.content(piece, index)
 
     # Chunk final com finish_reason
-    final_chunk = ChatCompletionChunkResponse(
-        id=completion_id,
-        model=model_name,
-        created=created_timestamp,
-        choices=[
-            StreamingChoice(
-                index=0,
-                delta=DeltaMessage(), # Delta vazio
-                finish_reason="stop",
+    for index, (_, finish_reason, _) in enumerate(choices):
+        yield encoder.finish(finish_reason, index)
+    if usage_prompt_tokens is not None:
+        yield encoder.usage(usage_prompt_tokens, sum(choice_tokens for _, _, choice_tokens in choices))
+    yield "data: [DONE]\n\n"
+
+
+async def generate_openai_streaming_chunks_from_deltas(
+    text_deltas: AsyncIterator[str],
+    model_name: str,
+    original_request_id: Optional[str] = None,
+    usage_prompt_tokens: Optional[int] = None, # Se informado, envia o chunk de `usage` no final
+    stop: Optional[Union[str, List[str]]] = None,
+    max_tokens: Optional[int] = None,
+    extra_choice_deltas: Sequence[AsyncIterator[str]] = (), # Deltas das escolhas 1..n-1 (n > 1)
+) -> AsyncGenerator[str, None]:
+    """
+    Gera chunks OpenAI ChatCompletionChunkResponse a partir de deltas incrementais do Gemini.
+    Os deltas são cortados em `stop` / `max_tokens`, reagrupados conforme STREAM_CHUNK_GRANULARITY
+    e STREAM_FLUSH_INTERVAL_MS e repassados ao cliente assim que ficam prontos (streaming real).
+    Se o upstream falhar depois que o streaming começou, não é mais possível mudar o
+    status HTTP, então um evento de erro no formato OpenAI é enviado antes de encerrar.
+    """
+    completion_id = original_request_id or f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    encoder = ChunkEncoder(completion_id, model_name, int(time.time()))
+    limiters = [CompletionLimiter(stop, max_tokens) for _ in range(1 + len(extra_choice_deltas))]
+    pieces_by_choice = [
+        coalesce_by_interval(
+            rechunk_text_deltas(
+                limit_text_deltas(choice_deltas, limiter), settings.STREAM_CHUNK_GRANULARITY, settings.STREAM_CHUNK_CHARS
+            ),
+            settings.STREAM_FLUSH_INTERVAL_MS / 1000,
+        )
+        for choice_deltas, limiter in zip((text_deltas, *extra_choice_deltas), limiters)
+    ]
+
+    # Uma contagem por escolha, feita à medida que os pedaços saem (cada trecho contado uma vez); o
+    # `usage` soma as escolhas, como no não-streaming. Com `max_tokens`, o limiter já contou o texto.
+    completion_counts = None
+    if usage_prompt_tokens is not None and max_tokens is None:
+        completion_counts = [IncrementalTokenCount() for _ in limiters]
+    try:
+        if not extra_choice_deltas:
+            async for piece in pieces_by_choice[0]:
+                if completion_counts is not None:
+                    completion_counts[0].add(piece)
+                yield encoder.content(piece)
+        else:
+            async for index, piece in interleave_choices(pieces_by_choice):
+                if completion_counts is not None:
+                    completion_counts[index].add(piece)
+                yield encoder.content(piece, index)
+    except Exception as e:
+        logger.error("Erro do upstream durante o streaming incremental ({}): {}", completion_id, e)
+        error_payload = OpenAIErrorResponse(
+            error=OpenAIErrorDetail(
+                message=f"Upstream error while streaming from Gemini service: {str(e)}",
+                type="api_error",
+                code="upstream_stream_error"
             )
-        ],
-    )
-    yield f"data: {final_chunk.model_dump_json(exclude_none=True)}\n\n"
+        )
+        yield f"data: {error_payload.model_dump_json(exclude_none=True)}\n\n"
+        return
+
+    for index, limiter in enumerate(limiters):
+        yield encoder.finish(limiter.finish_reason, index)
+    if usage_prompt_tokens is not None:
+        if completion_counts is not None:
+            completion_tokens = sum(completion_count.total for completion_count in completion_counts)
+        else:
+            completion_tokens = sum(limiter.completion_tokens for limiter in limiters)
+        yield encoder.usage(usage_prompt_tokens, completion_tokens)
     yield "data: [DONE]\n\n"
+
+
+async def interleave_choices(pieces_by_choice: Sequence[AsyncIterator[str]]) -> AsyncIterator[Tuple[int, str]]:
+    """
+    Consome os streams das escolhas ao mesmo tempo e produz (index, pedaço) na ordem em que os
+    pedaços ficam prontos. Se um deles falhar, os demais são cancelados e o erro é relançado.
+    """
+    # Fila curta: uma escolha mais rápida não acumula pedaços além do que o cliente consome.
+    queue: "asyncio.Queue[Tuple[int, Optional[str], Optional[BaseException]]]" = asyncio.Queue(maxsize=len(pieces_by_choice))
+
+    async def pump(index: int, pieces: AsyncIterator[str]) -> None:
+        try:
+            async for piece in pieces:
+                await queue.put((index, piece, None))
+        except Exception as e:
+            await queue.put((index, None, e))
+            return
+        await queue.put((index, None, None))
+
+    tasks = [asyncio.create_task(pump(index, pieces)) for index, pieces in enumerate(pieces_by_choice)]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            index, piece, error = await queue.get()
+            if error is not None:
+                raise error
+            if piece is None:
+                remaining -= 1
+                continue
+            yield index, piece
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
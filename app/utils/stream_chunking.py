@@ -0,0 +1,112 @@
+import asyncio
+import re
+from typing import AsyncIterator, List, Tuple
+
+# Granularidades aceitas em STREAM_CHUNK_GRANULARITY
+GRANULARITIES = ("upstream", "word", "chars", "sentence")
+
+# Uma frase termina em pontuação final (seguida de aspas/parênteses opcionais) e espaço, ou em quebra de linha.
+_SENTENCE_RE = re.compile(r".*?(?:[.!?…]+[\"')\]]*\s+|\n+)", re.DOTALL)
+
+
+def split_complete_units(buffer: str, granularity: str, chunk_chars: int) -> Tuple[List[str], str]:
+    """
+    Separa do início de `buffer` as unidades já completas na granularidade pedida.
+    Retorna (unidades, resto); o resto aguarda mais texto do upstream.
+    """
+    if granularity == "word":
+        last_space = buffer.rfind(" ")
+        if last_space < 0:
+            return [], buffer
+        return [word + " " for word in buffer[:last_space].split(" ")], buffer[last_space + 1:]
+    if granularity == "chars":
+        size = max(chunk_chars, 1)
+        complete = len(buffer) - len(buffer) % size
+        return [buffer[i:i + size] for i in range(0, complete, size)], buffer[complete:]
+    if granularity == "sentence":
+        units = []
+        position = 0
+        for match in _SENTENCE_RE.finditer(buffer):
+            units.append(match.group())
+            position = match.end()
+        return units, buffer[position:]
+    return ([buffer] if buffer else []), ""
+
+
+def split_full_text(text: str, granularity: str, chunk_chars: int) -> List[str]:
+    """Divide uma resposta completa (streaming sintético) em pedaços na granularidade pedida."""
+    if granularity not in ("chars", "sentence"):
+        # Mesmo fatiamento histórico do streaming sintético: uma palavra (com o espaço) por evento.
+        words = text.split(" ")
+        return [word + (" " if i < len(words) - 1 else "") for i, word in enumerate(words)]
+    units, rest = split_complete_units(text, granularity, chunk_chars)
+    return units + [rest] if rest else units
+
+
+async def rechunk_text_deltas(text_deltas: AsyncIterator[str], granularity: str, chunk_chars: int) -> AsyncIterator[str]:
+    """Reagrupa os deltas do upstream em unidades completas (palavra, N caracteres ou frase)."""
+    if granularity == "upstream":
+        async for delta in text_deltas:
+            yield delta
+        return
+    buffer = ""
+    try:
+        async for delta in text_deltas:
+            buffer += delta
+            units, buffer = split_complete_units(buffer, granularity, chunk_chars)
+            for unit in units:
+                yield unit
+    except Exception:
+        # Entrega o texto parcial antes de repassar o erro do upstream.
+        if buffer:
+            yield buffer
+        raise
+    if buffer:
+        yield buffer
+
+
+async def coalesce_by_interval(pieces: AsyncIterator[str], interval_seconds: float) -> AsyncIterator[str]:
+    """
+    Junta os pedaços que chegam dentro de `interval_seconds` num único evento. O primeiro pedaço
+    após um intervalo ocioso sai imediatamente, para não atrasar o TTFB.
+    """
+    if interval_seconds <= 0:
+        async for piece in pieces:
+            yield piece
+        return
+
+    loop = asyncio.get_running_loop()
+    iterator = pieces.__aiter__()
+    buffer: List[str] = []
+    last_flush_at = float("-inf")
+    next_piece = None
+    try:
+        while True:
+            if next_piece is None:
+                next_piece = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(last_flush_at + interval_seconds - loop.time(), 0) if buffer else None
+            done, _ = await asyncio.wait({next_piece}, timeout=timeout)
+            if not done:
+                yield "".join(buffer)
+                buffer.clear()
+                last_flush_at = loop.time()
+                continue
+            finished, next_piece = next_piece, None
+            try:
+                buffer.append(finished.result())
+            except StopAsyncIteration:
+                break
+            except Exception:
+                # Entrega o que já chegou antes de repassar o erro do upstream.
+                if buffer:
+                    yield "".join(buffer)
+                raise
+            if loop.time() - last_flush_at >= interval_seconds:
+                yield "".join(buffer)
+                buffer.clear()
+                last_flush_at = loop.time()
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if next_piece is not None:
+            next_piece.cancel()
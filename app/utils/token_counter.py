@@ -0,0 +1,231 @@
+import math
+import re
+from functools import lru_cache
+from typing import Optional, List, Callable, Tuple
+
+from loguru import logger
+
+from app.core.config import settings
+from app.models.openai_schemas import ChatMessage
+
+# Tokens extras por mensagem e para o início da resposta do assistente (mesma conta da OpenAI para chat)
+TOKENS_PER_MESSAGE = 3
+TOKENS_FOR_REPLY_PRIMING = 3
+# Estimativa por imagem/arquivo anexado (custo de uma imagem em baixa resolução na OpenAI)
+TOKENS_PER_ATTACHMENT = 85
+
+# Pré-tokenização no estilo do cl100k: contrações, palavras (com o espaço anterior), números em
+# grupos de até 3 dígitos, pontuação e espaços. O BPE real nunca junta tokens entre esses pedaços.
+_PRE_TOKEN_RE = re.compile(
+    r"'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+|\s+(?!\S)|\s+",
+    re.IGNORECASE,
+)
+# Pedaços distintos em cache no contador heurístico (palavras se repetem muito entre respostas)
+PIECE_CACHE_SIZE = 65536
+# Texto sem espaços (ex.: CJK) acima deste tamanho é contado mesmo sem fronteira, para não acumular.
+MAX_UNCOUNTED_CHARS = 256
+# IncrementalTokenCount conta em lotes deste tamanho: contar cada delta pequeno custaria mais que o texto todo.
+INCREMENTAL_COUNT_CHARS = 4096
+
+
+def token_boundary(text: str, end: int) -> int:
+    """
+    Início do último trecho de espaços em branco antes de `end` (-1 se não houver). Nenhum pedaço
+    do pré-tokenizador atravessa essa posição, então contar o texto antes e depois dela separados
+    dá o mesmo total que contar o texto inteiro (um trecho de espaços vira um pedaço só, por isso o
+    corte é no início dele, não no último espaço).
+    """
+    for index in range(end - 1, -1, -1):
+        if text[index].isspace():
+            while index > 0 and text[index - 1].isspace():
+                index -= 1
+            return index
+    return -1
+
+
+class TokenCounter:
+    """Interface dos contadores de tokens usados no `usage` e no orçamento de `max_tokens`."""
+
+    name = "base"
+
+    def count(self, text: str) -> int:
+        raise NotImplementedError
+
+    def count_prefix(self, text: str, budget: int) -> Tuple[int, int]:
+        """
+        Maior prefixo de `text` com até `budget` tokens. Retorna (tamanho do prefixo, `count` dele).
+        A implementação padrão faz uma busca binária sobre `count`.
+        """
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count(text[:middle]) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        return low, self.count(text[:low])
+
+
+class WhitespaceTokenCounter(TokenCounter):
+    """Contagem histórica do proxy: uma palavra separada por espaço = um token."""
+
+    name = "whitespace"
+
+    def count(self, text: str) -> int:
+        return len(text.split())
+
+
+class HeuristicTokenCounter(TokenCounter):
+    """
+    Estimativa no estilo BPE sem vocabulário e sem dependências: pré-tokeniza como o cl100k e
+    estima os tokens de cada pedaço pelo tamanho em bytes (palavras comuns viram 1 token;
+    palavras longas, acentuadas ou em outros alfabetos, mais). É uma aproximação, mas bem
+    mais próxima do BPE que contar palavras.
+    """
+
+    name = "heuristic"
+
+    def count(self, text: str) -> int:
+        return sum(map(_piece_tokens, _PRE_TOKEN_RE.findall(text)))
+
+    def count_prefix(self, text: str, budget: int) -> Tuple[int, int]:
+        """
+        Uma única passada pelos pedaços; só o pedaço que estoura o orçamento é cortado. O prefixo
+        cortado é recontado uma vez: um pedaço cortado pode se juntar aos espaços anteriores.
+        """
+        tokens = 0
+        for match in _PRE_TOKEN_RE.finditer(text):
+            piece_tokens = _piece_tokens(match.group())
+            if tokens + piece_tokens > budget:
+                piece_end, _ = super().count_prefix(match.group(), budget - tokens)
+                end = match.start() + piece_end
+                return end, self.count(text[:end])
+            tokens += piece_tokens
+        return len(text), tokens
+
+
+@lru_cache(maxsize=PIECE_CACHE_SIZE)
+def _piece_tokens(piece: str) -> int:
+    stripped = piece.lstrip(" ")
+    if not stripped or stripped.isspace():
+        return 1
+    if stripped.isascii():
+        # Palavras em ASCII: ~4 caracteres por token; pontuação: ~2.
+        return math.ceil(len(stripped) / (4 if stripped[0].isalnum() else 2))
+    return math.ceil(len(stripped.encode("utf-8")) / 3)
+
+
+class TiktokenTokenCounter(TokenCounter):
+    """Contagem exata no vocabulário da OpenAI via `tiktoken` (dependência opcional)."""
+
+    name = "tiktoken"
+
+    def __init__(self, encoding_name: str):
+        import tiktoken  # Importação tardia: só quem configura TOKEN_COUNTER=tiktoken precisa do pacote
+
+        self._encoding = tiktoken.get_encoding(encoding_name)
+
+    def count(self, text: str) -> int:
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def count_prefix(self, text: str, budget: int) -> Tuple[int, int]:
+        """Codifica uma vez e decodifica os primeiros `budget` tokens."""
+        tokens = self._encoding.encode(text, disallowed_special=())
+        if len(tokens) <= budget:
+            return len(text), len(tokens)
+        prefix = self._encoding.decode(tokens[:budget])
+        while budget > 0 and not text.startswith(prefix):
+            # O corte caiu no meio de um caractere multibyte: recua um token.
+            budget -= 1
+            prefix = self._encoding.decode(tokens[:budget])
+        return len(prefix), self.count(prefix)
+
+
+def create_token_counter(counter_name: str, encoding_name: str) -> TokenCounter:
+    """Cria o contador configurado em TOKEN_COUNTER ("heuristic", "tiktoken" ou "whitespace")."""
+    counter_name = counter_name.lower()
+    if counter_name == "tiktoken":
+        try:
+            counter = TiktokenTokenCounter(encoding_name)
+            logger.info("Contador de tokens: tiktoken ({}).", encoding_name)
+            return counter
+        except Exception as e:
+            # Sem o pacote, ou sem o arquivo do vocabulário em cache numa máquina offline.
+            logger.warning("Não foi possível carregar o tiktoken ({}): {}. Usando a estimativa heurística.", encoding_name, e)
+            return HeuristicTokenCounter()
+    if counter_name == "whitespace":
+        return WhitespaceTokenCounter()
+    if counter_name != "heuristic":
+        logger.warning("TOKEN_COUNTER '{}' desconhecido. Usando 'heuristic'.", counter_name)
+    return HeuristicTokenCounter()
+
+
+_counter: Optional[TokenCounter] = None
+_cached_count: Optional[Callable[[str], int]] = None
+
+
+def get_token_counter() -> TokenCounter:
+    """Carrega o contador configurado uma única vez, no primeiro uso."""
+    global _counter, _cached_count
+    if _counter is None:
+        _counter = create_token_counter(settings.TOKEN_COUNTER, settings.TOKEN_COUNTER_ENCODING)
+        # Prompts de sistema e históricos se repetem entre requisições: a contagem fica em cache (LRU).
+        _cached_count = lru_cache(maxsize=settings.TOKEN_COUNTER_CACHE_SIZE)(_counter.count)
+    return _counter
+
+
+def count_tokens(text: Optional[str], cached: bool = False) -> int:
+    """Conta os tokens de `text`. `cached=True` para textos que se repetem (prompts), não para respostas."""
+    if not text:
+        return 0
+    counter = get_token_counter()
+    return _cached_count(text) if cached else counter.count(text)
+
+
+def count_prefix(text: str, budget: int) -> Tuple[int, int]:
+    """Maior prefixo de `text` com até `budget` tokens: (tamanho do prefixo, tokens dele)."""
+    if not text or budget <= 0:
+        return 0, 0
+    return get_token_counter().count_prefix(text, budget)
+
+
+class IncrementalTokenCount:
+    """
+    Conta os tokens de um texto que chega em pedaços (deltas de um stream) sem guardar nem recontar
+    o texto inteiro: a cada INCREMENTAL_COUNT_CHARS, o trecho acumulado é contado uma única vez até
+    o início dos últimos espaços, fronteira que o pré-tokenizador nunca atravessa. O total é o
+    mesmo de contar o texto completo.
+    """
+
+    def __init__(self):
+        self.counted_tokens = 0
+        self._pending: List[str] = []
+        self._pending_chars = 0
+
+    def add(self, text: str) -> None:
+        self._pending.append(text)
+        self._pending_chars += len(text)
+        if self._pending_chars < INCREMENTAL_COUNT_CHARS:
+            return
+        pending = "".join(self._pending)
+        boundary = token_boundary(pending, len(pending))
+        if boundary <= 0:
+            boundary = len(pending) - MAX_UNCOUNTED_CHARS // 2
+        self.counted_tokens += count_tokens(pending[:boundary])
+        self._pending = [pending[boundary:]]
+        self._pending_chars = len(pending) - boundary
+
+    @property
+    def total(self) -> int:
+        return self.counted_tokens + count_tokens("".join(self._pending))
+
+
+def count_message_tokens(messages: List[ChatMessage]) -> int:
+    """Tokens do prompt completo enviado pelo cliente (system + histórico + mensagem atual)."""
+    return sum(
+        TOKENS_PER_MESSAGE
+        + count_tokens(message.role, cached=True)
+        + count_tokens(message.text, cached=True)
+        + TOKENS_PER_ATTACHMENT * len(message.attachments)
+        for message in messages
+    ) + TOKENS_FOR_REPLY_PRIMING
@@ -0,0 +1,96 @@
+"""
+Mede o custo de obter `--n` respostas para o mesmo prompt: antes, o cliente fazia n requisições
+separadas (em sequência ou simultâneas); agora, uma requisição com `n` devolve as n escolhas.
+Mostra o tempo por prompt e o número de chamadas ao upstream.
+
+Sem streaming, a chamada principal vem primeiro e os candidatos que o Gemini já retorna nela
+(`--candidates` por resposta no backend falso) cobrem parte das escolhas: menos chamadas, ao
+custo de uma segunda ida ao upstream para as que faltam. Com streaming, as n-1 chamadas extras
+são disparadas junto com a principal (a gemini-webapi só transmite o candidato escolhido).
+
+Uso:
+    python -m benchmarks.choices --n 4 --candidates 2 --prompts 20 --latency-ms 200
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, List
+
+# n requisições idênticas simultâneas seriam agrupadas numa só chamada (mesma resposta para todas).
+os.environ.setdefault("SINGLE_FLIGHT_ENABLED", "false")
+
+from benchmarks.common import install_fake_backend, call_chat_completions  # noqa: E402
+from app.services.fake_gemini import FakeChatSession  # noqa: E402
+
+
+def count_upstream_calls() -> List[int]:
+    """Conta as chamadas ao upstream falso (send_message e send_message_stream)."""
+    calls = [0]
+    for name in ("send_message", "send_message_stream"):
+        original = getattr(FakeChatSession, name)
+
+        def counted(self, *args, original=original, **kwargs):
+            calls[0] += 1
+            return original(self, *args, **kwargs)
+
+        setattr(FakeChatSession, name, counted)
+    return calls
+
+
+def payload(prompt_index: int, n: int, stream: bool) -> dict:
+    return {
+        "model": "gpt-4o-mini",
+        "messages": [{"role": "user", "content": f"classifique o documento {prompt_index}"}],
+        "n": n,
+        "stream": stream,
+    }
+
+
+async def measure(name: str, prompts: int, calls: List[int], run_prompt: Callable[[int], Awaitable[None]]) -> None:
+    calls[0] = 0
+    started_at = time.perf_counter()
+    for prompt_index in range(prompts):
+        await run_prompt(prompt_index)
+    elapsed_ms = (time.perf_counter() - started_at) * 1000 / prompts
+    print(f"{name:<34}{elapsed_ms:>12.0f}{calls[0] / prompts:>16.1f}")
+
+
+async def run(args: argparse.Namespace) -> None:
+    await install_fake_backend(
+        latency_seconds=args.latency_ms / 1000, tokens_per_second=0, response_tokens=50, candidates=args.candidates
+    )
+    calls = count_upstream_calls()
+    n = args.n
+
+    async def sequential(prompt_index: int, stream: bool) -> None:
+        for _ in range(n):
+            assert (await call_chat_completions(payload(prompt_index, 1, stream)))["status"] == 200
+
+    async def concurrent(prompt_index: int, stream: bool) -> None:
+        results = await asyncio.gather(*(call_chat_completions(payload(prompt_index, 1, stream)) for _ in range(n)))
+        assert all(result["status"] == 200 for result in results)
+
+    async def single(prompt_index: int, stream: bool) -> None:
+        assert (await call_chat_completions(payload(prompt_index, n, stream)))["status"] == 200
+
+    print(f"n={n}, {args.candidates} candidato(s) por resposta, latência do upstream {args.latency_ms:.0f}ms")
+    print(f"{'cenário':<34}{'ms/prompt':>12}{'chamadas/prompt':>16}")
+    for stream in (False, True):
+        mode = "stream" if stream else "json"
+        await measure(f"antes: {n} req. em sequência ({mode})", args.prompts, calls, lambda index: sequential(index, stream))
+        await measure(f"antes: {n} req. simultâneas ({mode})", args.prompts, calls, lambda index: concurrent(index, stream))
+        await measure(f"depois: 1 req. com n={n} ({mode})", args.prompts, calls, lambda index: single(index, stream))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=4, help="Escolhas por prompt.")
+    parser.add_argument("--candidates", type=int, default=2, help="Candidatos por resposta do upstream falso.")
+    parser.add_argument("--prompts", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Duração de cada chamada ao upstream falso.")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Utilitários compartilhados pelos benchmarks: configuração padrão do ambiente (backend falso
+do Gemini, sem limites do scheduler) e um cliente ASGI mínimo que mede TTFB e tempo total.
+
+Os valores abaixo são apenas padrões: variáveis de ambiente já definidas têm precedência.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Optional, Dict, Any
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("GEMINI_BACKEND", "fake")
+os.environ.setdefault("ALLOWED_API_KEYS", '["bench-key"]')
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("AUDIT_LOG_ENABLED", "false")
+os.environ.setdefault("SESSION_MEMORY_SNAPSHOT_PATH", "")
+# O benchmark mede o overhead do proxy, não o limitador de concorrência por conta.
+os.environ.setdefault("SCHEDULER_MAX_CONCURRENT_PER_ACCOUNT", "100000")
+os.environ.setdefault("SCHEDULER_MAX_QUEUE_SIZE", "100000")
+
+from app import main as app_main  # noqa: E402
+from app.main import app  # noqa: E402
+from app.services.fake_gemini import FakeGeminiClient  # noqa: E402
+from app.services.gemini_service import gemini_service_instance  # noqa: E402
+
+API_KEY = "bench-key"
+
+
+async def install_fake_backend(**fake_options: Any) -> FakeGeminiClient:
+    """Troca o client de todas as contas do pool por um FakeGeminiClient com as opções dadas."""
+    fake_client = FakeGeminiClient(**fake_options)
+    await fake_client.init()
+    for account in gemini_service_instance.accounts:
+        account.client = fake_client
+    app_main.active_chat_sessions.clear()
+    return fake_client
+
+
+def current_rss_mb() -> Optional[float]:
+    """RSS atual do processo em MB (Linux); None quando /proc não está disponível."""
+    try:
+        with open("/proc/self/status", encoding="utf-8") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+async def call_chat_completions(payload: Dict[str, Any], api_key: str = API_KEY) -> Dict[str, Any]:
+    """Executa uma requisição ASGI e registra o instante do primeiro e do último chunk de corpo."""
+    body = json.dumps(payload).encode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/v1/chat/completions",
+        "raw_path": b"/v1/chat/completions",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"authorization", f"Bearer {api_key}".encode()),
+        ],
+        "client": ("127.0.0.1", 12345),
+        "server": ("127.0.0.1", 8000),
+    }
+    request_sent = False
+    disconnect = asyncio.Event()
+    timings = {"status": None, "first_byte": None, "last_byte": None, "events": 0}
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            timings["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            chunk = message.get("body", b"")
+            if chunk:
+                now = time.perf_counter()
+                if timings["first_byte"] is None:
+                    timings["first_byte"] = now
+                timings["last_byte"] = now
+                timings["events"] += chunk.count(b"data: ")
+            if not message.get("more_body", False):
+                disconnect.set()
+
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    return {
+        "status": timings["status"],
+        "ttfb_ms": (timings["first_byte"] - start) * 1000 if timings["first_byte"] else None,
+        "total_ms": (timings["last_byte"] - start) * 1000 if timings["last_byte"] else None,
+        "events": timings["events"],
+    }
@@ -0,0 +1,95 @@
+"""
+Mede o custo das consultas de configuração feitas a cada requisição: validação da API key,
+mapeamento do modelo (com o `Model` resolvido e a cadeia de fallback) e a montagem de
+/v1/models. Compara o acesso anterior direto ao `Settings` (o mapa é decodificado do JSON a cada
+acesso, as keys ficam numa lista e /v1/models é montado a cada chamada, reproduzido para
+comparação) com o ConfigSnapshot pré-processado.
+
+Uso:
+    python -m benchmarks.config_snapshot --keys 1000 --models 50 --iterations 20000
+"""
+import argparse
+import json
+import os
+import time
+from typing import Callable
+
+from benchmarks.common import app_main  # noqa: F401  (configura o ambiente padrão dos benchmarks)
+from app.core.config import Settings
+from app.models.openai_schemas import ModelCard, ModelListResponse
+from app.services.gemini_service import resolve_gemini_model_enum
+from app.services.runtime_config import ConfigSnapshot
+
+GEMINI_MODEL_NAMES = ("gemini-2.5-flash", "gemini-2.5-pro", "gemini-2.0-flash")
+
+
+def legacy_request(source: Settings, api_key: str, model: str) -> None:
+    """Caminho anterior de uma requisição de chat: 3 acessos ao mapa, busca linear na lista de keys."""
+    if api_key not in source.ALLOWED_API_KEYS:
+        raise AssertionError("key não encontrada")
+    gemini_model_name = source.DEFAULT_GEMINI_MODEL_NAME
+    if model in source.OPENAI_TO_GEMINI_MODEL_MAP:
+        gemini_model_name = source.OPENAI_TO_GEMINI_MODEL_MAP[model]
+    resolve_gemini_model_enum(gemini_model_name)
+    chain = [gemini_model_name]
+    for name in source.OPENAI_TO_GEMINI_MODEL_MAP.values():
+        if name not in chain:
+            chain.append(name)
+
+
+def snapshot_request(snapshot: ConfigSnapshot, api_key: str, model: str) -> None:
+    if not snapshot.is_allowed_api_key(api_key):
+        raise AssertionError("key não encontrada")
+    gemini_model_name = snapshot.gemini_model_name(model)
+    snapshot.model_enum(gemini_model_name)
+    snapshot.model_fallback_chain(gemini_model_name)
+
+
+def legacy_list_models(source: Settings) -> bytes:
+    model_data = []
+    created_timestamp = int(time.time())
+    for openai_model_name in source.OPENAI_TO_GEMINI_MODEL_MAP.keys():
+        if not any(m.id == openai_model_name for m in model_data):
+            model_data.append(ModelCard(id=openai_model_name, created=created_timestamp, owned_by="proxy-engine"))
+    return ModelListResponse(data=model_data).model_dump_json().encode("utf-8")
+
+
+def measure(function: Callable[[], object], iterations: int) -> float:
+    for _ in range(min(iterations, 100)):  # Aquecimento
+        function()
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - started_at) / iterations * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=1000, help="API keys em ALLOWED_API_KEYS.")
+    parser.add_argument("--models", type=int, default=50, help="Modelos em OPENAI_TO_GEMINI_MODEL_MAP.")
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    api_keys = [f"sk-{index:06d}" for index in range(args.keys)]
+    model_map = {f"gpt-model-{index}": GEMINI_MODEL_NAMES[index % len(GEMINI_MODEL_NAMES)] for index in range(args.models)}
+    os.environ["ALLOWED_API_KEYS"] = json.dumps(api_keys)
+    os.environ["OPENAI_TO_GEMINI_MODEL_MAP_JSON"] = json.dumps(model_map)
+    source = Settings()
+    snapshot = ConfigSnapshot(source, version=1)
+    # Pior caso da busca linear: a última key da lista; modelo do fim do mapa.
+    api_key, model = api_keys[-1], f"gpt-model-{args.models - 1}"
+
+    print(f"{args.keys} keys, {args.models} modelos")
+    print(f"{'operação':<22}{'antes µs':>11}{'depois µs':>11}")
+    rows = (
+        ("chat (auth + modelo)", measure(lambda: legacy_request(source, api_key, model), args.iterations),
+         measure(lambda: snapshot_request(snapshot, api_key, model), args.iterations)),
+        ("/v1/models", measure(lambda: legacy_list_models(source), max(args.iterations // 10, 1)),
+         measure(lambda: snapshot.models_response_body, args.iterations)),
+    )
+    for name, before_us, after_us in rows:
+        print(f"{name:<22}{before_us:>11.2f}{after_us:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
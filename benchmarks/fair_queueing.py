@@ -0,0 +1,108 @@
+"""
+Mede o quanto uma API key barulhenta atrasa as demais quando as contas estão saturadas: a key
+"ruidosa" dispara `--noisy` requisições de uma vez e, logo depois, a key "quieta" dispara as suas
+`--quiet`. Compara a fila anterior (semáforo FIFO por conta, reproduzido para comparação) com os
+slots atuais por weighted fair queueing entre as keys, e também a key quieta com peso maior e a
+ruidosa na fila "batch".
+
+Uso:
+    python -m benchmarks.fair_queueing --noisy 200 --quiet 40 --slots 4 --latency-ms 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import List, Optional
+
+os.environ.setdefault("ALLOWED_API_KEYS", '["noisy-key", "quiet-key"]')
+
+from benchmarks.common import install_fake_backend, call_chat_completions  # noqa: E402
+from app.services import scheduler as scheduler_module  # noqa: E402
+from app.services.rate_limiter import rate_limiter_instance, ApiKeyPolicy  # noqa: E402
+
+
+class FifoSlots:
+    """Fila anterior: um asyncio.Semaphore por conta, na ordem de chegada, sem distinguir keys."""
+
+    def __init__(self, capacity: int):
+        self._semaphore = asyncio.Semaphore(capacity)
+
+    def try_acquire(self) -> bool:
+        if self._semaphore.locked():
+            return False
+        self._semaphore._value -= 1
+        return True
+
+    async def acquire(self, client_key: str, weight: float, lane: str) -> None:
+        await self._semaphore.acquire()
+
+    def release(self) -> None:
+        self._semaphore.release()
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+async def run_scenario(name: str, slots_class, noisy: int, quiet: int, noisy_lane: str, quiet_weight: float) -> None:
+    scheduler = scheduler_module.upstream_scheduler_instance
+    scheduler._account_slots.clear()
+    original_slots_class = scheduler_module._FairSlots
+    scheduler_module._FairSlots = slots_class
+    rate_limiter_instance.key_policies = {
+        "noisy-key": ApiKeyPolicy(0, 0, weight=1.0, lane=noisy_lane),
+        "quiet-key": ApiKeyPolicy(0, 0, weight=quiet_weight, lane="interactive"),
+    }
+    run_id = f"{name}-{time.time():.0f}"
+
+    def payload(prefix: str, index: int):
+        return {
+            "model": "gpt-4o-mini",
+            "messages": [{"role": "user", "content": json.dumps([run_id, prefix, index])}],
+            "stream": True,
+        }
+
+    try:
+        noisy_tasks = [asyncio.create_task(call_chat_completions(payload("noisy", index), api_key="noisy-key")) for index in range(noisy)]
+        await asyncio.sleep(0) # As ruidosas entram na fila primeiro
+        quiet_results = await asyncio.gather(
+            *(call_chat_completions(payload("quiet", index), api_key="quiet-key") for index in range(quiet))
+        )
+        noisy_results = await asyncio.gather(*noisy_tasks)
+    finally:
+        scheduler_module._FairSlots = original_slots_class
+        scheduler._account_slots.clear()
+
+    quiet_latencies = [result["total_ms"] for result in quiet_results if result["status"] == 200]
+    noisy_latencies = [result["total_ms"] for result in noisy_results if result["status"] == 200]
+    print(
+        f"{name:<27}{percentile(quiet_latencies, 0.5):>13.0f}{max(quiet_latencies):>13.0f}"
+        f"{percentile(noisy_latencies, 0.5):>13.0f}{max(noisy_latencies):>13.0f}"
+    )
+
+
+async def run(args: argparse.Namespace) -> None:
+    scheduler_module.upstream_scheduler_instance.max_concurrent_per_account = args.slots
+    await install_fake_backend(latency_seconds=args.latency_ms / 1000, tokens_per_second=0, response_tokens=20)
+    print(f"{'cenário (ms)':<27}{'quieta p50':>13}{'quieta máx':>13}{'ruidosa p50':>13}{'ruidosa máx':>13}")
+    await run_scenario("antes (FIFO)", FifoSlots, args.noisy, args.quiet, "interactive", 1.0)
+    await run_scenario("depois (fair, pesos 1:1)", scheduler_module._FairSlots, args.noisy, args.quiet, "interactive", 1.0)
+    await run_scenario("depois (fair, pesos 1:3)", scheduler_module._FairSlots, args.noisy, args.quiet, "interactive", 3.0)
+    await run_scenario("depois (ruidosa em batch)", scheduler_module._FairSlots, args.noisy, args.quiet, "batch", 1.0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--noisy", type=int, default=200, help="Requisições simultâneas da key ruidosa.")
+    parser.add_argument("--quiet", type=int, default=40, help="Requisições simultâneas da key quieta.")
+    parser.add_argument("--slots", type=int, default=4, help="Chamadas simultâneas por conta (SCHEDULER_MAX_CONCURRENT_PER_ACCOUNT).")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Duração de cada chamada ao upstream falso.")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Simula um deploy: sobe o servidor (uvicorn com o backend falso do Gemini) num subprocesso, mantém
+`--concurrency` clientes fazendo requisições em streaming e envia SIGTERM no meio da carga.
+Classifica cada requisição como completa (recebeu `[DONE]` sem erro), interrompida (stream cortado
+ou encerrado com erro) ou recusada (503 da drenagem ou conexão recusada: o balanceador a reenvia a
+outra réplica), e mede quanto o processo leva para sair.
+
+Compara o desligamento sem drenagem (SHUTDOWN_DRAIN_SECONDS=0: as requisições em andamento são
+cortadas no SIGTERM, como acontecia quando o orquestrador encerrava o processo) com a drenagem.
+
+Uso:
+    python -m benchmarks.graceful_shutdown --concurrency 32 --stream-seconds 2 --signal-after 3
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+API_KEY = "bench-key"
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, drain_seconds: float, stream_seconds: float) -> subprocess.Popen:
+    response_tokens = 100
+    env = {
+        **os.environ,
+        "GEMINI_BACKEND": "fake",
+        "ALLOWED_API_KEYS": f'["{API_KEY}"]',
+        "LOG_LEVEL": "WARNING",
+        "AUDIT_LOG_ENABLED": "false",
+        "CONFIG_RELOAD_ENABLED": "false",
+        "SESSION_MEMORY_SNAPSHOT_PATH": "",
+        "CONVERSATION_MODE": "stateless",
+        "SCHEDULER_MAX_CONCURRENT_PER_ACCOUNT": "100000",
+        "FAKE_GEMINI_LATENCY_SECONDS": "0.05",
+        "FAKE_GEMINI_RESPONSE_TOKENS": str(response_tokens),
+        "FAKE_GEMINI_TOKENS_PER_SECOND": str(response_tokens / stream_seconds),
+        "SHUTDOWN_DRAIN_SECONDS": str(drain_seconds),
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=PROJECT_ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_until_ready(client: httpx.AsyncClient, base_url: str) -> None:
+    for _ in range(200):
+        try:
+            if (await client.get(f"{base_url}/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.05)
+    raise RuntimeError("O servidor não ficou pronto.")
+
+
+async def stream_once(client: httpx.AsyncClient, base_url: str, index: int) -> str:
+    payload = {
+        "model": "gpt-4o-mini",
+        "messages": [{"role": "user", "content": f"pergunta {index}"}],
+        "stream": True,
+    }
+    started = False
+    try:
+        async with client.stream(
+            "POST", f"{base_url}/v1/chat/completions",
+            json=payload, headers={"Authorization": f"Bearer {API_KEY}"},
+        ) as response:
+            if response.status_code == 503:
+                return "recusada"
+            if response.status_code != 200:
+                return "interrompida"
+            body = b""
+            async for chunk in response.aiter_bytes():
+                started = True
+                body += chunk
+        if b'"error"' in body or not body.rstrip().endswith(b"data: [DONE]"):
+            return "interrompida"
+        return "completa"
+    except httpx.TransportError:
+        return "interrompida" if started else "recusada"
+
+
+async def client_loop(client: httpx.AsyncClient, base_url: str, worker: int, stop: asyncio.Event, outcomes: Counter) -> None:
+    index = 0
+    while not stop.is_set():
+        outcome = await stream_once(client, base_url, worker * 100000 + index)
+        outcomes[outcome] += 1
+        index += 1
+        if outcome == "recusada":
+            await asyncio.sleep(0.05) # Um cliente real tentaria outra réplica
+
+
+async def run_scenario(name: str, args: argparse.Namespace, drain_seconds: float) -> None:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = start_server(port, drain_seconds, args.stream_seconds)
+    outcomes: Counter = Counter()
+    stop = asyncio.Event()
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    try:
+        async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+            await wait_until_ready(client, base_url)
+            workers = [
+                asyncio.create_task(client_loop(client, base_url, worker, stop, outcomes))
+                for worker in range(args.concurrency)
+            ]
+            await asyncio.sleep(args.signal_after)
+            signaled_at = time.perf_counter()
+            server.send_signal(signal.SIGTERM)
+            while server.poll() is None and time.perf_counter() - signaled_at < args.kill_after:
+                await asyncio.sleep(0.05)
+            exit_seconds = time.perf_counter() - signaled_at
+            stop.set()
+            await asyncio.gather(*workers)
+    finally:
+        if server.poll() is None:
+            server.kill()
+            server.wait()
+    print(
+        f"{name:<26}{outcomes['completa']:>10}{outcomes['interrompida']:>14}"
+        f"{outcomes['recusada']:>11}{exit_seconds:>11.1f}"
+    )
+
+
+async def run(args: argparse.Namespace) -> None:
+    print(f"{args.concurrency} clientes, streams de ~{args.stream_seconds:.0f}s, SIGTERM após {args.signal_after:.0f}s")
+    print(f"{'cenário':<26}{'completas':>10}{'interrompidas':>14}{'recusadas':>11}{'saída (s)':>11}")
+    await run_scenario("antes (sem drenagem)", args, drain_seconds=0)
+    await run_scenario("depois (drenagem)", args, drain_seconds=args.drain_seconds)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=32, help="Clientes fazendo requisições em streaming.")
+    parser.add_argument("--stream-seconds", type=float, default=2.0, help="Duração de cada resposta do upstream falso.")
+    parser.add_argument("--signal-after", type=float, default=3.0, help="Segundos de carga antes do SIGTERM.")
+    parser.add_argument("--drain-seconds", type=float, default=25.0, help="SHUTDOWN_DRAIN_SECONDS do cenário com drenagem.")
+    parser.add_argument("--kill-after", type=float, default=30.0, help="SIGKILL se o processo não sair (como o orquestrador).")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
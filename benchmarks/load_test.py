@@ -0,0 +1,131 @@
+"""
+Teste de carga do endpoint /v1/chat/completions contra o backend falso do Gemini.
+
+Para cada modo (streaming e não-streaming) e cada nível de concorrência, envia `--requests`
+requisições com prompts distintos (sem cache nem single-flight) e reporta vazão, latência
+p50/p99, TTFB p50/p99, erros e RSS do processo. Serve de linha de base para comparar
+mudanças de desempenho: use `--json` para gravar os resultados e comparar entre versões.
+
+A latência e o ritmo de tokens do upstream falso são configuráveis; com `--latency-ms 0
+--tokens-per-second 0` o resultado mede apenas o overhead do próprio proxy.
+
+Uso:
+    python -m benchmarks.load_test --concurrency 1,8,32,128 --requests 200
+    python -m benchmarks.load_test --modes stream --latency-ms 0 --tokens-per-second 0 --json baseline.json
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import List, Dict, Any, Optional
+
+from benchmarks.common import install_fake_backend, call_chat_completions, current_rss_mb
+
+MODES = ("stream", "json")
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+async def run_level(mode: str, concurrency: int, total_requests: int, run_id: str) -> Dict[str, Any]:
+    results: List[Dict[str, Any]] = []
+    next_index = 0
+
+    async def worker() -> None:
+        nonlocal next_index
+        while next_index < total_requests:
+            index = next_index
+            next_index += 1
+            results.append(await call_chat_completions({
+                "model": "gpt-4o-mini",
+                "messages": [{"role": "user", "content": f"Pergunta {run_id}-{mode}-{concurrency}-{index}"}],
+                "stream": mode == "stream",
+            }))
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started_at
+
+    succeeded = [result for result in results if result["status"] == 200]
+    latencies = [result["total_ms"] for result in succeeded if result["total_ms"] is not None]
+    ttfbs = [result["ttfb_ms"] for result in succeeded if result["ttfb_ms"] is not None]
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(succeeded),
+        "throughput_rps": len(succeeded) / elapsed if elapsed > 0 else 0.0,
+        "latency_p50_ms": percentile(latencies, 0.50),
+        "latency_p99_ms": percentile(latencies, 0.99),
+        "ttfb_p50_ms": percentile(ttfbs, 0.50),
+        "ttfb_p99_ms": percentile(ttfbs, 0.99),
+        "rss_mb": current_rss_mb(),
+    }
+
+
+def _fmt(value: Optional[float]) -> str:
+    return f"{value:9.1f}" if value is not None else f"{'-':>9}"
+
+
+def print_row(row: Dict[str, Any]) -> None:
+    print(
+        f"{row['mode']:<7}{row['concurrency']:>6}{row['requests']:>7}{row['errors']:>7}"
+        f"{_fmt(row['throughput_rps'])}{_fmt(row['latency_p50_ms'])}{_fmt(row['latency_p99_ms'])}"
+        f"{_fmt(row['ttfb_p50_ms'])}{_fmt(row['ttfb_p99_ms'])}{_fmt(row['rss_mb'])}"
+    )
+
+
+async def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    await install_fake_backend(
+        latency_seconds=args.latency_ms / 1000,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        tokens_per_chunk=args.tokens_per_chunk,
+        error_rate=args.error_rate,
+    )
+    print(
+        f"{'modo':<7}{'conc':>6}{'reqs':>7}{'erros':>7}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}"
+        f"{'ttfb50':>9}{'ttfb99':>9}{'RSS MB':>9}"
+    )
+    run_id = f"{time.time():.0f}"
+    rows = []
+    for mode in args.modes:
+        for concurrency in args.concurrency:
+            row = await run_level(mode, concurrency, args.requests, run_id)
+            print_row(row)
+            rows.append(row)
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=lambda value: [int(part) for part in value.split(",")], default=[1, 8, 32, 128],
+                        help="Níveis de concorrência separados por vírgula.")
+    parser.add_argument("--requests", type=int, default=200, help="Requisições por nível de concorrência.")
+    parser.add_argument("--modes", type=lambda value: value.split(","), default=list(MODES),
+                        help="Modos separados por vírgula: stream, json.")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Latência do upstream falso até o primeiro token.")
+    parser.add_argument("--tokens-per-second", type=float, default=2000.0, help="Ritmo de geração do upstream falso (0 = instantâneo).")
+    parser.add_argument("--response-tokens", type=int, default=100, help="Palavras por resposta do upstream falso.")
+    parser.add_argument("--tokens-per-chunk", type=int, default=4, help="Palavras por parcial no streaming.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fração das chamadas ao upstream falso que falham.")
+    parser.add_argument("--json", dest="json_path", help="Grava os resultados neste arquivo JSON.")
+    args = parser.parse_args()
+    invalid_modes = set(args.modes) - set(MODES)
+    if invalid_modes:
+        parser.error(f"modos inválidos: {', '.join(sorted(invalid_modes))}")
+
+    rows = asyncio.run(run(args))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as output_file:
+            json.dump({"args": vars(args), "results": rows}, output_file, indent=2)
+        print(f"Resultados gravados em {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
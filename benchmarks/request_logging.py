@@ -0,0 +1,154 @@
+"""
+Mede o custo por requisição do log de requisições: sem middleware, o middleware anterior
+(`@app.middleware("http")` com f-strings e o formatador que inseria os valores no template) e o
+middleware ASGI atual com logs preguiçosos e template fixo. Cada variante atende um endpoint
+JSON e um endpoint SSE de `--chunks` partes, com LOG_LEVEL WARNING (logs descartados) e INFO
+(logs emitidos num sink nulo, de forma síncrona, para que o custo de formatação entre na conta).
+
+Uso:
+    python -m benchmarks.request_logging --requests 2000 --chunks 200
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from typing import Callable, Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from loguru import logger
+
+from benchmarks.common import app_main  # noqa: F401  (configura o ambiente padrão dos benchmarks)
+from app.core.logging_config import robust_log_formatter
+from app.core.request_logging import RequestLoggingMiddleware
+
+
+def legacy_log_formatter(record: dict) -> str:
+    """Formatador anterior: valores inseridos no template, que o Loguru reinterpretava a cada linha."""
+    request_id_val = record["extra"].get("request_id", "N/A")
+    log_parts = [
+        f"<green>{record['time']:%Y-%m-%d %H:%M:%S.%f%z}</green>",
+        f"<level>{record['level'].name: <8}</level>",
+        f"<cyan>{record['name']}</cyan>:<cyan>{record['function']}</cyan>:<cyan>{record['line']}</cyan>",
+        f"REQ_ID: <yellow>{request_id_val}</yellow>",
+        f"<level>{record['message']}</level>",
+    ]
+    return " | ".join(log_parts) + "\n"
+
+
+def install_legacy_middleware(app: FastAPI, log_level: str) -> None:
+    """Middleware anterior (BaseHTTPMiddleware), reproduzido para comparação."""
+
+    @app.middleware("http")
+    async def log_requests_responses(request: Request, call_next):
+        request_id = request.headers.get("X-Request-ID") or str(uuid.uuid4())
+        with logger.contextualize(request_id=request_id):
+            logger.info(f"Requisição recebida: {request.method} {request.url.path} (Cliente: {request.client.host if request.client else 'N/A'})")
+            if log_level == "DEBUG":
+                logger.debug(f"Headers da requisição: {dict(request.headers)}")
+            start_time = time.time()
+            response = await call_next(request)
+            process_time = (time.time() - start_time) * 1000
+            response.headers["X-Request-ID"] = request_id
+            log_message_suffix = f"(Tempo: {process_time:.2f}ms)"
+            if isinstance(response, StreamingResponse):
+                logger.info(f"Resposta enviada: {response.status_code} para {request.method} {request.url.path} (Streaming) {log_message_suffix}")
+            else:
+                logger.info(f"Resposta enviada: {response.status_code} para {request.method} {request.url.path} {log_message_suffix}")
+            return response
+
+
+def build_app(variant: str, chunks: int, log_level: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/json")
+    async def json_endpoint():
+        return {"object": "chat.completion", "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}}]}
+
+    @app.get("/stream")
+    async def stream_endpoint():
+        async def events():
+            for _ in range(chunks):
+                yield b'data: {"choices":[{"delta":{"content":"palavra "}}]}\n\n'
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    if variant == "antes":
+        install_legacy_middleware(app, log_level)
+    elif variant == "depois":
+        app.add_middleware(RequestLoggingMiddleware)
+    return app
+
+
+async def call(app: FastAPI, path: str) -> None:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"bench"), (b"user-agent", b"bench"), (b"accept", b"*/*")],
+        "client": ("127.0.0.1", 12345),
+        "server": ("127.0.0.1", 8000),
+    }
+    request_sent = False
+    finished = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and not message.get("more_body", False):
+            finished.set()
+
+    await app(scope, receive, send)
+
+
+async def measure(app: FastAPI, path: str, requests: int) -> float:
+    for _ in range(min(requests, 50)):  # Aquecimento
+        await call(app, path)
+    started_at = time.perf_counter()
+    for _ in range(requests):
+        await call(app, path)
+    return (time.perf_counter() - started_at) / requests * 1e6
+
+
+def configure_logger(formatter: Callable[[dict], str], log_level: str) -> None:
+    logger.remove()
+    logger.add(lambda message: None, format=formatter, level=log_level, colorize=True)
+
+
+async def run(requests: int, chunks: int) -> None:
+    formatters: Dict[str, Callable[[dict], str]] = {
+        "sem log": robust_log_formatter,
+        "antes": legacy_log_formatter,
+        "depois": robust_log_formatter,
+    }
+    print(f"{'nível':<9}{'variante':<10}{'JSON µs/req':>13}{f'SSE ({chunks}) µs/req':>20}")
+    for log_level in ("WARNING", "INFO"):
+        for variant, formatter in formatters.items():
+            configure_logger(formatter, log_level)
+            app = build_app(variant, chunks, log_level)
+            json_us = await measure(app, "/json", requests)
+            stream_us = await measure(app, "/stream", max(requests // 4, 1))
+            print(f"{log_level:<9}{variant:<10}{json_us:>13.1f}{stream_us:>20.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="Requisições por variante (o SSE usa 1/4).")
+    parser.add_argument("--chunks", type=int, default=200, help="Partes do corpo no endpoint SSE.")
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.chunks))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Compara o ChunkEncoder (prefixo/sufixo pré-montados) com a serialização Pydantic por chunk.
+
+Antes de medir, confere que a saída é idêntica byte a byte à de
+`ChatCompletionChunkResponse(...).model_dump_json(exclude_none=True)` para um conjunto de
+textos com aspas, barras, quebras de linha, caracteres de controle, acentos e emojis.
+Termina com código 1 se houver divergência.
+
+Uso:
+    python -m benchmarks.sse_encoder --words 2000 --rounds 20
+"""
+import argparse
+import sys
+import time
+
+from benchmarks.common import app_main  # noqa: F401  (configura o ambiente padrão dos benchmarks)
+from app.models.openai_schemas import ChatCompletionChunkResponse, StreamingChoice, DeltaMessage, Usage
+from app.utils.openai_formatter import ChunkEncoder
+
+SAMPLES = [
+    "palavra ",
+    "",
+    " ",
+    'aspas "duplas" e \'simples\'',
+    "barra \\ invertida e / normal",
+    "linha1\nlinha2\r\n\ttab",
+    "controles \x00\x01\x08\x0b\x0c\x1f\x7f",
+    "acentuação: ação, pão, você, Ünïcödé",
+    "emoji 🚀👩‍💻 e CJK 漢字",
+    "separadores     e BOM ﻿",
+    "</script><!-- html -->",
+    "data: [DONE]\n\n",
+]
+
+
+def pydantic_chunk(completion_id: str, model_name: str, created: int, text: str) -> str:
+    chunk = ChatCompletionChunkResponse(
+        id=completion_id,
+        model=model_name,
+        created=created,
+        choices=[StreamingChoice(index=0, delta=DeltaMessage(content=text), finish_reason=None)],
+    )
+    return f"data: {chunk.model_dump_json(exclude_none=True)}\n\n"
+
+
+def pydantic_finish(completion_id: str, model_name: str, created: int) -> str:
+    chunk = ChatCompletionChunkResponse(
+        id=completion_id,
+        model=model_name,
+        created=created,
+        choices=[StreamingChoice(index=0, delta=DeltaMessage(), finish_reason="stop")],
+    )
+    return f"data: {chunk.model_dump_json(exclude_none=True)}\n\n"
+
+
+def pydantic_usage(completion_id: str, model_name: str, created: int) -> str:
+    chunk = ChatCompletionChunkResponse(
+        id=completion_id,
+        model=model_name,
+        created=created,
+        choices=[],
+        usage=Usage(prompt_tokens=12, completion_tokens=34, total_tokens=46),
+    )
+    return f"data: {chunk.model_dump_json(exclude_none=True)}\n\n"
+
+
+def check_compatibility() -> bool:
+    ok = True
+    for completion_id, model_name in [("chatcmpl-abc123", "gpt-4o-mini"), ('id"\\', "modelo/ç\n")]:
+        encoder = ChunkEncoder(completion_id, model_name, 1700000000)
+        for text in SAMPLES:
+            expected = pydantic_chunk(completion_id, model_name, 1700000000, text)
+            if encoder.content(text) != expected:
+                ok = False
+                print(f"DIVERGÊNCIA em {text!r}:\n  esperado: {expected!r}\n  obtido:   {encoder.content(text)!r}")
+        if encoder.finish("stop") != pydantic_finish(completion_id, model_name, 1700000000):
+            ok = False
+            print("DIVERGÊNCIA no chunk final.")
+        if encoder.usage(12, 34) != pydantic_usage(completion_id, model_name, 1700000000):
+            ok = False
+            print("DIVERGÊNCIA no chunk de usage.")
+    return ok
+
+
+def measure(label: str, encode, words: int, rounds: int) -> float:
+    started_at = time.perf_counter()
+    for _ in range(rounds):
+        for i in range(words):
+            encode(f"palavra{i} ")
+    elapsed = time.perf_counter() - started_at
+    per_chunk_us = elapsed / (words * rounds) * 1e6
+    print(f"{label:<10} {per_chunk_us:8.2f} µs/chunk  ({words * rounds / elapsed:,.0f} chunks/s)")
+    return per_chunk_us
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=2000, help="Chunks por rodada.")
+    parser.add_argument("--rounds", type=int, default=20, help="Quantidade de rodadas.")
+    args = parser.parse_args()
+
+    if not check_compatibility():
+        sys.exit(1)
+    print(f"Saída idêntica à do Pydantic em {len(SAMPLES)} amostras.")
+
+    created = int(time.time())
+    encoder = ChunkEncoder("chatcmpl-bench", "gpt-4o-mini", created)
+    pydantic_us = measure("pydantic", lambda text: pydantic_chunk("chatcmpl-bench", "gpt-4o-mini", created, text), args.words, args.rounds)
+    encoder_us = measure("encoder", encoder.content, args.words, args.rounds)
+    print(f"Ganho: {pydantic_us / encoder_us:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
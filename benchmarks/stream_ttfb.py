@@ -0,0 +1,55 @@
+"""
+Mede o tempo até o primeiro byte (TTFB) do endpoint /v1/chat/completions com `stream: true`.
+
+Usa o backend falso do Gemini (GEMINI_BACKEND=fake), que gera a resposta de forma
+incremental (um pedaço a cada `--delay-ms`), e compara:
+  - o caminho de streaming real (`send_message_stream` disponível);
+  - o fallback sintético (upstream sem streaming, resposta fatiada depois de completa).
+
+Não acessa o Gemini real nem abre sockets: a aplicação é chamada diretamente via ASGI.
+
+Uso:
+    python -m benchmarks.stream_ttfb --chunks 40 --delay-ms 25
+"""
+import argparse
+import asyncio
+
+from benchmarks.common import install_fake_backend, call_chat_completions
+
+
+async def run(chunks: int, delay_ms: float) -> None:
+    delay = delay_ms / 1000
+    scenarios = [
+        ("streaming incremental", True),
+        ("fallback sintético", False),
+    ]
+    for label, streaming in scenarios:
+        # Cada cenário usa um client novo e, portanto, sua própria ChatSession falsa.
+        await install_fake_backend(
+            latency_seconds=0.0,
+            tokens_per_second=1 / delay if delay > 0 else 0.0,
+            response_tokens=chunks,
+            tokens_per_chunk=1,
+            streaming=streaming,
+        )
+        result = await call_chat_completions({
+            "model": "gpt-4o-mini",
+            "messages": [{"role": "user", "content": "Conte uma história."}],
+            "stream": True,
+        })
+        print(
+            f"{label:<24} status={result['status']} eventos={result['events']:<4} "
+            f"TTFB={result['ttfb_ms']:.1f}ms total={result['total_ms']:.1f}ms"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=40, help="Quantidade de pedaços gerados pelo upstream falso.")
+    parser.add_argument("--delay-ms", type=float, default=25.0, help="Intervalo entre pedaços do upstream falso.")
+    args = parser.parse_args()
+    asyncio.run(run(args.chunks, args.delay_ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Mede o custo dos contadores de tokens usados no `usage` (whitespace, heurístico e, se o pacote
+estiver instalado, tiktoken) em textos de 1 KB, 10 KB e 100 KB, com e sem o cache LRU usado
+para os prompts. Mostra também a contagem de cada um para o mesmo texto, para comparação.
+
+Depois mede o custo por resposta: o corte em `max_tokens` (antes, uma busca binária que recontava
+o texto a cada passo; agora, uma passada pelos pedaços) e a contagem do `usage` de um stream
+(antes, o texto inteiro recontado no fim; agora, cada delta contado uma vez ao passar).
+
+Uso:
+    python -m benchmarks.token_counter --rounds 50
+"""
+import argparse
+import time
+from functools import lru_cache
+from typing import List, Tuple
+
+from benchmarks.common import app_main  # noqa: F401  (configura o ambiente padrão dos benchmarks)
+from app.utils.token_counter import (
+    TokenCounter,
+    WhitespaceTokenCounter,
+    HeuristicTokenCounter,
+    TiktokenTokenCounter,
+    IncrementalTokenCount,
+    count_tokens,
+)
+
+SIZES_KB = (1, 10, 100)
+
+PARAGRAPH = (
+    "O proxy recebe requisições no formato da OpenAI, mantém uma sessão por conversa e repassa "
+    "os deltas do Gemini como eventos SSE. Contagens: 12345 tokens, 3.14159 e 2024-06-01! "
+    "Código: `def f(x): return x ** 2` — acentuação, emojis 🚀 e CJK 漢字 também aparecem.\n"
+)
+
+
+def sample_text(size_kb: int) -> str:
+    size = size_kb * 1024
+    return (PARAGRAPH * (size // len(PARAGRAPH) + 1))[:size]
+
+
+def available_counters(encoding_name: str) -> List[TokenCounter]:
+    counters: List[TokenCounter] = [WhitespaceTokenCounter(), HeuristicTokenCounter()]
+    try:
+        counters.append(TiktokenTokenCounter(encoding_name))
+    except Exception as e:
+        print(f"tiktoken indisponível ({e}); medindo só os contadores sem dependências.")
+    return counters
+
+
+def measure(count, text: str, rounds: int) -> Tuple[float, int]:
+    tokens = count(text)  # Aquecimento (e, com cache, primeira contagem)
+    started_at = time.perf_counter()
+    for _ in range(rounds):
+        count(text)
+    return (time.perf_counter() - started_at) / rounds * 1e6, tokens
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=50, help="Contagens por combinação de contador e tamanho.")
+    parser.add_argument("--encoding", default="cl100k_base", help="Encoding do tiktoken.")
+    args = parser.parse_args()
+
+    counters = available_counters(args.encoding)
+    print(f"{'contador':<12}{'texto':>8}{'tokens':>9}{'sem cache µs':>15}{'com cache µs':>15}")
+    for counter in counters:
+        cached_count = lru_cache(maxsize=16)(counter.count)
+        for size_kb in SIZES_KB:
+            text = sample_text(size_kb)
+            uncached_us, tokens = measure(counter.count, text, args.rounds)
+            cached_us, _ = measure(cached_count, text, args.rounds)
+            print(f"{counter.name:<12}{size_kb:>6}KB{tokens:>9}{uncached_us:>15.1f}{cached_us:>15.2f}")
+
+    print()
+    print(f"{'resposta (heurístico)':<34}{'texto':>8}{'antes µs':>12}{'depois µs':>12}")
+    heuristic = HeuristicTokenCounter()
+    for size_kb in SIZES_KB:
+        text = sample_text(size_kb)
+        budget = heuristic.count(text) // 2
+        before_us, _ = measure(lambda text: TokenCounter.count_prefix(heuristic, text, budget), text, args.rounds)
+        after_us, _ = measure(lambda text: heuristic.count_prefix(text, budget), text, args.rounds)
+        print(f"{'corte em max_tokens':<34}{size_kb:>6}KB{before_us:>12.0f}{after_us:>12.0f}")
+        deltas = [text[start:start + 16] for start in range(0, len(text), 16)]
+        before_us, _ = measure(lambda deltas: count_tokens("".join(deltas)), deltas, args.rounds)
+        after_us, _ = measure(stream_usage, deltas, args.rounds)
+        print(f"{'usage do stream (deltas de 16 chars)':<34}{size_kb:>6}KB{before_us:>12.0f}{after_us:>12.0f}")
+
+
+def stream_usage(deltas: List[str]) -> int:
+    completion_count = IncrementalTokenCount()
+    for delta in deltas:
+        completion_count.add(delta)
+    return completion_count.total
+
+
+if __name__ == "__main__":
+    main()
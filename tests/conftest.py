@@ -0,0 +1,43 @@
+"""
+Configuração compartilhada dos testes: o proxy roda com o backend falso do Gemini (ver
+`benchmarks/common.py`) e com o cache de respostas ligado. Os testes chamam a app via ASGI.
+
+Uso:
+    python -m pytest -q
+"""
+import os
+
+os.environ.setdefault("RESPONSE_CACHE_ENABLED", "true")
+os.environ.setdefault("ALLOWED_API_KEYS", '["bench-key", "key-a", "key-b"]')
+
+import httpx  # noqa: E402
+import pytest  # noqa: E402
+
+from benchmarks.common import API_KEY, app, install_fake_backend  # noqa: E402
+from app.services.fake_gemini import FakeChatSession  # noqa: E402
+
+
+def api_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app),
+        base_url="http://proxy",
+        headers={"Authorization": f"Bearer {API_KEY}"},
+    )
+
+
+@pytest.fixture
+def upstream_calls(monkeypatch):
+    """Lista com um item por chamada ao Gemini (falso) feita durante o teste."""
+    calls = []
+    send_message = FakeChatSession.send_message
+
+    async def counting_send_message(self, prompt, files=None, **kwargs):
+        calls.append(prompt)
+        return await send_message(self, prompt, files=files, **kwargs)
+
+    monkeypatch.setattr(FakeChatSession, "send_message", counting_send_message)
+    return calls
+
+
+async def setup_fake_backend(**fake_options):
+    return await install_fake_backend(**{"latency_seconds": 0.05, "tokens_per_second": 0, "response_tokens": 10, **fake_options})
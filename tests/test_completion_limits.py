@@ -0,0 +1,46 @@
+import asyncio
+import json
+import time
+import uuid
+
+from tests.conftest import api_client, setup_fake_backend
+
+
+def stream_events(response):
+    return [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line.startswith("data: {")]
+
+
+def test_streamed_max_tokens_matches_non_streaming_and_stops_upstream_early():
+    payload = {
+        "model": "gpt-4o-mini",
+        "messages": [{"role": "user", "content": f"pergunta {uuid.uuid4().hex}"}],
+        "max_tokens": 12,
+        "stream_options": {"include_usage": True},
+    }
+
+    async def scenario():
+        # 400 tokens a 100 tokens/s: sem o corte antecipado, o stream levaria 4 s.
+        await setup_fake_backend(latency_seconds=0.01, tokens_per_second=100, response_tokens=400, tokens_per_chunk=2)
+        async with api_client() as client:
+            started_at = time.perf_counter()
+            streamed = await client.post(
+                "/v1/chat/completions", json={**payload, "stream": True}, headers={"Cache-Control": "no-store"}
+            )
+            stream_seconds = time.perf_counter() - started_at
+            # O mesmo texto, sem esperar a geração: a resposta completa só serve de referência.
+            await setup_fake_backend(latency_seconds=0.01, response_tokens=400)
+            complete = await client.post("/v1/chat/completions", json=payload, headers={"Cache-Control": "no-store"})
+        return streamed, stream_seconds, complete
+
+    streamed, stream_seconds, complete = asyncio.run(scenario())
+
+    events = stream_events(streamed)
+    streamed_text = "".join(event["choices"][0]["delta"].get("content", "") for event in events if event["choices"])
+    finish_reasons = [event["choices"][0]["finish_reason"] for event in events if event["choices"] and event["choices"][0].get("finish_reason")]
+    complete_choice = complete.json()["choices"][0]
+
+    assert stream_seconds < 2
+    assert finish_reasons == ["length"]
+    assert streamed_text == complete_choice["message"]["content"]
+    assert complete_choice["finish_reason"] == "length"
+    assert events[-1]["usage"]["completion_tokens"] == complete.json()["usage"]["completion_tokens"] == 12
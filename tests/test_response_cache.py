@@ -0,0 +1,59 @@
+import asyncio
+import uuid
+
+from app.services.response_cache import CACHE_STATUS_HEADER
+from tests.conftest import api_client, setup_fake_backend
+
+
+def first_turn_payload(*roles):
+    # Conteúdo único por teste: o cache é compartilhado pelo processo.
+    marker = uuid.uuid4().hex
+    return {
+        "model": "gpt-4o-mini",
+        "messages": [{"role": role, "content": f"{role} {marker}"} for role in roles],
+    }
+
+
+def send_twice(payload):
+    async def scenario():
+        await setup_fake_backend()
+        async with api_client() as client:
+            first = await client.post("/v1/chat/completions", json=payload)
+            second = await client.post("/v1/chat/completions", json=payload)
+        return first, second
+
+    return asyncio.run(scenario())
+
+
+def test_repeated_first_turn_is_served_from_cache(upstream_calls):
+    first, second = send_twice(first_turn_payload("user"))
+
+    assert first.status_code == second.status_code == 200
+    assert first.headers[CACHE_STATUS_HEADER] == "MISS"
+    assert second.headers[CACHE_STATUS_HEADER] == "HIT"
+    assert second.json()["choices"][0]["message"]["content"] == first.json()["choices"][0]["message"]["content"]
+    assert len(upstream_calls) == 1
+
+
+def test_repeated_first_turn_with_system_prompt_is_served_from_cache(upstream_calls):
+    first, second = send_twice(first_turn_payload("system", "user"))
+
+    assert first.headers[CACHE_STATUS_HEADER] == "MISS"
+    assert second.headers[CACHE_STATUS_HEADER] == "HIT"
+    assert len(upstream_calls) == 1
+
+
+def test_cache_is_not_shared_across_conversations(upstream_calls):
+    payload = first_turn_payload("user")
+
+    async def scenario():
+        await setup_fake_backend()
+        async with api_client() as client:
+            return [
+                await client.post("/v1/chat/completions", json=payload, headers={"X-Conversation-ID": conversation_id})
+                for conversation_id in ("a", "b")
+            ]
+
+    first, second = asyncio.run(scenario())
+    assert first.headers[CACHE_STATUS_HEADER] == second.headers[CACHE_STATUS_HEADER] == "MISS"
+    assert len(upstream_calls) == 2
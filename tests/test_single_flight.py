@@ -0,0 +1,54 @@
+import asyncio
+import uuid
+
+from app.services.single_flight import COALESCED_HEADER
+from tests.conftest import api_client, setup_fake_backend
+
+CONCURRENT_REQUESTS = 5
+
+
+def test_concurrent_identical_first_turns_share_one_upstream_call(upstream_calls):
+    payload = {
+        "model": "gpt-4o-mini",
+        "messages": [{"role": "user", "content": f"pergunta {uuid.uuid4().hex}"}],
+    }
+
+    async def scenario():
+        await setup_fake_backend(latency_seconds=0.2)
+        async with api_client() as client:
+            # no-store: o cache fica de fora e só o agrupamento pode evitar chamadas repetidas.
+            return await asyncio.gather(*(
+                client.post("/v1/chat/completions", json=payload, headers={"Cache-Control": "no-store"})
+                for _ in range(CONCURRENT_REQUESTS)
+            ))
+
+    responses = asyncio.run(scenario())
+
+    assert [response.status_code for response in responses] == [200] * CONCURRENT_REQUESTS
+    assert len(upstream_calls) == 1
+    assert sum(COALESCED_HEADER in response.headers for response in responses) == CONCURRENT_REQUESTS - 1
+    assert len({response.json()["choices"][0]["message"]["content"] for response in responses}) == 1
+
+
+def test_concurrent_requests_from_different_api_keys_are_not_merged(upstream_calls):
+    payload = {
+        "model": "gpt-4o-mini",
+        "messages": [{"role": "user", "content": f"pergunta {uuid.uuid4().hex}"}],
+    }
+
+    async def scenario():
+        await setup_fake_backend(latency_seconds=0.2)
+        async with api_client() as client:
+            return await asyncio.gather(*(
+                client.post(
+                    "/v1/chat/completions",
+                    json=payload,
+                    headers={"Authorization": f"Bearer {api_key}", "Cache-Control": "no-store"},
+                )
+                for api_key in ("key-a", "key-b")
+            ))
+
+    responses = asyncio.run(scenario())
+
+    assert [response.status_code for response in responses] == [200, 200]
+    assert len(upstream_calls) == 2